@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from config import (
+    API_KEY_CACHE_MAX_ENTRIES,
+    API_KEY_CACHE_TTL_SECONDS,
+    API_KEY_CACHE_NEGATIVE_TTL_SECONDS,
+)
+
+# Canal de NOTIFY que emite el trigger de security.api_key_clients (ver database.init_db)
+API_KEYS_CHANNEL = "api_key_clients_changed"
+
+
+class ApiKeyCache:
+    """
+    Caché LRU acotada de API keys validadas.
+
+    - Keys válidas: se guarda el service_name durante ttl segundos.
+    - Keys inválidas: caché negativa con un TTL más corto para frenar reintentos con keys malas.
+    - Cualquier cambio en security.api_key_clients vacía la caché (invalidate).
+
+    Las keys se indexan por su hash SHA-256 para no mantener el secreto en claro en memoria.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, negative_ttl: float):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._entries = OrderedDict()   # hash -> (service_name | None, expira_en)
+        self._lock = threading.Lock()
+        # La generación cambia con cada invalidación. Sirve para descartar resultados
+        # leídos de la BD antes de una invalidación que llegó mientras tanto.
+        self._generation = 0
+        self._stats = {"hits": 0, "negative_hits": 0, "misses": 0, "invalidations": 0}
+
+    @staticmethod
+    def _hash(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, api_key: str):
+        """
+        Devuelve (encontrada, service_name).
+        service_name es None si la key está en la caché negativa.
+        """
+        key = self._hash(api_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats["misses"] += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            service_name = entry[0]
+            self._stats["hits" if service_name else "negative_hits"] += 1
+            return True, service_name
+
+    def put(self, api_key: str, service_name, generation: int):
+        """Guarda el resultado de la BD salvo que haya habido una invalidación desde que se leyó."""
+        ttl = self._ttl if service_name else self._negative_ttl
+        key = self._hash(api_key)
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (service_name, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, _payload=None):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "max_entries": self._max_entries}
+
+
+api_key_cache = ApiKeyCache(
+    max_entries=API_KEY_CACHE_MAX_ENTRIES,
+    ttl=API_KEY_CACHE_TTL_SECONDS,
+    negative_ttl=API_KEY_CACHE_NEGATIVE_TTL_SECONDS,
+)
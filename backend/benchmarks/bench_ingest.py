@@ -0,0 +1,124 @@
+"""
+Benchmark de la ingesta en raw.valencia_air_real_hourly.
+
+Compara la implementación anterior (DataFrame de pandas + INSERT ... ON CONFLICT con
+todas las filas como parámetros) con la ruta COPY de ingest.copy_ingest.
+Cada medición se hace dentro de una transacción que se deshace al final, así que
+no deja datos en la BD.
+
+Ejecutar dentro del contenedor del backend:
+    docker compose exec backend python benchmarks/bench_ingest.py --rows 10000
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import MetaData, Table
+from sqlalchemy.dialects.postgresql import insert
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import engine, async_engine  # noqa: E402
+from ingest import copy_ingest  # noqa: E402
+from main import AirQualityInbound  # noqa: E402
+
+
+def build_payload(n_rows: int) -> list[AirQualityInbound]:
+    """Genera mediciones sintéticas con objectid negativos para no chocar con datos reales."""
+    base = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    items = []
+    for i in range(n_rows):
+        items.append(AirQualityInbound(
+            objectid=-(i % 500) - 1,
+            fiwareid=f"BENCH_{i % 500}",
+            nombre=f"Estación benchmark {i % 500}",
+            direccion="BENCHMARK",
+            tipozona="Urbana",
+            tipoemisio="Tráfico",
+            calidad_am="Buena",
+            fecha_carg=(base + timedelta(hours=i // 500)).isoformat(),
+            so2=1.0, no2=20.5, o3=60.0, co=0.2, pm10=18.0, pm25=9.5,
+            geo_shape={"type": "Feature", "geometry": {"coordinates": [-0.37, 39.47], "type": "Point"}, "properties": {}},
+            geo_point_2d={"lon": -0.37, "lat": 39.47},
+        ))
+    return items
+
+
+def run_legacy(items) -> float:
+    """Ruta anterior: model_dump -> DataFrame -> dicts -> INSERT ... VALUES con todas las filas como parámetros."""
+    with engine.connect() as conn:
+        trans = conn.begin()
+        table = Table("valencia_air_real_hourly", MetaData(), schema="raw", autoload_with=conn)
+        start = time.perf_counter()
+
+        df = pd.DataFrame([item.model_dump() for item in items])
+        df["fecha_carg"] = pd.to_datetime(df["fecha_carg"])
+        df = df[[col for col in df.columns if col in table.c]]   # los metadatos de estación ya no van por fila
+        data = df.to_dict(orient="records")
+
+        # PostgreSQL admite como máximo 65535 parámetros por sentencia: con lotes grandes la
+        # implementación anterior fallaba, así que aquí se trocea en el mayor tamaño posible
+        chunk = 65535 // len(df.columns)
+        for i in range(0, len(data), chunk):
+            stmt = insert(table).values(data[i:i + chunk])
+            stmt = stmt.on_conflict_do_nothing(index_elements=["objectid", "fecha_carg"])
+            conn.execute(stmt)
+
+        elapsed = time.perf_counter() - start
+        trans.rollback()
+    return elapsed
+
+
+async def run_copy(items, repeat: int) -> tuple[float, float]:
+    """
+    Ruta COPY: primera pasada con filas nuevas y segunda pasada solo con duplicados.
+    Retorna el mejor tiempo de cada pasada.
+    """
+    best_new, best_dup = float("inf"), float("inf")
+    for _ in range(repeat):
+        async with async_engine.connect() as conn:
+            trans = await conn.begin()
+
+            start = time.perf_counter()
+            await copy_ingest(conn, items)
+            best_new = min(best_new, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            _, duplicados = await copy_ingest(conn, items)
+            best_dup = min(best_dup, time.perf_counter() - start)
+
+            await trans.rollback()
+        assert duplicados == len(items), "La segunda pasada debería ser 100% duplicados"
+
+    await async_engine.dispose()
+    return best_new, best_dup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Número de filas por lote")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se toma la mejor)")
+    args = parser.parse_args()
+
+    items = build_payload(args.rows)
+
+    legacy = min(run_legacy(items) for _ in range(args.repeat))
+    copy_new, copy_dup = asyncio.run(run_copy(items, args.repeat))
+
+    print(f"Filas por lote: {args.rows}")
+    print(f"{'Implementación':<28}{'segundos':>10}{'filas/s':>14}")
+    for name, elapsed in [
+        ("pandas + INSERT (anterior)", legacy),
+        ("COPY (filas nuevas)", copy_new),
+        ("COPY (todo duplicados)", copy_dup),
+    ]:
+        print(f"{name:<28}{elapsed:>10.3f}{args.rows / elapsed:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
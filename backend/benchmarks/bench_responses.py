@@ -0,0 +1,118 @@
+"""
+Microbenchmark de la serialización de respuestas con filas de marts.fct_air_quality_hourly.
+
+Compara la implementación anterior (bucle valor a valor con math.isnan/isinf +
+JSONResponse de FastAPI, que pasa por jsonable_encoder y json estándar) con la
+utilidad compartida de responses.py (saneado por columnas con numpy + orjson).
+No necesita base de datos: las filas se generan en memoria con un ~5% de NaN/Inf.
+
+Ejecutar dentro del contenedor del backend:
+    docker compose exec backend python benchmarks/bench_responses.py --rows 5000
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from responses import FastJSONResponse, dumps_ndjson, sanitize_rows  # noqa: E402
+
+KEYS = (
+    "fecha_hora", "ciudad", "id_estacion", "nombre_estacion",
+    "promedio_no2", "promedio_pm10", "promedio_pm25", "promedio_so2",
+    "promedio_ozono", "promedio_co", "total_mediciones_hora",
+)
+
+
+def build_rows(n_rows: int) -> list[tuple]:
+    """Filas con la forma de fct_air_quality_hourly (tuplas, como llegan del driver)."""
+    rnd = random.Random(42)
+    base = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def valor():
+        r = rnd.random()
+        if r < 0.03:
+            return float("nan")
+        if r < 0.05:
+            return float("inf")
+        if r < 0.10:
+            return None
+        return round(rnd.uniform(0, 120), 2)
+
+    return [
+        (base - timedelta(hours=i // 20), "Valencia", i % 20 + 1, f"Estación {i % 20 + 1}",
+         valor(), valor(), valor(), valor(), valor(), valor(), rnd.randint(1, 4))
+        for i in range(n_rows)
+    ]
+
+
+def legacy_records(rows) -> list[dict]:
+    """rows_to_records anterior: dict por fila y comprobación valor a valor."""
+    records = [dict(zip(KEYS, row)) for row in rows]
+    for row in records:
+        for k, v in row.items():
+            if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
+                row[k] = None
+    return records
+
+
+def legacy_json(rows) -> bytes:
+    return JSONResponse(jsonable_encoder(legacy_records(rows))).body
+
+
+def fast_json(rows) -> bytes:
+    return FastJSONResponse(sanitize_rows(KEYS, rows)).body
+
+
+def legacy_ndjson(rows) -> bytes:
+    lines = [json.dumps(record, default=str) for record in legacy_records(rows)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def fast_ndjson(rows) -> bytes:
+    return dumps_ndjson(sanitize_rows(KEYS, rows))
+
+
+def best_of(fn, rows, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="Filas por respuesta")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones (se toma la mejor)")
+    args = parser.parse_args()
+
+    rows = build_rows(args.rows)
+
+    # Ambas rutas deben producir el mismo contenido
+    assert json.loads(legacy_json(rows)) == json.loads(fast_json(rows))
+
+    print(f"Filas por respuesta: {args.rows}")
+    print(f"{'Implementación':<36}{'ms':>10}{'filas/s':>14}")
+    for name, fn in [
+        ("JSON: bucle + jsonable_encoder", legacy_json),
+        ("JSON: numpy + orjson", fast_json),
+        ("NDJSON: bucle + json.dumps", legacy_ndjson),
+        ("NDJSON: numpy + orjson", fast_ndjson),
+    ]:
+        elapsed = best_of(fn, rows, args.repeat)
+        print(f"{name:<36}{elapsed * 1000:>10.2f}{args.rows / elapsed:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Benchmark de los formatos de envío de /api/ingest (ver payloads.py).
+
+Para cada formato mide los bytes que viajan por la red por cada 10.000 filas y el
+tiempo de CPU del backend en decodificar el cuerpo (descompresión + parseo) y validarlo
+con AirQualityInbound, que es lo que cambia entre formatos (el COPY posterior es el mismo;
+ver bench_ingest.py). Los lotes se codifican igual que en ingestion/utils.py. No necesita
+base de datos.
+
+Ejecutar dentro del contenedor del backend:
+    docker compose exec backend python benchmarks/bench_transport.py --rows 10000
+"""
+
+import argparse
+import gzip
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import msgpack
+import orjson
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from main import INGEST_ADAPTER  # noqa: E402
+from payloads import decode_ingest_body  # noqa: E402
+
+FORMATS = ("json", "json+gzip", "msgpack", "msgpack+gzip")
+
+
+def build_records(n_rows: int) -> list[dict]:
+    """Registros con la misma forma que devuelve la API de Valencia (incluido geo_shape)."""
+    base = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    records = []
+    for i in range(n_rows):
+        station = i % 500
+        lon, lat = -0.37 - station / 10000, 39.47 + station / 10000
+        records.append({
+            "objectid": -station - 1,
+            "nombre": f"Estación benchmark {station}",
+            "direccion": f"Calle del benchmark, {station}",
+            "tipozona": "Urbana",
+            "parametros": "NO2, O3, PM10, PM2.5, SO2, CO",
+            "mediciones": "https://valencia.opendatasoft.com/explore/dataset/estacions-contaminacio-atmosferiques",
+            "so2": 1.0, "no2": 20.5 + station % 7, "o3": 60.0, "co": 0.2, "pm10": 18.0, "pm25": 9.5,
+            "tipoemisio": "Tráfico",
+            "fecha_carg": (base + timedelta(hours=i // 500)).isoformat(),
+            "calidad_am": "Razonablemente Buena",
+            "fiwareid": f"A{station:02d}_BENCHMARK_60m",
+            "geo_shape": {
+                "type": "Feature",
+                "geometry": {"coordinates": [lon, lat], "type": "Point"},
+                "properties": {},
+            },
+            "geo_point_2d": {"lon": lon, "lat": lat},
+        })
+    return records
+
+
+def encode(records: list[dict], fmt: str) -> tuple[bytes, str, str | None]:
+    """Misma codificación que f_codificar_lote de la ingesta. Retorna (cuerpo, content-type, content-encoding)."""
+    if fmt == "json":
+        return orjson.dumps(records), "application/json", None
+
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    columnar = {"columns": columns, "rows": [[record.get(c) for c in columns] for record in records]}
+
+    serialization, _, compression = fmt.partition("+")
+    if serialization == "msgpack":
+        body, content_type = msgpack.packb(columnar), "application/msgpack"
+    else:
+        body, content_type = orjson.dumps(columnar), "application/json"
+
+    if compression == "gzip":
+        return gzip.compress(body, compresslevel=6), content_type, "gzip"
+    return body, content_type, None
+
+
+def server_cpu(body: bytes, content_type: str, content_encoding: str | None, repeat: int) -> tuple[float, float]:
+    """Mejor tiempo de CPU (s) de decodificar y de decodificar + validar el cuerpo."""
+    best_decode, best_total = float("inf"), float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        records = decode_ingest_body(body, content_type, content_encoding)
+        decoded = time.process_time()
+        INGEST_ADAPTER.validate_python(records)
+        end = time.process_time()
+        best_decode = min(best_decode, decoded - start)
+        best_total = min(best_total, end - start)
+    return best_decode, best_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="Número de filas por lote")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones (se toma la mejor)")
+    args = parser.parse_args()
+
+    records = build_records(args.rows)
+    per_10k = 10000 / args.rows
+
+    print(f"Filas por lote: {args.rows} (bytes y CPU normalizados a 10.000 filas)")
+    print(f"{'Formato':<16}{'KiB/10k':>12}{'vs json':>10}{'decode ms':>12}{'+valid. ms':>12}")
+    json_size = None
+    for fmt in FORMATS:
+        body, content_type, content_encoding = encode(records, fmt)
+        decode_s, total_s = server_cpu(body, content_type, content_encoding, args.repeat)
+        size = len(body) * per_10k
+        json_size = json_size or size
+        print(
+            f"{fmt:<16}{size / 1024:>12,.1f}{size / json_size:>10.0%}"
+            f"{decode_s * per_10k * 1000:>12.1f}{total_s * per_10k * 1000:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
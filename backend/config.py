@@ -1,5 +1,6 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
 
 # 1. Configuración de la Base de Datos
 # Sacamos los datos de las variables de entorno definidas en el docker-compose / .env
@@ -12,6 +13,45 @@ DB_NAME = os.getenv("POSTGRES_DB")
 # Construimos la URL de conexión
 DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+# URL sin dialecto de SQLAlchemy para conexiones psycopg directas (LISTEN/NOTIFY)
+DATABASE_DSN = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
 # Creamos el motor. 
 # pool_pre_ping=True ayuda a recuperar la conexión si se corta.
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
\ No newline at end of file
+engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+
+# 2. Caché de API keys (por worker de uvicorn)
+# Las entradas se invalidan al instante vía NOTIFY cuando cambia security.api_key_clients;
+# el TTL solo acota el tiempo máximo de una entrada si se perdiera la escucha.
+API_KEY_CACHE_MAX_ENTRIES = int(os.getenv("API_KEY_CACHE_MAX_ENTRIES", "1024"))
+API_KEY_CACHE_TTL_SECONDS = float(os.getenv("API_KEY_CACHE_TTL_SECONDS", "300"))
+API_KEY_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("API_KEY_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+
+# 3. Motor asíncrono para los endpoints de FastAPI
+# Usa el mismo driver psycopg (modo async), así las consultas no bloquean el event loop
+# y la concurrencia queda limitada por el tamaño del pool, no por el worker.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "5"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+async_engine = create_async_engine(
+    DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=True,
+    connect_args={
+        "connect_timeout": DB_CONNECT_TIMEOUT_SECONDS,
+        "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}",
+    },
+)
+
+# 4. Caché de respuestas de endpoints que leen de marts.* (invalidada por la generación de dbt)
+MART_CACHE_MAX_ENTRIES = int(os.getenv("MART_CACHE_MAX_ENTRIES", "2048"))
+
+# 5. Carga de históricos al arrancar: procesos que parsean los CSV en paralelo
+HISTORICAL_LOAD_WORKERS = int(os.getenv("HISTORICAL_LOAD_WORKERS", str(os.cpu_count() or 2)))
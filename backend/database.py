@@ -1,115 +1,190 @@
-from sqlalchemy import text, types
-from config import engine # Importamos el engine centralizado
+from sqlalchemy import text
+from config import engine, DATABASE_DSN, HISTORICAL_LOAD_WORKERS # Importamos el engine centralizado
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
 import time
 import pandas as pd
+import psycopg
 import os
 from pathlib import Path
-
-# Diccionario con los metadatos de cada estación (basado en la API de Valencia)
-# La clave es el objectid (nombre del archivo CSV)
-
-STATIONS_METADATA = {
-    12: {
-        "nombre": "Dr. Lluch",
-        "direccion": "DR.LLUCH",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A08_DR_LLUCH_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.328289489402739, 39.4666847554611], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.328289489402739, "lat": 39.4666847554611}
-    },
-    13: {
-        "nombre": "Francia",
-        "direccion": "AVDA.FRANCIA",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A01_AVFRANCIA_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.342986232422652, 39.4578268875183], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.342986232422652, "lat": 39.4578268875183}
-    },
-    14: {
-        "nombre": "Boulevar Sur",
-        "direccion": "BULEVARD SUD",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A02_BULEVARDSUD_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.396337564375856, 39.4503960055054], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.396337564375856, "lat": 39.4503960055054}
-    },
-    15: {
-        "nombre": "Molí del Sol",
-        "direccion": "MOLÍ DEL SOL",
-        "tipozona": "Suburbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A03_MOLISOL_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.408809896900938, 39.4811121109041], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.408809896900938, "lat": 39.4811121109041}
-    },
-    16: {
-        "nombre": "Pista de Silla",
-        "direccion": "PISTA DE SILLA",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A04_PISTASILLA_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.376643936579157, 39.4580609536967], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.376643936579157, "lat": 39.4580609536967}
-    },
-    17: {
-        "nombre": "Universidad Politécnica",
-        "direccion": "POLITÈCNIC",
-        "tipozona": "Suburbana",
-        "tipoemisio": "Fondo",
-        "fiwareid": "A05_POLITECNIC_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.337400660521869, 39.4796444969292], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.337400660521869, "lat": 39.4796444969292}
-    },
-    18: {
-        "nombre": "Viveros",
-        "direccion": "VIVERS",
-        "tipozona": "Urbana",
-        "tipoemisio": "Fondo",
-        "fiwareid": "A06_VIVERS_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.36964822314381, 39.4796409248053], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.36964822314381, "lat": 39.4796409248053}
-    },
-    19: {
-        "nombre": "Centro",
-        "direccion": "VALÈNCIA CENTRE",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A07_VALENCIACENTRE_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.376397651655324, 39.4705476702601], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.376397651655324, "lat": 39.4705476702601}
-    },
-    20: {
-        "nombre": "Cabanyal",
-        "direccion": "CABANYAL",
-        "tipozona": "Urbana",
-        "tipoemisio": "Fondo",
-        "fiwareid": "A09_CABANYAL_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.328534813492744, 39.4743907853568], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.328534813492744, "lat": 39.4743907853568}
-    },
-    21: {
-        "nombre": "Olivereta",
-        "direccion": "OLIVERETA",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A10_OLIVERETA_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.405923445529068, 39.469244235092], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.405923445529068, "lat": 39.469244235092}
-    },
-    22: {
-        "nombre": "Patraix",
-        "direccion": "PATRAIX",
-        "tipozona": "Urbana",
-        "tipoemisio": "Tráfico",
-        "fiwareid": "A11_PATRAIX_60m",
-        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.401411329219129, 39.4591890899964], "type": "Point"}, "properties": {}},
-        "geo_point_2d": {"lon": -0.401411329219129, "lat": 39.4591890899964}
-    },
+from stations import SEED_STATIONS_SQL, STATIONS_METADATA, UPSERT_STATIONS_SQL, station_row
+
+# --- PARTICIONADO DE LAS TABLAS RAW ---
+#
+# Las tablas raw se particionan por rango sobre la fecha de medición para que las
+# consultas acotadas en el tiempo (staging, dedup, API) solo lean las particiones
+# afectadas. Las horarias van por meses y la diaria por años (unas decenas de filas
+# al mes por estación no justifican una partición mensual).
+# Tabla -> (columna de partición, granularidad)
+RAW_PARTITIONED_TABLES = {
+    "valencia_air_real_hourly": ("fecha_carg", "month"),
+    "valencia_air_historical_simulated_hourly": ("fecha_carg", "month"),
+    "valencia_air_historical_real_daily": ("fecha_medicion", "year"),
 }
 
+# Particiones futuras que se dejan creadas al arrancar (la ingesta crea las que falten)
+PARTITIONS_AHEAD_MONTHS = 3
+
+# Crea las particiones (tabla_pAAAAMM / tabla_pAAAA, límites en UTC) que cubren [desde, hasta].
+# Si la partición DEFAULT tiene filas de ese rango se mueven a la nueva antes de enlazarla.
+# El camino habitual (todas existen) no toma ningún lock; solo se serializa quien tenga que crear.
+_ENSURE_PARTITIONS_FUNCTION = """
+    CREATE OR REPLACE FUNCTION raw.asegurar_particiones(
+        tabla regclass, desde timestamptz, hasta timestamptz, granularidad text DEFAULT 'month'
+    ) RETURNS integer LANGUAGE plpgsql AS $$
+    DECLARE
+        esquema text;
+        nombre text;
+        clave text;
+        defecto regclass;
+        particion text;
+        inicio timestamptz;
+        fin timestamptz;
+        creadas integer := 0;
+    BEGIN
+        SELECT n.nspname, c.relname INTO esquema, nombre
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.oid = tabla;
+
+        SELECT a.attname INTO clave
+        FROM pg_partitioned_table p
+        JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+        WHERE p.partrelid = tabla;
+
+        defecto := to_regclass(format('%I.%I', esquema, nombre || '_default'));
+        inicio := date_trunc(granularidad, desde AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+
+        WHILE inicio <= hasta LOOP
+            fin := ((inicio AT TIME ZONE 'UTC') + ('1 ' || granularidad)::interval) AT TIME ZONE 'UTC';
+            particion := nombre || '_p' || to_char(
+                inicio AT TIME ZONE 'UTC', CASE granularidad WHEN 'year' THEN 'YYYY' ELSE 'YYYYMM' END
+            );
+
+            IF to_regclass(format('%I.%I', esquema, particion)) IS NULL THEN
+                PERFORM pg_advisory_xact_lock(tabla::oid::bigint);
+                IF to_regclass(format('%I.%I', esquema, particion)) IS NULL THEN
+                    EXECUTE format('CREATE TABLE %I.%I (LIKE %s INCLUDING DEFAULTS)', esquema, particion, tabla);
+                    IF defecto IS NOT NULL THEN
+                        EXECUTE format(
+                            'WITH movidas AS (DELETE FROM %s WHERE %I >= $1 AND %I < $2 RETURNING *) '
+                            'INSERT INTO %I.%I SELECT * FROM movidas',
+                            defecto, clave, clave, esquema, particion
+                        ) USING inicio, fin;
+                    END IF;
+                    EXECUTE format(
+                        'ALTER TABLE %s ATTACH PARTITION %I.%I FOR VALUES FROM (%L) TO (%L)',
+                        tabla, esquema, particion, inicio, fin
+                    );
+                    creadas := creadas + 1;
+                END IF;
+            END IF;
+
+            inicio := fin;
+        END LOOP;
+
+        RETURN creadas;
+    END;
+    $$;
+"""
+
+
+# Columnas de estación que las tablas raw guardaban por fila antes de existir raw.estaciones
+LEGACY_STATION_COLUMNS = ("nombre", "direccion", "tipozona", "tipoemisio", "fiwareid", "geo_shape", "geo_point_2d")
+
+
+def _move_station_columns(conn, table: str):
+    """
+    Si la tabla raw aún guarda los metadatos de estación por fila, vuelca a raw.estaciones
+    los de la fila más reciente de cada estación (sin pisar los que ya existan) y elimina
+    esas columnas. Las filas antiguas liberan el espacio al reescribirse (VACUUM FULL).
+    """
+    schema, name = table.split(".")
+    has_columns = conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = :name AND column_name = 'geo_point_2d'
+        )
+    """), {"schema": schema, "name": name}).scalar()
+    if not has_columns:
+        return
+
+    conn.execute(text(f"""
+        INSERT INTO raw.estaciones (objectid, nombre, direccion, tipozona, tipoemisio, fiwareid, latitud, longitud, geo_shape)
+        SELECT DISTINCT ON (objectid)
+            objectid, nombre, direccion, tipozona, tipoemisio, fiwareid,
+            (geo_point_2d->>'lat')::DOUBLE PRECISION, (geo_point_2d->>'lon')::DOUBLE PRECISION, geo_shape
+        FROM {table}
+        WHERE objectid IS NOT NULL
+        ORDER BY objectid, ingested_at DESC
+        ON CONFLICT (objectid) DO NOTHING
+    """))
+    drops = ", ".join(f"DROP COLUMN IF EXISTS {col}" for col in LEGACY_STATION_COLUMNS)
+    conn.execute(text(f"ALTER TABLE {table} {drops}"))
+    print(f"✅ {table}: metadatos de estación movidos a raw.estaciones")
+
+
+def _create_partitioned_table(conn, table_name: str, create_sql: str):
+    """
+    Crea la tabla raw particionada, su partición DEFAULT y las de los próximos meses.
+    Si existe una versión antigua sin particionar la migra: se renombra, se liberan los
+    nombres de sus índices, restricciones y secuencia, se copian sus filas y se borra.
+    Todo ocurre en la transacción de init_db: si algo falla no queda nada a medias.
+    """
+    key, granularity = RAW_PARTITIONED_TABLES[table_name]
+    relkind = conn.execute(text("""
+        SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'raw' AND c.relname = :table_name
+    """), {"table_name": table_name}).scalar()
+
+    legacy = None
+    if relkind == "r":
+        legacy = f"{table_name}_sin_particionar"
+        print(f"🔄 Migrando raw.{table_name} a tabla particionada...")
+        conn.execute(text(f"ALTER TABLE raw.{table_name} RENAME TO {legacy}"))
+        constraints = conn.execute(text(
+            f"SELECT conname FROM pg_constraint WHERE conrelid = 'raw.{legacy}'::regclass"
+        )).scalars().all()
+        for constraint in constraints:
+            conn.execute(text(f'ALTER TABLE raw.{legacy} DROP CONSTRAINT "{constraint}"'))
+        indexes = conn.execute(text(
+            f"SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = 'raw.{legacy}'::regclass"
+        )).scalars().all()
+        for index in indexes:
+            conn.execute(text(f"DROP INDEX {index}"))
+        conn.execute(text(f"ALTER SEQUENCE IF EXISTS raw.{table_name}_id_seq RENAME TO {legacy}_id_seq"))
+
+    conn.execute(text(create_sql))
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS raw.{table_name}_default PARTITION OF raw.{table_name} DEFAULT"))
+    conn.execute(text("""
+        SELECT raw.asegurar_particiones(CAST(:table AS regclass), now(), now() + make_interval(months => :ahead), :granularity)
+    """), {"table": f"raw.{table_name}", "ahead": PARTITIONS_AHEAD_MONTHS, "granularity": granularity})
+
+    if legacy:
+        _move_station_columns(conn, f"raw.{legacy}")
+        conn.execute(text(f"""
+            SELECT raw.asegurar_particiones('raw.{table_name}', min({key}), max({key}), :granularity)
+            FROM raw.{legacy}
+        """), {"granularity": granularity})
+        # Las filas sin fecha nunca llegaban a staging
+        columns = ", ".join(conn.execute(text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = 'raw' AND table_name = :table_name
+            ORDER BY ordinal_position
+        """), {"table_name": table_name}).scalars().all())
+        moved = conn.execute(text(
+            f"INSERT INTO raw.{table_name} ({columns}) SELECT {columns} FROM raw.{legacy} WHERE {key} IS NOT NULL"
+        )).rowcount
+        conn.execute(text(f"""
+            SELECT setval(pg_get_serial_sequence('raw.{table_name}', 'id'), COALESCE(max(id), 0) + 1, false)
+            FROM raw.{table_name}
+        """))
+        conn.execute(text(f"DROP TABLE raw.{legacy}"))
+        print(f"✅ raw.{table_name}: {moved} filas migradas a particiones")
+    else:
+        # Tabla ya particionada de una versión anterior con los metadatos por fila
+        _move_station_columns(conn, f"raw.{table_name}")
+
+
 def init_db():
     """Inicializa la infraestructura de la base de datos (esquemas y tablas)."""
     for i in range(10):
@@ -127,16 +202,35 @@ def init_db():
                 conn.execute(text("CREATE SCHEMA IF NOT EXISTS marts;"))
                 conn.execute(text("CREATE SCHEMA IF NOT EXISTS alerts;"))
                 conn.execute(text("CREATE SCHEMA IF NOT EXISTS security;"))
+                conn.execute(text("CREATE SCHEMA IF NOT EXISTS monitoring;"))
 
-                # 2. Tabla para Valencia (datos en tiempo real de la API)
+                # Función que crea particiones bajo demanda (la usan init_db, las cargas y la ingesta)
+                conn.execute(text(_ENSURE_PARTITIONS_FUNCTION))
+
+                # Dimensión de estaciones: las tablas de mediciones solo guardan el objectid
+                # (la rellenan /api/ingest y las cargas de históricos, ver stations.py)
                 conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS raw.valencia_air_real_hourly (
-                        id SERIAL PRIMARY KEY,
-                        ingested_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
-                        objectid INTEGER,
+                    CREATE TABLE IF NOT EXISTS raw.estaciones (
+                        objectid INTEGER PRIMARY KEY,
                         nombre VARCHAR(255),
                         direccion TEXT,
                         tipozona VARCHAR(100),
+                        tipoemisio VARCHAR(100),
+                        fiwareid VARCHAR(255),
+                        latitud DOUBLE PRECISION,
+                        longitud DOUBLE PRECISION,
+                        geo_shape JSONB,
+                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    );
+                """))
+
+                # 2. Tabla para Valencia (datos en tiempo real de la API), particionada por mes de fecha_carg
+                # La clave de partición tiene que formar parte de la PK y de las restricciones UNIQUE
+                _create_partitioned_table(conn, "valencia_air_real_hourly", """
+                    CREATE TABLE IF NOT EXISTS raw.valencia_air_real_hourly (
+                        id SERIAL,
+                        ingested_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                        objectid INTEGER,
                         parametros TEXT,
                         mediciones TEXT,
                         so2 NUMERIC,
@@ -145,48 +239,38 @@ def init_db():
                         co NUMERIC,
                         pm10 NUMERIC,
                         pm25 NUMERIC,
-                        tipoemisio VARCHAR(100),
-                        fecha_carg TIMESTAMPTZ,
+                        fecha_carg TIMESTAMPTZ NOT NULL,
                         calidad_am VARCHAR(100),
-                        fiwareid VARCHAR(255),
-                        geo_shape JSONB,
-                        geo_point_2d JSONB,
+                        PRIMARY KEY (id, fecha_carg),
                         UNIQUE(objectid, fecha_carg)
-                    );
-                """))
+                    ) PARTITION BY RANGE (fecha_carg);
+                """)
 
                 # 3. Tabla para datos históricos reales diarios de Valencia del 01/01/2014 al 31/10/2025 (cargados desde los CSV de la ruta historical/real)
-                conn.execute(text("""
+                # Particionada por año de fecha_medicion
+                _create_partitioned_table(conn, "valencia_air_historical_real_daily", """
                     CREATE TABLE IF NOT EXISTS raw.valencia_air_historical_real_daily (
-                        id SERIAL PRIMARY KEY,
+                        id SERIAL,
                         ingested_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
                         objectid INTEGER,
-                        nombre VARCHAR(255),
-                        direccion TEXT,
-                        tipozona VARCHAR(100),
-                        tipoemisio VARCHAR(100),
-                        fiwareid VARCHAR(255),
-                        fecha_medicion TIMESTAMPTZ,
+                        fecha_medicion TIMESTAMPTZ NOT NULL,
                         so2 NUMERIC,
                         no2 NUMERIC,
                         o3 NUMERIC,
                         co NUMERIC,
                         pm10 NUMERIC,
                         pm25 NUMERIC,
-                        geo_shape JSONB,
-                        geo_point_2d JSONB
-                    );
-                """))
+                        PRIMARY KEY (id, fecha_medicion)
+                    ) PARTITION BY RANGE (fecha_medicion);
+                """)
 
                 # 4. Tabla para datos históricos simulados horarios de Valencia del 01/01/2025 al 31/01/2026 (cargados desde los CSV de la ruta historical/simulated)
-                conn.execute(text("""
+                # Particionada por mes de fecha_carg
+                _create_partitioned_table(conn, "valencia_air_historical_simulated_hourly", """
                     CREATE TABLE IF NOT EXISTS raw.valencia_air_historical_simulated_hourly (
-                        id SERIAL PRIMARY KEY,
+                        id SERIAL,
                         ingested_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
                         objectid INTEGER,
-                        nombre VARCHAR(255),
-                        direccion TEXT,
-                        tipozona VARCHAR(100),
                         parametros TEXT,
                         mediciones TEXT,
                         so2 NUMERIC,
@@ -195,14 +279,26 @@ def init_db():
                         co NUMERIC,
                         pm10 NUMERIC,
                         pm25 NUMERIC,
-                        tipoemisio VARCHAR(100),
-                        fecha_carg TIMESTAMPTZ,
+                        fecha_carg TIMESTAMPTZ NOT NULL,
                         calidad_am VARCHAR(100),
-                        fiwareid VARCHAR(255),
-                        geo_shape JSONB,
-                        geo_point_2d JSONB,
+                        PRIMARY KEY (id, fecha_carg),
                         UNIQUE(objectid, fecha_carg)
-                    );
+                    ) PARTITION BY RANGE (fecha_carg);
+                """)
+
+                # Índices para los modelos incrementales de dbt: la marca de agua filtra por
+                # ingested_at y después se releen todas las filas de cada (estación, hora) afectada
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_valencia_air_real_hourly_ingested_at
+                    ON raw.valencia_air_real_hourly(ingested_at);
+                """))
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_valencia_air_simulated_hourly_ingested_at
+                    ON raw.valencia_air_historical_simulated_hourly(ingested_at);
+                """))
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_valencia_air_simulated_hourly_objectid_fecha
+                    ON raw.valencia_air_historical_simulated_hourly(objectid, fecha_carg);
                 """))
 
                 # 5. Tabla para registro de alertas enviadas a Telegram (histórico permanente)
@@ -238,6 +334,23 @@ def init_db():
                     ON security.api_key_clients(api_key);
                 """))
 
+                # Trigger que avisa (NOTIFY) a los workers del backend cuando hay altas, bajas o
+                # desactivaciones de clientes, para invalidar su caché de API keys al instante
+                conn.execute(text("""
+                    CREATE OR REPLACE FUNCTION security.notify_api_key_clients_changed()
+                    RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('api_key_clients_changed', TG_OP);
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """))
+                conn.execute(text("""
+                    CREATE OR REPLACE TRIGGER trg_api_key_clients_changed
+                    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON security.api_key_clients
+                    FOR EACH STATEMENT EXECUTE FUNCTION security.notify_api_key_clients_changed();
+                """))
+
                 # 7. Insertar clientes API desde variables de entorno
                 api_clients = {
                     "ingestion-valencia": os.getenv("INGESTION_VALENCIA_API_KEY"),
@@ -256,6 +369,86 @@ def init_db():
                     else:
                         print(f"  ⚠️ API key no encontrada para: {service_name}")
 
+                # 8. Generación de los marts: dbt la incrementa al final de cada ejecución
+                # (hook on-run-end) y el trigger avisa a los workers del backend para que
+                # invaliden su caché de respuestas
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS monitoring.mart_generation (
+                        id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                        generation BIGINT NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    );
+                """))
+                conn.execute(text("""
+                    INSERT INTO monitoring.mart_generation (id) VALUES (1)
+                    ON CONFLICT (id) DO NOTHING;
+                """))
+                conn.execute(text("""
+                    CREATE OR REPLACE FUNCTION monitoring.notify_mart_generation()
+                    RETURNS trigger AS $$
+                    BEGIN
+                        PERFORM pg_notify('mart_generation', NEW.generation::text);
+                        RETURN NULL;
+                    END;
+                    $$ LANGUAGE plpgsql;
+                """))
+                conn.execute(text("""
+                    CREATE OR REPLACE TRIGGER trg_mart_generation
+                    AFTER UPDATE ON monitoring.mart_generation
+                    FOR EACH ROW EXECUTE FUNCTION monitoring.notify_mart_generation();
+                """))
+
+                # 9. Marcas de agua de los modelos incrementales de dbt que no pueden deducirla
+                # de su propia tabla (p.ej. el mart de alertas solo guarda las filas con alerta)
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS monitoring.dbt_marcas_agua (
+                        modelo VARCHAR(255) PRIMARY KEY,
+                        marca TIMESTAMPTZ,
+                        updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                    );
+                """))
+                # marca_pendiente: límite superior de lo que evalúa la ejecución en curso (pre-hook);
+                # pasa a 'marca' en el post-hook, solo si el modelo ha terminado bien
+                conn.execute(text("""
+                    ALTER TABLE monitoring.dbt_marcas_agua ADD COLUMN IF NOT EXISTS marca_pendiente TIMESTAMPTZ;
+                """))
+
+                # 10. Tiempos de cada ejecución de dbt por carril (rápido / lento), los escribe el planificador
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS monitoring.dbt_ejecuciones_carril (
+                        id BIGSERIAL PRIMARY KEY,
+                        carril VARCHAR(20) NOT NULL,
+                        inicio TIMESTAMPTZ NOT NULL,
+                        duracion_s NUMERIC NOT NULL,
+                        resultado VARCHAR(20) NOT NULL,
+                        motivo TEXT
+                    );
+                """))
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_dbt_ejecuciones_carril_inicio
+                    ON monitoring.dbt_ejecuciones_carril(carril, inicio);
+                """))
+
+                # 11. Tiempos por modelo de cada ejecución de dbt (hook on-run-end registrar_ejecucion_modelos)
+                conn.execute(text("""
+                    CREATE TABLE IF NOT EXISTS monitoring.dbt_ejecuciones_modelo (
+                        id BIGSERIAL PRIMARY KEY,
+                        invocation_id VARCHAR(64) NOT NULL,
+                        selector VARCHAR(100),
+                        modelo VARCHAR(255) NOT NULL,
+                        materializacion VARCHAR(50),
+                        estado VARCHAR(20) NOT NULL,
+                        inicio TIMESTAMPTZ NOT NULL,
+                        duracion_s NUMERIC NOT NULL,
+                        filas_afectadas BIGINT,
+                        mensaje TEXT
+                    );
+                """))
+                conn.execute(text("""
+                    CREATE INDEX IF NOT EXISTS idx_dbt_ejecuciones_modelo_modelo_inicio
+                    ON monitoring.dbt_ejecuciones_modelo(modelo, inicio);
+                """))
+
                 conn.commit()
                 print("✅ Base de datos lista: Esquemas y tablas RAW creados correctamente.")
                 return 
@@ -267,8 +460,212 @@ def init_db():
     raise RuntimeError("No se pudo conectar a la base de datos tras 10 intentos.")
 
 
+# --- CARGA DE HISTÓRICOS ---
+#
+# Cada CSV se parsea en un proceso aparte (pandas, en paralelo) y el worker devuelve
+# las filas ya serializadas como CSV listo para COPY. El proceso principal solo vuelca
+# ese texto con COPY ... FROM STDIN según van terminando los workers, así el parseo
+# de unos archivos se solapa con la carga de otros.
+
+# Columnas de raw.valencia_air_historical_real_daily que rellena la carga (orden del COPY)
+REAL_DAILY_COLUMNS = (
+    "objectid", "fecha_medicion", "so2", "no2", "o3", "co", "pm10", "pm25",
+)
+
+# Columnas de raw.valencia_air_historical_simulated_hourly que pueden venir en los CSV simulados
+SIMULATED_HOURLY_COLUMNS = (
+    "objectid", "parametros", "mediciones",
+    "so2", "no2", "o3", "co", "pm10", "pm25",
+    "fecha_carg", "calidad_am",
+)
+
+# Columnas de los CSV simulados que van a raw.estaciones (una vez por estación, no por fila)
+SIMULATED_STATION_COLUMNS = ("nombre", "direccion", "tipozona", "tipoemisio", "fiwareid", "geo_shape", "geo_point_2d")
+
+
+def _real_column_name(col: str):
+    """Nombre normalizado de una columna de los CSV reales (sin unidades). None = se ignora."""
+    col_lower = col.lower()
+    if 'fecha' in col_lower:
+        return 'fecha_medicion'
+    if 'pm2.5' in col_lower or 'pm2,5' in col_lower:
+        return 'pm25'
+    if 'pm10' in col_lower:
+        return 'pm10'
+    if 'so2' in col_lower:
+        return 'so2'
+    if 'co' in col_lower and 'veloc' not in col_lower:
+        return 'co'
+    if 'no2' in col_lower:
+        return 'no2'
+    if 'ozono' in col_lower or 'o3' in col_lower:
+        return 'o3'
+    # Ignoramos NO, NOx y Veloc. ya que no están en la tabla
+    return None
+
+
+def _parse_real_csv(csv_path: str):
+    """
+    Worker: parsea un CSV diario real (un archivo por estación) y lo devuelve como CSV para COPY.
+    Retorna (nombre_archivo, filas, payload | None, (fecha_min, fecha_max) | None, segundos_parseo, aviso | None).
+    """
+    start = time.perf_counter()
+    csv_file = Path(csv_path)
+
+    # Extraer objectid del nombre del archivo (ej: "13.csv" -> 13)
+    objectid = int(csv_file.stem)
+    metadata = STATIONS_METADATA.get(objectid)
+    if metadata is None:
+        return csv_file.name, 0, None, None, time.perf_counter() - start, f"No hay metadatos para estación {objectid}"
+
+    # Solo se leen las columnas que acaban en la tabla, ya renombradas
+    header = pd.read_csv(csv_file, sep=';', encoding='latin-1', nrows=0).columns
+    column_mapping = {col: _real_column_name(col) for col in header if _real_column_name(col)}
+
+    # - Separador: punto y coma
+    # - Decimales con coma
+    # - Encoding latin-1 para caracteres especiales
+    df = pd.read_csv(
+        csv_file,
+        sep=';',
+        decimal=',',
+        encoding='latin-1',
+        na_values=['', ' '],
+        usecols=list(column_mapping),
+    ).rename(columns=column_mapping)
+
+    # Convertir fecha de dd/mm/yyyy; eliminar filas sin fecha válida
+    df['fecha_medicion'] = pd.to_datetime(df['fecha_medicion'], format='%d/%m/%Y', errors='coerce')
+    df = df.dropna(subset=['fecha_medicion'])
+    if df.empty:
+        return csv_file.name, 0, None, None, time.perf_counter() - start, "No hay datos válidos"
+
+    # Rango de fechas del archivo: el proceso principal crea sus particiones antes del COPY
+    date_range = (df['fecha_medicion'].min().to_pydatetime(), df['fecha_medicion'].max().to_pydatetime())
+
+    # Los metadatos de la estación van a raw.estaciones (ver load_historical_real_data)
+    df['objectid'] = objectid
+
+    # Columnas de contaminantes que no vengan en este archivo quedan a NULL
+    df = df.reindex(columns=REAL_DAILY_COLUMNS)
+    payload = df.to_csv(index=False, header=False, date_format='%Y-%m-%d')
+    return csv_file.name, len(df), payload, date_range, time.perf_counter() - start, metadata['nombre']
+
+
+def _parse_simulated_csv(csv_path: str):
+    """
+    Worker: parsea un CSV simulado horario (ya trae todos los metadatos) para COPY.
+    Los metadatos de estación se separan de las mediciones: una fila por estación para raw.estaciones.
+    Retorna (nombre_archivo, filas, (columnas, payload, estaciones) | None, (fecha_min, fecha_max) | None,
+    segundos_parseo, aviso | None).
+    """
+    start = time.perf_counter()
+    csv_file = Path(csv_path)
+
+    header = pd.read_csv(csv_file, encoding='utf-8', nrows=0).columns
+    columns = [col for col in SIMULATED_HOURLY_COLUMNS if col in header]
+    station_columns = [col for col in SIMULATED_STATION_COLUMNS if col in header]
+
+    df = pd.read_csv(
+        csv_file,
+        encoding='utf-8',
+        na_values=['', ' '],
+        usecols=columns + station_columns,
+        dtype={col: str for col in ('geo_shape', 'geo_point_2d', 'parametros', 'mediciones') if col in header},
+    )
+    if 'fecha_carg' not in df.columns:
+        return csv_file.name, 0, None, None, time.perf_counter() - start, "Sin columna fecha_carg"
+
+    # fecha_carg es la clave de partición (NOT NULL): las filas con fecha inválida se descartan
+    df['fecha_carg'] = pd.to_datetime(df['fecha_carg'], errors='coerce', utc=True)
+    df = df.dropna(subset=['fecha_carg'])
+    if df.empty:
+        return csv_file.name, 0, None, None, time.perf_counter() - start, "No hay datos válidos"
+
+    # Metadatos de la última fila de cada estación
+    latest = df.dropna(subset=['objectid']).drop_duplicates('objectid', keep='last')
+    latest = latest.reindex(columns=['objectid', *SIMULATED_STATION_COLUMNS]).astype(object)
+    latest = latest.where(latest.notna(), None)
+    stations = [
+        station_row(int(row.objectid), row.nombre, row.direccion, row.tipozona, row.tipoemisio,
+                    row.fiwareid, row.geo_shape, row.geo_point_2d)
+        for row in latest.itertuples(index=False)
+    ]
+
+    date_range = (df['fecha_carg'].min().to_pydatetime(), df['fecha_carg'].max().to_pydatetime())
+    payload = df[columns].to_csv(index=False, header=False)  # usecols no reordena: se fija el orden del COPY
+    return csv_file.name, len(df), (columns, payload, stations), date_range, time.perf_counter() - start, None
+
+
+def _copy_csv(cur, table_name: str, columns, payload: str):
+    """Vuelca un CSV ya serializado con COPY (campos vacíos sin comillas = NULL)."""
+    column_list = ", ".join(columns)
+    with cur.copy(f"COPY raw.{table_name} ({column_list}) FROM STDIN WITH (FORMAT csv)") as copy:
+        copy.write(payload)
+
+
+def _load_csv_files_parallel(csv_files, parse_fn, table_name: str, columns=None) -> int:
+    """
+    Parsea los CSV en un pool de procesos y los carga con COPY en una única transacción
+    (si algo falla no queda la tabla a medias, y en el siguiente arranque se reintenta).
+    Cada archivo va en su propio savepoint: un CSV corrupto se salta sin perder los demás.
+    Retorna el total de registros insertados.
+    """
+    total_records = 0
+    start = time.perf_counter()
+    granularity = RAW_PARTITIONED_TABLES[table_name][1]
+    workers = min(len(csv_files), HISTORICAL_LOAD_WORKERS)
+
+    # 'forkserver' porque el proceso de uvicorn ya tiene hilos en marcha (un fork directo podría
+    # heredar locks tomados). El servidor precarga este módulo (pandas incluido) una sola vez
+    # y cada worker se crea con un fork barato desde él, sin volver a importar nada.
+    mp_context = multiprocessing.get_context("forkserver")
+    mp_context.set_forkserver_preload([__name__])
+
+    with psycopg.connect(DATABASE_DSN) as pg_conn, pg_conn.transaction(), pg_conn.cursor() as cur, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+
+        futures = {pool.submit(parse_fn, str(csv_file)): csv_file for csv_file in csv_files}
+        for future in as_completed(futures):
+            csv_file = futures[future]
+            try:
+                name, n_rows, payload, date_range, parse_seconds, detail = future.result()
+                if payload is None:
+                    print(f"⚠️ {name}: {detail}. Saltando archivo")
+                    continue
+
+                file_columns, data, stations = (columns, payload, None) if columns else payload
+                copy_start = time.perf_counter()
+                with pg_conn.transaction():
+                    if stations:
+                        # En orden de objectid, como en ingest.copy_ingest (sin deadlocks entre ambos)
+                        cur.executemany(UPSERT_STATIONS_SQL, sorted(stations, key=lambda row: row[0]))
+                    # Particiones del rango del archivo antes del COPY (si no, todo iría a DEFAULT)
+                    cur.execute("SELECT raw.asegurar_particiones(%s, %s, %s, %s)",
+                                (f"raw.{table_name}", *date_range, granularity))
+                    _copy_csv(cur, table_name, file_columns, data)
+                copy_seconds = time.perf_counter() - copy_start
+
+                total_records += n_rows
+                extra = f" ({detail})" if detail else ""
+                print(f"  ✅ {name}: {n_rows} registros cargados{extra} "
+                      f"[parseo {parse_seconds:.2f}s, COPY {copy_seconds:.2f}s]")
+
+            except Exception as e:
+                print(f"  ❌ Error procesando {csv_file.name}: {e}")
+                continue
+
+    print(f"⏱️ {len(csv_files)} archivos en {time.perf_counter() - start:.2f}s con {workers} procesos")
+    return total_records
+
+
+def _table_is_empty(table_name: str) -> bool:
+    with engine.connect() as conn:
+        return not conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM raw.{table_name})")).scalar()
+
+
 def load_historical_real_data(historical_path: str = "", table_name: str = ""):
-    """table_name
+    """
     Carga los datos históricos desde archivos CSV a la tabla de históricos del esquema raw.
     Solo se ejecuta si la tabla está vacía (carga única).
 
@@ -277,128 +674,34 @@ def load_historical_real_data(historical_path: str = "", table_name: str = ""):
         table_name: tabla en la db a la que cargar los históricos
     """
     try:
-        with engine.connect() as conn:
-            # Verificar si ya hay datos históricos cargados
-            result = conn.execute(text(f"SELECT COUNT(*) FROM raw.{table_name}"))
-            count = result.scalar()
-
-            if count > 0:
-                print(f"⏭️ Datos históricos ya cargados ({count} registros). Saltando carga.")
-                return
-
-            # Verificar si existe el directorio de históricos
-            historical_dir = Path(historical_path)
-            if not historical_dir.exists():
-                print(f"⚠️ Directorio de históricos no encontrado: {historical_path}")
-                return
-
-            # Buscar archivos CSV
-            csv_files = list(historical_dir.glob("*.csv"))
-            if not csv_files:
-                print(f"⚠️ No se encontraron archivos CSV en {historical_path}")
-                return
-
-            print(f">> Iniciando carga de {len(csv_files)} archivos históricos...")
-            total_records = 0
-
-            for csv_file in csv_files:
-                try:
-                    # Extraer objectid del nombre del archivo (ej: "13.csv" -> 13)
-                    objectid = int(csv_file.stem)
-
-                    # Verificar que tenemos metadatos para esta estación
-                    if objectid not in STATIONS_METADATA:
-                        print(f"⚠️ No hay metadatos para estación {objectid}. Saltando {csv_file.name}")
-                        continue
-
-                    metadata = STATIONS_METADATA[objectid]
-
-                    # Leer CSV con configuración específica para estos archivos
-                    # - Separador: punto y coma
-                    # - Decimales con coma
-                    # - Encoding latin-1 para caracteres especiales
-                    df = pd.read_csv(
-                        csv_file,
-                        sep=';',
-                        decimal=',',
-                        encoding='latin-1',
-                        na_values=['', ' ']
-                    )
-
-                    # Normalizar nombres de columnas (quitar unidades y espacios)
-                    column_mapping = {}
-                    for col in df.columns:
-                        col_lower = col.lower()
-                        if 'fecha' in col_lower:
-                            column_mapping[col] = 'fecha_medicion'
-                        elif 'pm2.5' in col_lower or 'pm2,5' in col_lower:
-                            column_mapping[col] = 'pm25'
-                        elif 'pm10' in col_lower:
-                            column_mapping[col] = 'pm10'
-                        elif 'so2' in col_lower:
-                            column_mapping[col] = 'so2'
-                        elif 'co' in col_lower and 'veloc' not in col_lower:
-                            column_mapping[col] = 'co'
-                        elif 'no2' in col_lower:
-                            column_mapping[col] = 'no2'
-                        elif 'ozono' in col_lower or 'o3' in col_lower:
-                            column_mapping[col] = 'o3'
-                        # Ignoramos NO, NOx y Veloc. ya que no están en la tabla
-
-                    df = df.rename(columns=column_mapping)
-
-                    # Convertir fecha de dd/mm/yyyy a formato date
-                    if 'fecha_medicion' in df.columns:
-                        df['fecha_medicion'] = pd.to_datetime(
-                            df['fecha_medicion'],
-                            format='%d/%m/%Y',
-                            errors='coerce'
-                        ).dt.date
-
-                    # Seleccionar solo las columnas que necesitamos
-                    columns_to_keep = ['fecha_medicion', 'pm25', 'pm10', 'so2', 'co', 'no2', 'o3']
-                    available_columns = [col for col in columns_to_keep if col in df.columns]
-                    df = df[available_columns].copy()
-
-                    # Añadir metadatos de la estación
-                    df['objectid'] = objectid
-                    df['nombre'] = metadata['nombre']
-                    df['direccion'] = metadata['direccion']
-                    df['tipozona'] = metadata['tipozona']
-                    df['tipoemisio'] = metadata['tipoemisio']
-                    df['fiwareid'] = metadata['fiwareid']
-                    df['geo_shape'] = [metadata['geo_shape']] * len(df)
-                    df['geo_point_2d'] = [metadata['geo_point_2d']] * len(df)
-
-                    # Eliminar filas sin fecha válida
-                    df = df.dropna(subset=['fecha_medicion'])
-
-                    if len(df) == 0:
-                        print(f"⚠️ No hay datos válidos en {csv_file.name}")
-                        continue
-
-                    # Insertar en la base de datos
-                    
-                    df.to_sql(
-                        f'{table_name}',
-                        engine,
-                        schema='raw',
-                        if_exists='append',
-                        index=False,
-                        dtype={
-                            'geo_shape': types.JSON,
-                            'geo_point_2d': types.JSON
-                        }
-                    )
-
-                    total_records += len(df)
-                    print(f"✅ {csv_file.name}: {len(df)} registros cargados ({metadata['nombre']})")
-
-                except Exception as e:
-                    print(f"  ❌ Error procesando {csv_file.name}: {e}")
-                    continue
+        # Verificar si ya hay datos históricos cargados
+        if not _table_is_empty(table_name):
+            print("⏭️ Datos históricos ya cargados. Saltando carga.")
+            return
 
-            print(f"✅ Carga histórica completada: {total_records} registros totales insertados.")
+        # Verificar si existe el directorio de históricos
+        historical_dir = Path(historical_path)
+        if not historical_dir.exists():
+            print(f"⚠️ Directorio de históricos no encontrado: {historical_path}")
+            return
+
+        # Buscar archivos CSV
+        csv_files = sorted(historical_dir.glob("*.csv"))
+        if not csv_files:
+            print(f"⚠️ No se encontraron archivos CSV en {historical_path}")
+            return
+
+        # Los CSV reales solo traen mediciones: la dimensión se siembra con STATIONS_METADATA
+        # (sin pisar lo que ya haya enviado la API en tiempo real)
+        with psycopg.connect(DATABASE_DSN) as pg_conn, pg_conn.cursor() as cur:
+            cur.executemany(
+                SEED_STATIONS_SQL,
+                [station_row(objectid, **metadata) for objectid, metadata in STATIONS_METADATA.items()],
+            )
+
+        print(f">> Iniciando carga de {len(csv_files)} archivos históricos...")
+        total_records = _load_csv_files_parallel(csv_files, _parse_real_csv, table_name, columns=REAL_DAILY_COLUMNS)
+        print(f"✅ Carga histórica completada: {total_records} registros totales insertados.")
 
     except Exception as e:
         print(f"❌ Error en la carga de datos históricos: {e}")
@@ -413,67 +716,26 @@ def load_historical_simulated_data(historical_path: str = "", table_name: str =
     Nota: Los archivos CSV simulados ya contienen todos los metadatos (objectid, nombre,
     geo_shape, etc.) en un único archivo con todas las estaciones.
     """
-    import json
-
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(f"SELECT COUNT(*) FROM raw.{table_name}"))
-            if result.scalar() > 0:
-                print(f"⏭️ Datos históricos simulados ya cargados. Saltando carga.")
-                return
+        if not _table_is_empty(table_name):
+            print("⏭️ Datos históricos simulados ya cargados. Saltando carga.")
+            return
 
         historical_dir = Path(historical_path)
         if not historical_dir.exists():
             print(f"⚠️ Directorio no encontrado: {historical_path}")
             return
 
-        csv_files = list(historical_dir.glob("*.csv"))
+        csv_files = sorted(historical_dir.glob("*.csv"))
         if not csv_files:
             print(f"⚠️ No se encontraron archivos CSV en {historical_path}")
             return
 
         print(f">> Cargando {len(csv_files)} archivos históricos simulados...")
-        total_records = 0
-
-        for csv_file in csv_files:
-            try:
-                # Leer CSV en chunks para evitar problemas de memoria
-                chunk_size = 10000
-                chunks_loaded = 0
-
-                for chunk in pd.read_csv(csv_file, encoding='utf-8', na_values=['', ' '], chunksize=chunk_size):
-                    # Convertir fecha_carg de string a datetime
-                    if 'fecha_carg' in chunk.columns:
-                        chunk['fecha_carg'] = pd.to_datetime(chunk['fecha_carg'], errors='coerce')
-
-                    # Convertir columnas geo_shape y geo_point_2d de string JSON a dict
-                    if 'geo_shape' in chunk.columns:
-                        chunk['geo_shape'] = chunk['geo_shape'].apply(lambda x: json.loads(x) if pd.notna(x) and isinstance(x, str) else x)
-                    if 'geo_point_2d' in chunk.columns:
-                        chunk['geo_point_2d'] = chunk['geo_point_2d'].apply(lambda x: json.loads(x) if pd.notna(x) and isinstance(x, str) else x)
-
-                    chunk.to_sql(
-                        table_name, engine, schema='raw', if_exists='append', index=False,
-                        dtype={
-                            'geo_shape': types.JSON,
-                            'geo_point_2d': types.JSON,
-                            'fecha_carg': types.DateTime(timezone=True)
-                        }
-                    )
-
-                    chunks_loaded += len(chunk)
-                    total_records += len(chunk)
-
-                print(f"  ✅ {csv_file.name}: {chunks_loaded} registros cargados")
-
-            except Exception as e:
-                print(f"  ❌ Error en {csv_file.name}: {e}")
-                import traceback
-                traceback.print_exc()
-
+        total_records = _load_csv_files_parallel(csv_files, _parse_simulated_csv, table_name)
         print(f"✅ Carga completada: {total_records} registros insertados.")
 
     except Exception as e:
         print(f"❌ Error en carga de históricos simulados: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
@@ -0,0 +1,109 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from stations import UPSERT_STATIONS_SQL, station_row
+
+# Ingesta masiva en raw.valencia_air_real_hourly mediante COPY.
+#
+# En lugar de construir diccionarios, un DataFrame y un INSERT gigante con miles de
+# parámetros, las filas validadas se vuelcan con COPY a una tabla temporal de la
+# propia conexión y desde ahí se fusionan con un único INSERT ... SELECT que
+# ignora los duplicados por (objectid, fecha_carg). Los metadatos de cada estación
+# (nombre, dirección, coordenadas...) no se guardan por fila: van una vez por estación
+# a raw.estaciones con un upsert que solo escribe si han cambiado.
+
+# Canal de NOTIFY con el que se avisa al planificador de dbt de que hay filas nuevas en raw
+RAW_INGESTED_CHANNEL = "raw_data_ingested"
+
+# Columnas de medición del payload (mismo orden en la tabla temporal y en el COPY)
+INGEST_COLUMNS = (
+    "objectid", "calidad_am", "fecha_carg", "parametros", "mediciones",
+    "so2", "no2", "o3", "co", "pm10", "pm25",
+)
+
+# Tabla temporal sin id ni ingested_at: así el COPY no consume valores de la secuencia
+# de la tabla raw y ingested_at se asigna al fusionar. ON COMMIT DELETE ROWS permite
+# reutilizarla en cada petición que use la misma conexión del pool.
+_CREATE_STAGING = """
+    CREATE TEMP TABLE IF NOT EXISTS tmp_ingest_real_hourly (
+        objectid INTEGER,
+        calidad_am VARCHAR(100),
+        fecha_carg TIMESTAMPTZ,
+        parametros TEXT,
+        mediciones TEXT,
+        so2 NUMERIC,
+        no2 NUMERIC,
+        o3 NUMERIC,
+        co NUMERIC,
+        pm10 NUMERIC,
+        pm25 NUMERIC
+    ) ON COMMIT DELETE ROWS
+"""
+
+_COLUMN_LIST = ", ".join(INGEST_COLUMNS)
+
+# La tabla raw está particionada por mes de fecha_carg: antes de fusionar se crean las
+# particiones que falten para el rango del lote (normalmente ya existen y no hace nada)
+_ENSURE_PARTITIONS = """
+    SELECT raw.asegurar_particiones('raw.valencia_air_real_hourly', min(fecha_carg), max(fecha_carg), 'month')
+    FROM tmp_ingest_real_hourly
+"""
+
+# fecha_carg es la clave de partición (NOT NULL): las filas sin fecha no llegaban a staging
+_MERGE = f"""
+    INSERT INTO raw.valencia_air_real_hourly ({_COLUMN_LIST})
+    SELECT {_COLUMN_LIST} FROM tmp_ingest_real_hourly
+    WHERE fecha_carg IS NOT NULL
+    ON CONFLICT (objectid, fecha_carg) DO NOTHING
+"""
+
+
+def _to_copy_row(item) -> tuple:
+    """Convierte un AirQualityInbound en la tupla que espera el COPY."""
+    return (
+        item.objectid, item.calidad_am, item.fecha_carg, item.parametros, item.mediciones,
+        item.so2, item.no2, item.o3, item.co, item.pm10, item.pm25,
+    )
+
+
+async def copy_ingest(conn: AsyncConnection, items) -> tuple[int, int]:
+    """
+    Inserta las mediciones validadas con COPY + INSERT ... ON CONFLICT DO NOTHING.
+    Debe llamarse dentro de una transacción (async_engine.begin()).
+    Si hay filas nuevas avisa por NOTIFY (RAW_INGESTED_CHANNEL) al planificador de dbt.
+    Retorna (insertadas, duplicadas).
+    """
+    raw_conn = await conn.get_raw_connection()
+    pg_conn = raw_conn.driver_connection   # psycopg.AsyncConnection subyacente
+
+    total = 0
+    stations = {}
+    async with pg_conn.cursor() as cur:
+        await cur.execute(_CREATE_STAGING)
+
+        async with cur.copy(f"COPY tmp_ingest_real_hourly ({_COLUMN_LIST}) FROM STDIN") as copy:
+            for item in items:
+                await copy.write_row(_to_copy_row(item))
+                stations[item.objectid] = item   # la última fila de cada estación manda
+                total += 1
+
+        await cur.execute(_ENSURE_PARTITIONS)
+        await cur.execute(_MERGE)
+        inserted = cur.rowcount
+
+        # El upsert bloquea la fila de cada estación (aunque no cambie) hasta el COMMIT: se hace
+        # al final y en orden de objectid, para que ingestas concurrentes con estaciones comunes
+        # esperen poco y nunca se bloqueen mutuamente (deadlock)
+        await cur.executemany(UPSERT_STATIONS_SQL, [
+            station_row(item.objectid, item.nombre, item.direccion, item.tipozona, item.tipoemisio,
+                        item.fiwareid, item.geo_shape, item.geo_point_2d)
+            for _, item in sorted(stations.items())
+        ])
+
+        # Solo se avisa si hay filas nuevas; el NOTIFY se entrega al hacer COMMIT
+        if inserted:
+            await cur.execute("SELECT pg_notify(%s, %s)", (RAW_INGESTED_CHANNEL, str(inserted)))
+
+        # Vaciamos la temporal ya, por si la transacción la continúa otra operación
+        await cur.execute("TRUNCATE tmp_ingest_real_hourly")
+
+    return inserted, total - inserted
@@ -1,16 +1,28 @@
-from fastapi import FastAPI, HTTPException, Depends, Security, Query
+from fastapi import FastAPI, HTTPException, Depends, Security, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
 from fastapi.security import APIKeyHeader
-from config import engine
-import pandas as pd
-from pydantic import BaseModel, ConfigDict
+from config import async_engine
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
 from typing import Optional, Dict, Any
-from sqlalchemy import types, text
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
 from contextlib import asynccontextmanager
 from database import init_db, load_historical_real_data, load_historical_simulated_data
-from sqlalchemy.dialects.postgresql import insert
-import math
+from api_key_cache import api_key_cache, API_KEYS_CHANNEL
+from pg_listener import listener
+from ingest import copy_ingest
+from payloads import decode_ingest_body
+from response_cache import mart_cache, MART_GENERATION_CHANNEL
+from responses import FastJSONResponse, dumps_ndjson, rows_to_records, sanitize_rows
+import asyncio
+import os
+from datetime import datetime
 
 
+# Filas que se serializan y envían juntas en las respuestas NDJSON
+HOURLY_STREAM_BATCH_ROWS = 500
+
 # ----------------------------------
 
 # Clase principal de la medición
@@ -50,6 +62,23 @@ class AirQualityInbound(BaseModel):
 
     model_config = ConfigDict(extra='forbid')
 
+
+# Validador del lote de /api/ingest (el cuerpo se decodifica a mano según su formato)
+INGEST_ADAPTER = TypeAdapter(list[AirQualityInbound])
+
+
+# Alerta ya enviada a Telegram (una por estación, hora y contaminante)
+class AlertaEnviada(BaseModel):
+    id_estacion: int
+    fecha_hora_alerta: datetime
+    nombre_estacion: Optional[str] = None
+    ciudad: Optional[str] = None
+    parametro: str = Field(max_length=10)
+    valor: Optional[float] = None
+    limite: Optional[float] = None
+
+    model_config = ConfigDict(extra='forbid')
+
 # ----------------------------------
 
 @asynccontextmanager    # El decorador es un envoltorio funcional. Le dice a python que la función es un Gestor de Contexto (Context Manager) y tiene dos tiempos, una al arrancar (Antes del yield) y otra al apagar la api (Despues del yield)
@@ -57,26 +86,190 @@ async def lifespan(app: FastAPI):
 
     # --- CÓDIGO AL ARRANCAR EL CONTENEDOR ---
 
+    # La inicialización usa el engine síncrono; la lanzamos en un hilo para no bloquear el event loop
     try:
-        init_db()
+        await asyncio.to_thread(init_db)
         # Cargar datos históricos (solo se ejecuta si la tabla está vacía)
-        load_historical_real_data("/app/historical/real", "valencia_air_historical_real_daily") # Cargamos los datos históricos reales diarios sacados de la api
+        await asyncio.to_thread(load_historical_real_data, "/app/historical/real", "valencia_air_historical_real_daily") # Cargamos los datos históricos reales diarios sacados de la api
         
-        load_historical_simulated_data("/app/historical/simulated", "valencia_air_historical_simulated_hourly") # Cargamos los datos históricos simulados horarios sacados de la api
+        await asyncio.to_thread(load_historical_simulated_data, "/app/historical/simulated", "valencia_air_historical_simulated_hourly") # Cargamos los datos históricos simulados horarios sacados de la api
         
     except Exception as e:
         print(f"❌ Error inicializando la BD: {e}")
+
+    # Escucha de cambios en security.api_key_clients para invalidar la caché de API keys.
+    # Al (re)conectar también se vacía, por si se perdió algún NOTIFY mientras no había escucha.
+    listener.subscribe(API_KEYS_CHANNEL, api_key_cache.invalidate, on_connect=api_key_cache.invalidate)
+    # Idem para la caché de respuestas de marts: dbt incrementa la generación al terminar cada ejecución
+    listener.subscribe(MART_GENERATION_CHANNEL, mart_cache.on_generation, on_connect=mart_cache.reset)
+    listener.start()
+
     yield   #Pausa la ejecución de la función para seguir con la aplicación.
             #Se pueden configurar acciones a realizar al apagar la api
 
+    listener.stop()
+    await async_engine.dispose()
+
 # Inicialización de la API
 app = FastAPI(
     lifespan=lifespan,
     title="Air Quality Barrier API",
     description="API de aislamiento para proteger el acceso a air_quality_db",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse,
 )
 
+# --- CONSULTAS COMPARTIDAS ---
+
+# Alerta más reciente de una estación con su severidad y recomendación
+ALERTA_ACTUAL_SQL = """
+    WITH alertas_con_severidad AS (
+        SELECT
+            fecha_hora_alerta,
+            id_estacion,
+            nombre_estacion,
+            ciudad,
+            CASE
+                WHEN alerta_no2 THEN 'NO2'
+                WHEN alerta_pm25 THEN 'PM2.5'
+                WHEN alerta_pm10 THEN 'PM10'
+                WHEN alerta_so2 THEN 'SO2'
+                WHEN alerta_o3 THEN 'O3'
+                WHEN alerta_co THEN 'CO'
+                ELSE 'Desconocido'
+            END as contaminante_principal,
+            CASE
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3 THEN 3
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2 THEN 2
+                ELSE 1
+            END as nivel_severidad,
+            CASE
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3
+                THEN 'Alerta Grave - Múltiples contaminantes exceden límites'
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2
+                THEN 'Alerta Moderada - Varios contaminantes elevados'
+                ELSE 'Alerta Leve - Contaminante elevado'
+            END as descripcion_severidad,
+            CASE
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3
+                THEN 'Evite actividades al aire libre. Permanezca en interiores con ventanas cerradas.'
+                WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
+                      alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2
+                THEN 'Reduzca actividades físicas intensas al aire libre. Use mascarilla si es necesario.'
+                ELSE 'Limite actividades físicas prolongadas al aire libre.'
+            END as recomendacion
+        FROM marts.fct_alertas_actuales_contaminacion
+        WHERE id_estacion = :station_id
+    )
+    SELECT
+        fecha_hora_alerta,
+        id_estacion,
+        nombre_estacion,
+        nivel_severidad,
+        contaminante_principal,
+        descripcion_severidad,
+        recomendacion
+    FROM alertas_con_severidad
+    ORDER BY fecha_hora_alerta DESC
+    LIMIT 1
+"""
+
+# Fila más reciente (última hora) de una estación. marts.fct_estado_actual_estaciones
+# la mantiene dbt (1 fila por estación, índice único por id_estacion): es una búsqueda puntual
+ULTIMA_HORA_ESTACION_SQL = """
+    SELECT
+        fecha_hora,
+        ciudad,
+        id_estacion,
+        nombre_estacion,
+        promedio_no2,
+        promedio_pm10,
+        promedio_pm25,
+        promedio_so2,
+        promedio_ozono,
+        promedio_co,
+        total_mediciones_hora
+    FROM marts.fct_estado_actual_estaciones
+    WHERE id_estacion = :station_id
+"""
+
+# Límites dinámicos (P75) de una estación: promedio de los límites de todas las horas
+LIMITES_ESTACION_SQL = """
+    SELECT
+        ROUND(AVG(p75_no2)::numeric, 2)::float as limite_no2,
+        ROUND(AVG(p75_pm10)::numeric, 2)::float as limite_pm10,
+        ROUND(AVG(p75_pm25)::numeric, 2)::float as limite_pm25,
+        ROUND(AVG(p75_so2)::numeric, 2)::float as limite_so2,
+        ROUND(AVG(p75_o3)::numeric, 2)::float as limite_o3,
+        ROUND(AVG(p75_co)::numeric, 2)::float as limite_co
+    FROM marts.fct_limites_de_contaminacion
+    WHERE id_estacion = :station_id
+    GROUP BY id_estacion
+"""
+
+# Si no hay límites para la estación se usan los límites OMS por defecto
+LIMITES_OMS = {
+    "limite_no2": 25.0,
+    "limite_pm10": 45.0,
+    "limite_pm25": 15.0,
+    "limite_so2": 40.0,
+    "limite_o3": 100.0,
+    "limite_co": 10.0
+}
+
+# Bloques de la foto de una estación: cada uno es una subconsulta escalar que Postgres
+# devuelve como JSON (psycopg lo entrega ya como dict)
+SNAPSHOT_SECCIONES_SQL = {
+    "ultima_hora": f"SELECT row_to_json(h) FROM ({ULTIMA_HORA_ESTACION_SQL}) h",
+    "limites": f"SELECT row_to_json(l) FROM ({LIMITES_ESTACION_SQL}) l",
+    "alerta": f"SELECT row_to_json(a) FROM ({ALERTA_ACTUAL_SQL}) a",
+    "coordenadas": """
+        SELECT json_build_object('lat', latitud, 'lon', longitud)
+        FROM marts.fct_estado_actual_estaciones
+        WHERE id_estacion = :station_id
+    """,
+}
+
+# Foto completa de una estación en UNA sola consulta
+SNAPSHOT_ESTACION_SQL = "SELECT " + ",\n".join(
+    f"({sql}) AS {seccion}" for seccion, sql in SNAPSHOT_SECCIONES_SQL.items()
+)
+
+# Resumen por modelo de las ejecuciones de dbt de los últimos días (hook registrar_ejecucion_modelos).
+# tendencia_s_por_dia es la pendiente de la duración frente al tiempo: los modelos que más crecen primero
+DBT_MODELOS_RESUMEN_SQL = """
+    SELECT
+        modelo,
+        max(materializacion) AS materializacion,
+        count(*) AS ejecuciones,
+        count(*) FILTER (WHERE estado NOT IN ('success', 'skipped')) AS fallidas,
+        round(avg(duracion_s), 3)::float AS media_duracion_s,
+        round(max(duracion_s), 3)::float AS max_duracion_s,
+        (array_agg(duracion_s ORDER BY inicio DESC))[1]::float AS ultima_duracion_s,
+        (array_agg(filas_afectadas ORDER BY inicio DESC))[1] AS ultimas_filas_afectadas,
+        round(regr_slope(duracion_s::float, extract(epoch FROM inicio)::float / 86400)::numeric, 4)::float
+            AS tendencia_s_por_dia,
+        max(inicio) AS ultima_ejecucion
+    FROM monitoring.dbt_ejecuciones_modelo
+    WHERE inicio >= now() - make_interval(days => CAST(:dias AS integer))
+    GROUP BY modelo
+    ORDER BY tendencia_s_por_dia DESC NULLS LAST, media_duracion_s DESC
+"""
+
+# Últimas ejecuciones de un modelo (para ver en qué momento empezó una regresión)
+DBT_MODELO_HISTORIAL_SQL = """
+    SELECT invocation_id, selector, estado, inicio, duracion_s::float AS duracion_s, filas_afectadas, mensaje
+    FROM monitoring.dbt_ejecuciones_modelo
+    WHERE modelo = :modelo
+    ORDER BY inicio DESC
+    LIMIT :limit
+"""
+
 # ----------------------------------
 
 # --- AUTENTICACIÓN M2M ---
@@ -88,36 +281,33 @@ async def verify_api_key(api_key: str = Security(api_key_header)) -> str:
     Dependencia de FastAPI para validar API keys.
     Verifica que la key exista en security.api_key_clients y esté activa.
     Retorna el nombre del servicio autenticado.
+    Los resultados (válidos e inválidos) se cachean en memoria; ver api_key_cache.py.
     """
     if not api_key:
         raise HTTPException(status_code=401, detail="API Key requerida. Incluye el header 'X-API-Key'.")
 
-    with engine.connect() as conn:
-        result = conn.execute(text("""
-            SELECT service_name FROM security.api_key_clients
-            WHERE api_key = :api_key AND is_active = TRUE
-        """), {"api_key": api_key})
-        client = result.fetchone()
+    found, service_name = api_key_cache.get(api_key)
 
-    if not client:
-        raise HTTPException(status_code=403, detail="API Key inválida o servicio desactivado.")
-
-    return client.service_name
-
-# ----------------------------------
+    if not found:
+        # Capturamos la generación antes de consultar: si llega una invalidación
+        # mientras leemos, el resultado no se guarda en caché
+        generation = api_key_cache.generation
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text("""
+                SELECT service_name FROM security.api_key_clients
+                WHERE api_key = :api_key AND is_active = TRUE
+            """), {"api_key": api_key})
+            client = result.fetchone()
 
-# Definimos un método de inserción personalizado de Pandas para insertar datos en la BD
-# evitando que se generen registros duplicados.
-# La función .to_sql le inyecta los parámetros al llamar a la función
+        service_name = client.service_name if client else None
+        api_key_cache.put(api_key, service_name, generation)
 
-def insert_with_ignore_duplicates(table, conn, keys, data_iter):
+    if not service_name:
+        raise HTTPException(status_code=403, detail="API Key inválida o servicio desactivado.")
 
-    data = [dict(zip(keys, row)) for row in data_iter]
-    if data:
-        stmt = insert(table.table).values(data)
-        stmt = stmt.on_conflict_do_nothing(index_elements=['objectid', 'fecha_carg'])
-        conn.execute(stmt)
+    return service_name
 
+# ----------------------------------
 
 # --- ENDPOINTS ---
 
@@ -128,49 +318,91 @@ async def health_check():
     Verifica conexión a la base de datos.
     """
     try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
         return {"status": "healthy", "database": "connected"}
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database unavailable: {e}")
 
 
+@app.get("/api/auth/cache-stats")
+async def get_api_key_cache_stats(service: str = Depends(verify_api_key)):
+    """
+    Contadores de la caché de API keys (aciertos, fallos, invalidaciones).
+    Son por worker: cada proceso de uvicorn tiene su propia caché.
+    """
+    return {"pid": os.getpid(), **api_key_cache.stats()}
+
+
+@app.get("/api/mart-cache/stats")
+async def get_mart_cache_stats(service: str = Depends(verify_api_key)):
+    """
+    Contadores de la caché de respuestas de marts y generación de dbt vigente.
+    Son por worker: cada proceso de uvicorn tiene su propia caché.
+    """
+    return {"pid": os.getpid(), **mart_cache.stats()}
+
+
+@app.get("/api/monitoring/dbt-models")
+async def get_dbt_models_profile(
+    dias: int = Query(7, ge=1, le=365),
+    service: str = Depends(verify_api_key),
+):
+    """
+    Perfil de las ejecuciones de dbt por modelo en los últimos `dias`: número de ejecuciones,
+    fallos, duración media / máxima / última, filas afectadas y tendencia de la duración.
+    """
+    try:
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text(DBT_MODELOS_RESUMEN_SQL), {"dias": dias})
+            return FastJSONResponse(rows_to_records(result))
+    except Exception as e:
+        print(f"Error en dbt-models: {e}")
+        raise HTTPException(status_code=500, detail="Error al obtener el perfil de dbt")
+
+
+@app.get("/api/monitoring/dbt-models/{modelo}")
+async def get_dbt_model_history(
+    modelo: str,
+    limit: int = Query(100, ge=1, le=5000),
+    service: str = Depends(verify_api_key),
+):
+    """Últimas ejecuciones de un modelo de dbt (más reciente primero)."""
+    try:
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text(DBT_MODELO_HISTORIAL_SQL), {"modelo": modelo, "limit": limit})
+            return FastJSONResponse(rows_to_records(result))
+    except Exception as e:
+        print(f"Error en historial de dbt-models: {e}")
+        raise HTTPException(status_code=500, detail="Error al obtener el historial del modelo")
+
+
 # --- ENDPOINTS INGESTA ---
 
 @app.post("/api/ingest", status_code=201)
-async def ingest_air_data(data: list[AirQualityInbound], service: str = Depends(verify_api_key)):
+async def ingest_air_data(request: Request, service: str = Depends(verify_api_key)):
+    # El formato se negocia con Content-Type (JSON o MessagePack, por filas o columnar) y
+    # Content-Encoding (gzip); ver payloads.py. La validación es la misma para todos.
+    records = decode_ingest_body(
+        await request.body(), request.headers.get("content-type"), request.headers.get("content-encoding"),
+    )
     try:
-        # 1. Convertimos la lista de modelos Pydantic a una lista de diccionarios Python
-        # model_dump() es el estándar moderno de Pydantic v2
-
-        payload = [item.model_dump() for item in data]
-
-        # 2. Creamos el DataFrame. Al ser las llaves del JSON iguales a las
-        # columnas de la tabla, el mapeo es automático.
-
-        df = pd.DataFrame(payload)
-
-        # 3. Inserción en la tabla raw.valencia_air_real_hourly
-        # Usamos method personalizado para ignorar duplicados automáticamente
-        # Especificamos dtype para asegurar que los diccionarios se traten como JSONB
-
-        df.to_sql(
-            'valencia_air_real_hourly',
-            engine,
-            schema='raw',
-            if_exists='append',
-            index=False,
-            method=insert_with_ignore_duplicates,
-            dtype={
-                'geo_shape': types.JSON,
-                'geo_point_2d': types.JSON,
-                'fecha_carg': types.DateTime(timezone=True)
-            }
-        )
+        data = INGEST_ADAPTER.validate_python(records)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False))
+
+    try:
+        # Las filas ya validadas por Pydantic se envían directamente con COPY a una tabla
+        # temporal y se fusionan con raw.valencia_air_real_hourly ignorando duplicados
+
+        async with async_engine.begin() as conn:
+            insertados, duplicados = await copy_ingest(conn, data)
 
         return {
             "status": "success",
-            "message": f"Se procesaron {len(df)} registros (duplicados ignorados automáticamente)."
+            "message": f"Se procesaron {len(data)} registros ({insertados} nuevos, {duplicados} duplicados ignorados).",
+            "insertados": insertados,
+            "duplicados": duplicados,
         }
 
     except Exception as e:
@@ -197,60 +429,138 @@ async def get_alertas_pendientes(service: str = Depends(verify_api_key)):
         )
         ORDER BY a.fecha_hora_alerta DESC
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        alertas = [dict(row._mapping) for row in result]
-    return {"alertas": alertas, "total": len(alertas)}
+    async with async_engine.connect() as conn:
+        result = await conn.execute(text(query))
+        alertas = rows_to_records(result)
+    return FastJSONResponse({"alertas": alertas, "total": len(alertas)})
+
+
+# Inserta todo el lote en una sola sentencia: cada columna llega como un array y
+# unnest() las recompone en filas (un único viaje a la BD, sin importar cuántas alertas haya)
+REGISTRAR_ALERTAS_SQL = """
+    INSERT INTO alerts.alertas_enviadas_telegram
+    (id_estacion, fecha_hora_alerta, nombre_estacion, ciudad, parametro, valor, limite)
+    SELECT * FROM unnest(
+        CAST(:id_estacion AS integer[]),
+        CAST(:fecha_hora_alerta AS timestamptz[]),
+        CAST(:nombre_estacion AS varchar[]),
+        CAST(:ciudad AS varchar[]),
+        CAST(:parametro AS varchar[]),
+        CAST(:valor AS numeric[]),
+        CAST(:limite AS numeric[])
+    )
+    ON CONFLICT (id_estacion, fecha_hora_alerta, parametro) DO NOTHING
+"""
 
 
 @app.post("/api/alertas/registrar-envio")
-async def registrar_alerta_enviada(alertas: list[dict], service: str = Depends(verify_api_key)):
-
-    """Registra en el histórico las alertas enviadas a Telegram."""
-    with engine.connect() as conn:
-        for alerta in alertas:
-            conn.execute(text("""
-                INSERT INTO alerts.alertas_enviadas_telegram
-                (id_estacion, fecha_hora_alerta, nombre_estacion, ciudad, parametro, valor, limite)
-                VALUES (:id_estacion, :fecha_hora_alerta, :nombre_estacion, :ciudad, :parametro, :valor, :limite)
-                ON CONFLICT (id_estacion, fecha_hora_alerta, parametro) DO NOTHING
-            """), alerta)
-        conn.commit()
-    return {"status": "success", "alertas_registradas": len(alertas)}
+async def registrar_alerta_enviada(alertas: list[AlertaEnviada], service: str = Depends(verify_api_key)):
+    """
+    Registra en el histórico las alertas enviadas a Telegram.
+    Retorna cuántas eran nuevas (las ya registradas se ignoran).
+    """
+    if not alertas:
+        return {"status": "success", "alertas_recibidas": 0, "alertas_registradas": 0}
+
+    columnas = {campo: [getattr(a, campo) for a in alertas] for campo in AlertaEnviada.model_fields}
+    async with async_engine.begin() as conn:
+        result = await conn.execute(text(REGISTRAR_ALERTAS_SQL), columnas)
+
+    return {
+        "status": "success",
+        "alertas_recibidas": len(alertas),
+        "alertas_registradas": result.rowcount,
+    }
 
 # --- ENDPOINTS PLOTLI ---
 
-@app.get("/api/hourly-metrics")
-def get_hourly_metrics(limit: int = Query(100, ge=1, le=5000), service: str = Depends(verify_api_key)):
-    """
-    Devuelve las últimas métricas horarias (JSON seguro: sin NaN/Inf).
-    """
+def parse_keyset_cursor(after: str) -> tuple[datetime, int]:
+    """Parsea el cursor 'fecha_hora,id_estacion' (la última fila recibida en la página anterior)."""
     try:
-        query = f"""
-            SELECT *
-            FROM marts.fct_air_quality_hourly
-            ORDER BY fecha_hora DESC
-            LIMIT {limit}
-        """
-        df = pd.read_sql(query, engine)
+        fecha_hora, id_estacion = after.rsplit(",", 1)
+        return datetime.fromisoformat(fecha_hora.strip()), int(id_estacion)
+    except ValueError:
+        raise HTTPException(
+            status_code=422,
+            detail="Parámetro 'after' inválido. Formato esperado: <fecha_hora ISO 8601>,<id_estacion>",
+        )
 
-        # ✅ Convertir NaN/Inf a None para que JSON no rompa
-        records = df.to_dict(orient="records")
-        for row in records:
-            for k, v in row.items():
-                if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
-                    row[k] = None
 
-        return records
+@app.get("/api/hourly-metrics")
+async def get_hourly_metrics(
+    limit: Optional[int] = Query(100, ge=1, description="Máximo de filas a devolver (sin tope superior)"),
+    after: Optional[str] = Query(None, description="Cursor 'fecha_hora,id_estacion' de la última fila recibida"),
+    station_id: Optional[int] = Query(None, ge=1),
+    desde: Optional[datetime] = Query(None, description="fecha_hora mínima (inclusive)"),
+    hasta: Optional[datetime] = Query(None, description="fecha_hora máxima (exclusive)"),
+    service: str = Depends(verify_api_key),
+):
+    """
+    Devuelve las métricas horarias más recientes como NDJSON (una fila JSON por línea, sin NaN/Inf).
 
+    Paginación por keyset en orden (fecha_hora, id_estacion) descendente: para pedir la
+    siguiente página se pasa en 'after' la fecha_hora e id_estacion de la última línea recibida.
+    Las filas se leen con un cursor de servidor y se envían a medida que llegan, así que la
+    memoria no crece con el volumen de histórico solicitado.
+    """
+    conditions = []
+    params = {"limit": limit}
+
+    if after:
+        params["after_fecha_hora"], params["after_id_estacion"] = parse_keyset_cursor(after)
+        conditions.append("(fecha_hora, id_estacion) < (:after_fecha_hora, :after_id_estacion)")
+    if station_id is not None:
+        params["station_id"] = station_id
+        conditions.append("id_estacion = :station_id")
+    if desde is not None:
+        params["desde"] = desde
+        conditions.append("fecha_hora >= :desde")
+    if hasta is not None:
+        params["hasta"] = hasta
+        conditions.append("fecha_hora < :hasta")
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT *
+        FROM marts.fct_air_quality_hourly
+        {where}
+        ORDER BY fecha_hora DESC, id_estacion DESC
+        LIMIT :limit
+    """
+
+    # La consulta y el primer bloque se leen ANTES de crear la respuesta: un error de BD
+    # (mart inexistente, conexión caída...) todavía puede devolverse como 500
+    conn = await async_engine.connect()
+    try:
+        result = await conn.stream(text(query), params)
+        keys = list(result.keys())
+        partitions = result.partitions(HOURLY_STREAM_BATCH_ROWS)
+        first = await anext(partitions, None)
     except Exception as e:
-        print(f"Error en API: {e}")
+        await conn.close()
+        print(f"Error en API hourly-metrics: {e}")
         raise HTTPException(status_code=500, detail="Error interno al leer base de datos")
 
+    async def stream_rows():
+        try:
+            if first is not None:
+                # ✅ NaN/Inf -> None por columnas para que JSON no rompa
+                yield dumps_ndjson(sanitize_rows(keys, first))
+                async for partition in partitions:
+                    yield dumps_ndjson(sanitize_rows(keys, partition))
+        except Exception as e:
+            # Las cabeceras ya se enviaron: solo podemos cortar el stream y registrar el error
+            print(f"Error en API hourly-metrics (stream): {e}")
+            raise
+        finally:
+            await conn.close()
+
+    return StreamingResponse(stream_rows(), media_type="application/x-ndjson")
+
 
 #Podio
 @app.get("/api/zonas-verdes")
-def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(verify_api_key)):
+async def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(verify_api_key)):
 
     """
     Devuelve las estaciones con mejor calidad del aire (menor contaminación).
@@ -258,21 +568,10 @@ def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(
     Umbrales: NO2=25, PM2.5=15, PM10=45, O3=100, SO2=40 µg/m³
     """
     try:
+        # marts.fct_estado_actual_estaciones ya tiene la última hora de cada estación
+        # y su indice_contaminacion: la consulta recorre una fila por estación
         query = """
-            WITH ultimas_mediciones AS (
-                SELECT DISTINCT ON (id_estacion)
-                    id_estacion,
-                    nombre_estacion,
-                    promedio_no2,
-                    promedio_pm25,
-                    promedio_pm10,
-                    promedio_ozono,
-                    promedio_so2,
-                    fecha_hora
-                FROM marts.fct_air_quality_hourly
-                ORDER BY id_estacion, fecha_hora DESC
-            ),
-            sin_alertas AS (
+            WITH sin_alertas AS (
                 SELECT
                     id_estacion,
                     nombre_estacion,
@@ -282,9 +581,8 @@ def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(
                     promedio_pm10,
                     promedio_ozono,
                     promedio_so2,
-                    COALESCE(promedio_no2, 0) + COALESCE(promedio_pm25, 0) + COALESCE(promedio_pm10, 0) +
-                    COALESCE(promedio_ozono, 0) + COALESCE(promedio_so2, 0) AS indice_contaminacion
-                FROM ultimas_mediciones
+                    indice_contaminacion
+                FROM marts.fct_estado_actual_estaciones
                 WHERE nombre_estacion IS NOT NULL
                   AND (promedio_no2 IS NULL OR promedio_no2 <= 25)
                   AND (promedio_pm25 IS NULL OR promedio_pm25 <= 15)
@@ -304,20 +602,14 @@ def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(
                 ROW_NUMBER() OVER (ORDER BY indice_contaminacion ASC) as ranking_pos
             FROM sin_alertas
             ORDER BY indice_contaminacion ASC
-            LIMIT %(limit)s
+            LIMIT :limit
         """
-        df = pd.read_sql(query, engine, params={"limit": limit})
-
-        if df.empty:
-            return []
+        async def consultar():
+            async with async_engine.connect() as conn:
+                result = await conn.execute(text(query), {"limit": limit})
+                return rows_to_records(result)
 
-        records = df.to_dict(orient="records")
-        for row in records:
-            for k, v in row.items():
-                if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
-                    row[k] = None
-
-        return records
+        return FastJSONResponse(await mart_cache.get_or_compute("zonas-verdes", (limit,), consultar))
 
     except Exception as e:
         print(f"Error en zonas-verdes: {e}")
@@ -327,108 +619,48 @@ def get_zonas_verdes(limit: int = Query(3, ge=1, le=10), service: str = Depends(
 
 
 @app.get("/api/station/latest-hourly")
-def get_station_latest_hourly(station_id: int = Query(..., ge=1), service: str = Depends(verify_api_key)):
+async def get_station_latest_hourly(station_id: int = Query(..., ge=1), service: str = Depends(verify_api_key)):
     """
-    Devuelve la fila más reciente (última hora) de marts.fct_air_quality_hourly para una estación.
+    Devuelve la fila más reciente (última hora) de una estación (marts.fct_estado_actual_estaciones).
     """
     try:
-        query = """
-            SELECT *
-            FROM marts.fct_air_quality_hourly
-            WHERE id_estacion = %(station_id)s
-            ORDER BY fecha_hora DESC
-            LIMIT 1
-        """
-        df = pd.read_sql(query, engine, params={"station_id": station_id})
-
-        if df.empty:
-            return {}
+        query = ULTIMA_HORA_ESTACION_SQL
+        async def consultar():
+            async with async_engine.connect() as conn:
+                result = await conn.execute(text(query), {"station_id": station_id})
+                records = rows_to_records(result)
 
-        record = df.to_dict(orient="records")[0]
+            # JSON seguro
+            return records[0] if records else {}
 
-        # JSON seguro
-        for k, v in list(record.items()):
-            if isinstance(v, float) and (math.isnan(v) or math.isinf(v)):
-                record[k] = None
-
-        return record
+        return FastJSONResponse(await mart_cache.get_or_compute("station/latest-hourly", (station_id,), consultar))
 
     except Exception as e:
         print(f"Error latest-hourly: {e}")
         raise HTTPException(status_code=500, detail="Error interno al leer base de datos")
     
 @app.get("/api/alerts/now")
-def get_alert_now(station_id: int = Query(..., ge=1),service: str = Depends(verify_api_key)):
+async def get_alert_now(station_id: int = Query(..., ge=1),service: str = Depends(verify_api_key)):
     """
     Devuelve el semáforo + recomendación actual para una estación,
     leyendo desde marts.fct_alertas_actuales_contaminacion.
     """
     try:
-        q = text("""
-            WITH alertas_con_severidad AS (
-                SELECT
-                    fecha_hora_alerta,
-                    id_estacion,
-                    nombre_estacion,
-                    ciudad,
-                    CASE
-                        WHEN alerta_no2 THEN 'NO2'
-                        WHEN alerta_pm25 THEN 'PM2.5'
-                        WHEN alerta_pm10 THEN 'PM10'
-                        WHEN alerta_so2 THEN 'SO2'
-                        WHEN alerta_o3 THEN 'O3'
-                        WHEN alerta_co THEN 'CO'
-                        ELSE 'Desconocido'
-                    END as contaminante_principal,
-                    CASE
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3 THEN 3
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2 THEN 2
-                        ELSE 1
-                    END as nivel_severidad,
-                    CASE
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3
-                        THEN 'Alerta Grave - Múltiples contaminantes exceden límites'
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2
-                        THEN 'Alerta Moderada - Varios contaminantes elevados'
-                        ELSE 'Alerta Leve - Contaminante elevado'
-                    END as descripcion_severidad,
-                    CASE
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 3
-                        THEN 'Evite actividades al aire libre. Permanezca en interiores con ventanas cerradas.'
-                        WHEN (alerta_no2::int + alerta_pm25::int + alerta_pm10::int +
-                              alerta_so2::int + alerta_o3::int + alerta_co::int) >= 2
-                        THEN 'Reduzca actividades físicas intensas al aire libre. Use mascarilla si es necesario.'
-                        ELSE 'Limite actividades físicas prolongadas al aire libre.'
-                    END as recomendacion
-                FROM marts.fct_alertas_actuales_contaminacion
-                WHERE id_estacion = :station_id
-            )
-            SELECT
-                fecha_hora_alerta,
-                id_estacion,
-                nombre_estacion,
-                nivel_severidad,
-                contaminante_principal,
-                descripcion_severidad,
-                recomendacion
-            FROM alertas_con_severidad
-            ORDER BY fecha_hora_alerta DESC
-            LIMIT 1;
-        """)
-
-        with engine.connect() as conn:
-            row = conn.execute(q, {"station_id": station_id}).mappings().first()
+        q = text(ALERTA_ACTUAL_SQL)
+
+        async def consultar():
+            async with async_engine.connect() as conn:
+                row = (await conn.execute(q, {"station_id": station_id})).mappings().first()
+            return dict(row) if row else None
+
+        # También se cachea la ausencia de alerta (None) hasta la siguiente ejecución de dbt
+        row = await mart_cache.get_or_compute("alerts/now", (station_id,), consultar)
 
         if not row:
             raise HTTPException(status_code=404, detail="No hay alerta disponible para esa estación.")
 
         # devolvemos dict JSON-friendly
-        return dict(row)
+        return row
 
     except HTTPException:
         raise
@@ -437,7 +669,7 @@ def get_alert_now(station_id: int = Query(..., ge=1),service: str = Depends(veri
         raise HTTPException(status_code=500, detail="Error interno al leer alerts/now")
 
 @app.get("/air_quality/history")
-def air_quality_history(station_id: int, window: str = "now", service: str = Depends(verify_api_key)):
+async def air_quality_history(station_id: int, window: str = "now", service: str = Depends(verify_api_key)):
     rows = []
 
     # --- tu lógica actual de histórico ---
@@ -451,25 +683,23 @@ def air_quality_history(station_id: int, window: str = "now", service: str = Dep
         query = """
             SELECT latitud, longitud
             FROM marts.fct_dim_estaciones
-            WHERE id_estacion = %(station_id)s
+            WHERE id_estacion = :station_id
             LIMIT 1
         """
-        df = pd.read_sql(query, engine, params={"station_id": station_id})
-
-        if not df.empty:
-            lat = df.iloc[0]['latitud']
-            lon = df.iloc[0]['longitud']
+        async with async_engine.connect() as conn:
+            coords = (await conn.execute(text(query), {"station_id": station_id})).first()
 
+        if coords:
             for r in rows:
-                r["lat"] = lat
-                r["lon"] = lon
+                r["lat"] = coords.latitud
+                r["lon"] = coords.longitud
     except Exception as e:
         print(f"Error al obtener coordenadas: {e}")
 
-    return rows
+    return FastJSONResponse(rows)
 
 @app.get("/api/stations")
-def get_stations(service: str = Depends(verify_api_key)):
+async def get_stations(service: str = Depends(verify_api_key)):
     """
     Devuelve la lista de estaciones únicas con su ID y nombre.
     """
@@ -480,47 +710,85 @@ def get_stations(service: str = Depends(verify_api_key)):
             WHERE nombre_estacion IS NOT NULL
             ORDER BY nombre_estacion
         """
-        df = pd.read_sql(query, engine)
-        return df.to_dict(orient="records")
+        async def consultar():
+            async with async_engine.connect() as conn:
+                result = await conn.execute(text(query))
+                return rows_to_records(result)
+
+        return FastJSONResponse(await mart_cache.get_or_compute("stations", (), consultar))
     except Exception as e:
         print(f"Error en stations: {e}")
         raise HTTPException(status_code=500, detail="Error al obtener estaciones")
 
 
 @app.get("/api/limites/{station_id}")
-def get_limites_estacion(station_id: int, service: str = Depends(verify_api_key)):
+async def get_limites_estacion(station_id: int, service: str = Depends(verify_api_key)):
     """
     Devuelve los límites dinámicos (P75) para una estación específica.
     Calcula el promedio de los límites de todas las horas.
     """
     try:
-        query = """
-            SELECT
-                ROUND(AVG(p75_no2)::numeric, 2)::float as limite_no2,
-                ROUND(AVG(p75_pm10)::numeric, 2)::float as limite_pm10,
-                ROUND(AVG(p75_pm25)::numeric, 2)::float as limite_pm25,
-                ROUND(AVG(p75_so2)::numeric, 2)::float as limite_so2,
-                ROUND(AVG(p75_o3)::numeric, 2)::float as limite_o3,
-                ROUND(AVG(p75_co)::numeric, 2)::float as limite_co
-            FROM marts.fct_limites_de_contaminacion
-            WHERE id_estacion = %(station_id)s
-            GROUP BY id_estacion
-        """
-        df = pd.read_sql(query, engine, params={"station_id": station_id})
+        query = LIMITES_ESTACION_SQL
+        async def consultar():
+            async with async_engine.connect() as conn:
+                row = (await conn.execute(text(query), {"station_id": station_id})).mappings().first()
+            return dict(row) if row else None
+
+        limites = await mart_cache.get_or_compute("limites", (station_id,), consultar)
 
-        if df.empty:
+        if not limites:
             # Si no hay límites, devolver límites OMS por defecto
-            return {
-                "limite_no2": 25.0,
-                "limite_pm10": 45.0,
-                "limite_pm25": 15.0,
-                "limite_so2": 40.0,
-                "limite_o3": 100.0,
-                "limite_co": 10.0
-            }
+            return LIMITES_OMS
 
-        return df.to_dict(orient="records")[0]
+        return limites
     except Exception as e:
         print(f"Error en limites: {e}")
         raise HTTPException(status_code=500, detail="Error al obtener límites")
 
+
+
+@app.get("/api/station/{station_id}/snapshot")
+async def get_station_snapshot(station_id: int, service: str = Depends(verify_api_key)):
+    """
+    Devuelve todo lo que necesita la app ciudadana al seleccionar una estación:
+    última medición horaria, límites dinámicos, alerta activa (con severidad) y coordenadas.
+    Se resuelve con una única consulta a la BD y se cachea por generación de dbt.
+    """
+    try:
+        params = {"station_id": station_id}
+
+        async def consultar():
+            async with async_engine.connect() as conn:
+                try:
+                    row = dict((await conn.execute(text(SNAPSHOT_ESTACION_SQL), params)).mappings().first())
+                except ProgrammingError as e:
+                    # Falta algún mart (p. ej. durante la primera ejecución de dbt): se consulta
+                    # bloque a bloque, cada uno en su savepoint, y el que falle queda vacío
+                    print(f"⚠️ Snapshot de estación por bloques: {e.orig}")
+                    await conn.rollback()
+                    row = {}
+                    for seccion, sql in SNAPSHOT_SECCIONES_SQL.items():
+                        try:
+                            async with conn.begin_nested():
+                                row[seccion] = (await conn.execute(text(sql), params)).scalar()
+                        except ProgrammingError:
+                            row[seccion] = None
+
+            ultima_hora = row["ultima_hora"] or {}
+            alerta = row["alerta"]
+            return {
+                "id_estacion": station_id,
+                "nombre_estacion": ultima_hora.get("nombre_estacion") or (alerta or {}).get("nombre_estacion"),
+                "ultima_hora": ultima_hora,
+                # Si no hay límites para la estación, límites OMS por defecto
+                "limites": row["limites"] or LIMITES_OMS,
+                "limites_por_defecto": row["limites"] is None,
+                "alerta": alerta,
+                "coordenadas": row["coordenadas"],
+            }
+
+        return await mart_cache.get_or_compute("station/snapshot", (station_id,), consultar)
+
+    except Exception as e:
+        print(f"Error en snapshot de estación: {e}")
+        raise HTTPException(status_code=500, detail="Error al obtener el estado de la estación")
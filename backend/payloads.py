@@ -0,0 +1,67 @@
+import zlib
+
+import msgpack
+import orjson
+from fastapi import HTTPException
+
+# Decodificación de los cuerpos de /api/ingest según Content-Type y Content-Encoding.
+#
+# Además de JSON plano (lista de objetos) se aceptan:
+#   - Content-Encoding: gzip, sobre cualquiera de los formatos.
+#   - Content-Type: application/msgpack (o application/x-msgpack).
+#   - Forma columnar {"columns": [...], "rows": [[...], ...]} en JSON o MessagePack:
+#     los nombres de campo van una sola vez por lote en lugar de una vez por fila.
+# Se descomprime con un límite de tamaño para que un cuerpo pequeño no pueda
+# expandirse sin control en memoria (bomba gzip).
+
+MAX_INGEST_BODY_BYTES = 64 * 1024 * 1024
+
+JSON_CONTENT_TYPES = ("application/json",)
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def _gunzip(body: bytes) -> bytes:
+    decompressor = zlib.decompressobj(wbits=31)   # 31 = formato gzip
+    try:
+        data = decompressor.decompress(body, MAX_INGEST_BODY_BYTES)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Cuerpo gzip no válido")
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="El cuerpo descomprimido supera el tamaño máximo")
+    return data
+
+
+def _to_records(payload) -> list:
+    """Acepta una lista de objetos o la forma columnar {"columns", "rows"}."""
+    if isinstance(payload, dict) and "columns" in payload and "rows" in payload:
+        columns, rows = payload["columns"], payload["rows"]
+        if not isinstance(columns, list) or not all(isinstance(column, str) for column in columns):
+            raise HTTPException(status_code=400, detail="'columns' debe ser una lista de nombres de campo")
+        if not isinstance(rows, list) or not all(isinstance(row, list) and len(row) == len(columns) for row in rows):
+            raise HTTPException(status_code=400, detail="'rows' debe ser una lista de filas con un valor por columna")
+        return [dict(zip(columns, row)) for row in rows]
+    if isinstance(payload, list):
+        return payload
+    raise HTTPException(status_code=400, detail="Se esperaba una lista de registros o {columns, rows}")
+
+
+def decode_ingest_body(body: bytes, content_type: str | None, content_encoding: str | None) -> list:
+    """Convierte el cuerpo de la petición en la lista de registros (dicts) que se validará."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "gzip":
+        body = _gunzip(body)
+    elif encoding != "identity":
+        raise HTTPException(status_code=415, detail=f"Content-Encoding no soportado: {encoding}")
+
+    media_type = (content_type or "application/json").split(";")[0].strip().lower()
+    try:
+        if media_type in JSON_CONTENT_TYPES:
+            payload = orjson.loads(body)
+        elif media_type in MSGPACK_CONTENT_TYPES:
+            payload = msgpack.unpackb(body, raw=False)
+        else:
+            raise HTTPException(status_code=415, detail=f"Content-Type no soportado: {media_type}")
+    except (orjson.JSONDecodeError, msgpack.UnpackException, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Cuerpo no válido: {e}")
+
+    return _to_records(payload)
@@ -0,0 +1,66 @@
+import threading
+import time
+import psycopg
+from config import DATABASE_DSN
+
+# Escucha de notificaciones de PostgreSQL (LISTEN/NOTIFY).
+# Cada worker de uvicorn abre su propia conexión de escucha, así que un único
+# NOTIFY llega a todos los procesos y cada uno invalida su caché local.
+
+
+class PgListener:
+    """
+    Hilo en segundo plano que mantiene una conexión LISTEN abierta y despacha
+    cada notificación al callback registrado para su canal.
+    """
+
+    def __init__(self, dsn: str = DATABASE_DSN, reconnect_delay: float = 2.0):
+        self._dsn = dsn
+        self._reconnect_delay = reconnect_delay
+        self._handlers = {}         # canal -> lista de callbacks(payload)
+        self._on_connect = []       # callbacks a ejecutar tras (re)conectar
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, channel: str, handler, on_connect=None):
+        """
+        Registra un callback para un canal.
+        on_connect se llama en cada (re)conexión: mientras no había escucha se
+        pueden haber perdido notificaciones, así que el consumidor debe resincronizarse.
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+        if on_connect is not None:
+            self._on_connect.append(on_connect)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="pg-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with psycopg.connect(self._dsn, autocommit=True) as conn:
+                    for channel in self._handlers:
+                        conn.execute(f'LISTEN "{channel}"')
+                    for callback in self._on_connect:
+                        callback()
+                    print(f"👂 Escuchando notificaciones: {', '.join(self._handlers)}")
+
+                    while not self._stop.is_set():
+                        # timeout para poder comprobar periódicamente si hay que parar
+                        for notify in conn.notifies(timeout=5.0):
+                            for handler in self._handlers.get(notify.channel, []):
+                                handler(notify.payload)
+
+            except Exception as e:
+                print(f"⚠️ Escucha de notificaciones interrumpida: {e}. Reconectando...")
+                time.sleep(self._reconnect_delay)
+
+
+# Instancia compartida por el proceso
+listener = PgListener()
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from config import async_engine, MART_CACHE_MAX_ENTRIES
+
+# Canal de NOTIFY que emite el trigger de monitoring.mart_generation (ver database.init_db)
+MART_GENERATION_CHANNEL = "mart_generation"
+
+
+class MartResponseCache:
+    """
+    Caché de respuestas de los endpoints que leen de marts.*.
+
+    Los marts solo cambian cuando dbt termina una ejecución, y al final de cada una dbt
+    incrementa monitoring.mart_generation (hook on-run-end). Cada respuesta se guarda
+    junto a la generación con la que se calculó y solo se sirve mientras esa generación
+    siga siendo la actual, así que entre ejecuciones se responde desde memoria y los
+    datos se invalidan justo cuando llegan datos nuevos.
+    """
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries = OrderedDict()   # (endpoint, params) -> (generación, valor)
+        self._lock = threading.Lock()
+        self._generation = None         # None = desconocida, hay que leerla de la BD
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def on_generation(self, payload: str):
+        """Callback del NOTIFY: fija la nueva generación y libera las entradas antiguas."""
+        with self._lock:
+            self._generation = int(payload)
+            self._entries.clear()
+            self._stats["invalidations"] += 1
+
+    def reset(self):
+        """Tras (re)conectar la escucha pudo perderse algún NOTIFY: se relee la generación."""
+        with self._lock:
+            self._generation = None
+
+    async def _current_generation(self) -> int:
+        generation = self._generation
+        if generation is None:
+            async with async_engine.connect() as conn:
+                generation = (await conn.execute(text(
+                    "SELECT generation FROM monitoring.mart_generation WHERE id = 1"
+                ))).scalar() or 0
+            with self._lock:
+                if self._generation is None:
+                    self._generation = generation
+        return generation
+
+    async def get_or_compute(self, endpoint: str, params: tuple, compute):
+        """Devuelve la respuesta cacheada para (endpoint, params) o la calcula con compute()."""
+        key = (endpoint, params)
+        generation = await self._current_generation()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry[1]
+            self._stats["misses"] += 1
+
+        value = await compute()
+
+        # Se guarda con la generación leída ANTES de calcular: si dbt terminó mientras
+        # tanto, la entrada queda obsoleta y no se servirá
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "generation": self._generation,
+                "size": len(self._entries),
+                "max_entries": self._max_entries,
+            }
+
+
+mart_cache = MartResponseCache(max_entries=MART_CACHE_MAX_ENTRIES)
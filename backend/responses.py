@@ -0,0 +1,82 @@
+import math
+from decimal import Decimal
+
+import numpy as np
+import orjson
+from fastapi.responses import Response
+
+# Utilidades compartidas para serializar las respuestas de la API.
+#
+# Las filas se sanean por columnas: en lugar de comprobar valor a valor si es un float
+# NaN/Inf, se detectan una vez las columnas numéricas (float o NUMERIC/Decimal) y cada
+# una se convierte a un array de numpy, donde np.isfinite marca de golpe los valores
+# que JSON no admite. El resultado se serializa con orjson, que es bastante más rápido
+# que el json de la librería estándar que usa FastAPI por defecto.
+
+_FLOAT_TYPES = (float, Decimal)
+
+
+def _orjson_default(value):
+    """Tipos que orjson no serializa por sí mismo (NUMERIC de Postgres llega como Decimal)."""
+    if isinstance(value, Decimal):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def _sanitize_column(values: tuple) -> tuple:
+    """Convierte una columna numérica a float y cambia NaN/Inf (y NULL) por None."""
+    arr = np.array(values, dtype=np.float64)    # None -> nan
+    out = arr.astype(object)
+    out[~np.isfinite(arr)] = None
+    return tuple(out.tolist())
+
+
+def sanitize_rows(keys, rows) -> list[dict]:
+    """
+    Convierte filas (tuplas) en diccionarios JSON seguros: NaN/Inf -> None y
+    Decimal -> float. El saneado se hace columna a columna con numpy.
+    """
+    keys = list(keys)
+    if not rows:
+        return []
+
+    columns = list(zip(*rows))
+    for i, column in enumerate(columns):
+        types = set(map(type, column))
+        types.discard(type(None))
+        # Solo columnas puramente numéricas con decimales: los enteros (ids, contadores)
+        # se dejan como están para no convertirlos en float
+        if types and all(issubclass(t, _FLOAT_TYPES) for t in types):
+            columns[i] = _sanitize_column(column)
+
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+
+def rows_to_records(result) -> list[dict]:
+    """Convierte el resultado de una consulta en diccionarios JSON seguros (NaN/Inf -> None)."""
+    return sanitize_rows(result.keys(), result.all())
+
+
+def dumps(content) -> bytes:
+    """Serializa con orjson (fechas en ISO 8601, Decimal como float)."""
+    return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def dumps_ndjson(records) -> bytes:
+    """Serializa una lista de registros como NDJSON (una línea JSON por registro)."""
+    return b"".join(dumps(record) + b"\n" for record in records)
+
+
+class FastJSONResponse(Response):
+    """
+    Respuesta JSON serializada con orjson.
+
+    Devolverla directamente desde un endpoint evita también el jsonable_encoder de
+    FastAPI, que recorre de nuevo toda la estructura antes de serializarla.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
@@ -0,0 +1,152 @@
+"""
+Dimensión de estaciones (raw.estaciones).
+
+Las tablas raw de mediciones solo guardan el objectid de la estación: nombre, dirección,
+zona, emisión, identificador FIWARE y coordenadas se guardan una sola vez por estación
+en raw.estaciones. La mantienen al día /api/ingest y las cargas de históricos.
+"""
+
+import json
+
+# Metadatos de cada estación (basado en la API de Valencia) para los CSV históricos reales,
+# que solo traen mediciones. La clave es el objectid (nombre del archivo CSV).
+# Es solo la semilla: la ingesta en tiempo real actualiza la dimensión con lo que envíe la API.
+STATIONS_METADATA = {
+    12: {
+        "nombre": "Dr. Lluch",
+        "direccion": "DR.LLUCH",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A08_DR_LLUCH_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.328289489402739, 39.4666847554611], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.328289489402739, "lat": 39.4666847554611}
+    },
+    13: {
+        "nombre": "Francia",
+        "direccion": "AVDA.FRANCIA",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A01_AVFRANCIA_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.342986232422652, 39.4578268875183], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.342986232422652, "lat": 39.4578268875183}
+    },
+    14: {
+        "nombre": "Boulevar Sur",
+        "direccion": "BULEVARD SUD",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A02_BULEVARDSUD_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.396337564375856, 39.4503960055054], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.396337564375856, "lat": 39.4503960055054}
+    },
+    15: {
+        "nombre": "Molí del Sol",
+        "direccion": "MOLÍ DEL SOL",
+        "tipozona": "Suburbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A03_MOLISOL_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.408809896900938, 39.4811121109041], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.408809896900938, "lat": 39.4811121109041}
+    },
+    16: {
+        "nombre": "Pista de Silla",
+        "direccion": "PISTA DE SILLA",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A04_PISTASILLA_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.376643936579157, 39.4580609536967], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.376643936579157, "lat": 39.4580609536967}
+    },
+    17: {
+        "nombre": "Universidad Politécnica",
+        "direccion": "POLITÈCNIC",
+        "tipozona": "Suburbana",
+        "tipoemisio": "Fondo",
+        "fiwareid": "A05_POLITECNIC_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.337400660521869, 39.4796444969292], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.337400660521869, "lat": 39.4796444969292}
+    },
+    18: {
+        "nombre": "Viveros",
+        "direccion": "VIVERS",
+        "tipozona": "Urbana",
+        "tipoemisio": "Fondo",
+        "fiwareid": "A06_VIVERS_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.36964822314381, 39.4796409248053], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.36964822314381, "lat": 39.4796409248053}
+    },
+    19: {
+        "nombre": "Centro",
+        "direccion": "VALÈNCIA CENTRE",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A07_VALENCIACENTRE_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.376397651655324, 39.4705476702601], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.376397651655324, "lat": 39.4705476702601}
+    },
+    20: {
+        "nombre": "Cabanyal",
+        "direccion": "CABANYAL",
+        "tipozona": "Urbana",
+        "tipoemisio": "Fondo",
+        "fiwareid": "A09_CABANYAL_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.328534813492744, 39.4743907853568], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.328534813492744, "lat": 39.4743907853568}
+    },
+    21: {
+        "nombre": "Olivereta",
+        "direccion": "OLIVERETA",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A10_OLIVERETA_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.405923445529068, 39.469244235092], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.405923445529068, "lat": 39.469244235092}
+    },
+    22: {
+        "nombre": "Patraix",
+        "direccion": "PATRAIX",
+        "tipozona": "Urbana",
+        "tipoemisio": "Tráfico",
+        "fiwareid": "A11_PATRAIX_60m",
+        "geo_shape": {"type": "Feature", "geometry": {"coordinates": [-0.401411329219129, 39.4591890899964], "type": "Point"}, "properties": {}},
+        "geo_point_2d": {"lon": -0.401411329219129, "lat": 39.4591890899964}
+    },
+}
+
+# Columnas de raw.estaciones que rellena el upsert (orden de station_row)
+STATION_COLUMNS = (
+    "objectid", "nombre", "direccion", "tipozona", "tipoemisio", "fiwareid",
+    "latitud", "longitud", "geo_shape",
+)
+
+# Solo se reescribe la fila si algo ha cambiado: en régimen normal cada lote de la ingesta
+# trae las mismas estaciones y no debe generar versiones muertas de la tabla
+UPSERT_STATIONS_SQL = f"""
+    INSERT INTO raw.estaciones AS e ({", ".join(STATION_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(STATION_COLUMNS))})
+    ON CONFLICT (objectid) DO UPDATE SET
+        {", ".join(f"{col} = EXCLUDED.{col}" for col in STATION_COLUMNS[1:])},
+        updated_at = CURRENT_TIMESTAMP
+    WHERE ({", ".join(f"e.{col}" for col in STATION_COLUMNS[1:])})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{col}" for col in STATION_COLUMNS[1:])})
+"""
+
+# Semilla de STATIONS_METADATA: solo estaciones que aún no existan
+SEED_STATIONS_SQL = f"""
+    INSERT INTO raw.estaciones ({", ".join(STATION_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(STATION_COLUMNS))})
+    ON CONFLICT (objectid) DO NOTHING
+"""
+
+
+def station_row(objectid, nombre, direccion, tipozona, tipoemisio, fiwareid, geo_shape, geo_point_2d) -> tuple:
+    """Tupla para UPSERT_STATIONS_SQL. geo_shape / geo_point_2d como dict (o JSON en texto)."""
+    if isinstance(geo_point_2d, str):
+        geo_point_2d = json.loads(geo_point_2d)
+    if not isinstance(geo_shape, (str, type(None))):
+        geo_shape = json.dumps(geo_shape)
+    geo_point_2d = geo_point_2d or {}
+    return (
+        objectid, nombre, direccion, tipozona, tipoemisio, fiwareid,
+        geo_point_2d.get("lat"), geo_point_2d.get("lon"), geo_shape,
+    )
@@ -0,0 +1,22 @@
+{#
+    Incrementa monitoring.mart_generation al terminar una ejecución de dbt (hook on-run-end).
+    El backend cachea las respuestas de los endpoints que leen de marts.* por generación,
+    así que solo se invalida cuando al menos un modelo se ha reconstruido con éxito.
+#}
+{% macro bump_mart_generation(results) -%}
+    {%- set modelos_ok = [] -%}
+    {%- for res in results -%}
+        {%- if res.node.resource_type == 'model' and res.status == 'success' -%}
+            {%- do modelos_ok.append(res.node.name) -%}
+        {%- endif -%}
+    {%- endfor -%}
+
+    {%- if modelos_ok | length > 0 -%}
+        update monitoring.mart_generation
+        set generation = generation + 1,
+            updated_at = current_timestamp
+        where id = 1
+    {%- else -%}
+        select 1
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,38 @@
+{#
+    Utilidades de los histogramas de contaminantes (ver int_histograma_contaminantes).
+
+    Cada medición se guarda como el índice de su cubeta: round(valor / resolución).
+    La resolución de cada contaminante se define en la variable 'resolucion_histograma'
+    de dbt_project.yml. La pseudo-columna '_filas' cuenta todas las mediciones (aunque
+    los contaminantes vengan a NULL) para conservar total_mediciones.
+#}
+
+{# Filas (contaminante, cubeta) de una medición, para usar en CROSS JOIN LATERAL (VALUES ...).
+   Con prefijo_cubeta se leen cubetas ya calculadas (columnas <prefijo><contaminante>). #}
+{% macro valores_histograma(prefijo_cubeta=none) -%}
+    ('_filas', 0::bigint)
+    {%- for contaminante, resolucion in var('resolucion_histograma').items() %},
+    {%- if prefijo_cubeta %}
+    ('{{ contaminante }}', {{ prefijo_cubeta }}{{ contaminante }})
+    {%- else %}
+    ('{{ contaminante }}', round({{ contaminante }} / {{ resolucion }})::bigint)
+    {%- endif %}
+    {%- endfor %}
+{%- endmacro %}
+
+{# Columnas cubeta_<contaminante> de una medición #}
+{% macro cubetas_histograma() -%}
+    {%- for contaminante, resolucion in var('resolucion_histograma').items() %}
+    round({{ contaminante }} / {{ resolucion }})::bigint as cubeta_{{ contaminante }}
+    {%- if not loop.last %},{% endif %}
+    {%- endfor %}
+{%- endmacro %}
+
+{# Resolución del contaminante de la fila (para pasar de cubeta a valor) #}
+{% macro resolucion_histograma(columna_contaminante) -%}
+    case {{ columna_contaminante }}
+    {%- for contaminante, resolucion in var('resolucion_histograma').items() %}
+        when '{{ contaminante }}' then {{ resolucion }}
+    {%- endfor %}
+    end
+{%- endmacro %}
@@ -0,0 +1,47 @@
+{#
+    Guarda en monitoring.dbt_ejecuciones_modelo una fila por modelo ejecutado (hook on-run-end):
+    duración, filas afectadas según el adaptador, estado y mensaje. Así queda el histórico
+    de cuánto tarda cada modelo para ver cuál crece más rápido o detectar regresiones
+    (GET /api/monitoring/dbt-models y panel "Rendimiento de dbt" de Grafana).
+#}
+
+{% macro literal_sql(valor) -%}
+    {%- if valor is none -%}
+        null
+    {%- else -%}
+        '{{ valor | string | replace("'", "''") }}'
+    {%- endif -%}
+{%- endmacro %}
+
+{% macro registrar_ejecucion_modelos(results) -%}
+    {%- set filas = [] -%}
+    {%- set selector = (invocation_args_dict or {}).get('selector') -%}
+
+    {%- for res in results if res.node.resource_type == 'model' -%}
+        {#- Inicio de la fase 'execute' del modelo (si no llegó a ejecutarse, el de la invocación) -#}
+        {%- set ns = namespace(inicio=run_started_at) -%}
+        {%- for paso in res.timing if paso.name == 'execute' and paso.started_at -%}
+            {%- set ns.inicio = paso.started_at -%}
+        {%- endfor -%}
+        {%- set filas_afectadas = (res.adapter_response or {}).get('rows_affected') -%}
+
+        {%- do filas.append(
+            "(" ~ literal_sql(invocation_id) ~ ", " ~ literal_sql(selector) ~ ", "
+            ~ literal_sql(res.node.name) ~ ", " ~ literal_sql(res.node.config.materialized) ~ ", "
+            ~ literal_sql(res.status) ~ ", "
+            ~ literal_sql(ns.inicio.strftime('%Y-%m-%d %H:%M:%S.%f')) ~ "::timestamp at time zone 'UTC', "
+            ~ (res.execution_time | round(3)) ~ ", "
+            ~ (filas_afectadas if filas_afectadas is not none and filas_afectadas >= 0 else 'null') ~ ", "
+            ~ literal_sql(res.message) ~ ")"
+        ) -%}
+    {%- endfor -%}
+
+    {%- if filas | length > 0 -%}
+        insert into monitoring.dbt_ejecuciones_modelo
+            (invocation_id, selector, modelo, materializacion, estado, inicio, duracion_s, filas_afectadas, mensaje)
+        values
+            {{ filas | join(", ") }}
+    {%- else -%}
+        select 1
+    {%- endif -%}
+{%- endmacro %}
@@ -0,0 +1,40 @@
+{#
+    Agregados acumulables de la cadena hora -> día -> semana (int_rollup_horario,
+    int_rollup_diario y los marts diario y semanal).
+
+    De cada contaminante se guardan suma, número de valores no nulos, mínimo y máximo.
+    Un nivel superior combina las filas del inferior (suma de sumas, suma de n, mínimo de
+    mínimos...), así que su promedio (suma / n) es exactamente el de las mediciones
+    originales, no una media de medias.
+#}
+
+{% macro contaminantes_rollup() -%}
+    {{ return(['no2', 'pm10', 'pm25', 'so2', 'o3', 'co']) }}
+{%- endmacro %}
+
+{# Columnas suma_/n_/min_/max_<contaminante> a partir de mediciones #}
+{% macro agregados_desde_mediciones() -%}
+    {%- for contaminante in contaminantes_rollup() %}
+    sum({{ contaminante }}) as suma_{{ contaminante }},
+    count({{ contaminante }}) as n_{{ contaminante }},
+    min({{ contaminante }}) as min_{{ contaminante }},
+    max({{ contaminante }}) as max_{{ contaminante }}
+    {%- if not loop.last %},{% endif %}
+    {%- endfor %}
+{%- endmacro %}
+
+{# Las mismas columnas combinando filas de un nivel inferior de la cadena #}
+{% macro agregados_desde_rollup() -%}
+    {%- for contaminante in contaminantes_rollup() %}
+    sum(suma_{{ contaminante }}) as suma_{{ contaminante }},
+    sum(n_{{ contaminante }})::bigint as n_{{ contaminante }},
+    min(min_{{ contaminante }}) as min_{{ contaminante }},
+    max(max_{{ contaminante }}) as max_{{ contaminante }}
+    {%- if not loop.last %},{% endif %}
+    {%- endfor %}
+{%- endmacro %}
+
+{# Promedio exacto del contaminante, redondeado como en el resto de marts #}
+{% macro promedio_rollup(contaminante) -%}
+    round((suma_{{ contaminante }} / nullif(n_{{ contaminante }}, 0))::numeric, 2)::float
+{%- endmacro %}
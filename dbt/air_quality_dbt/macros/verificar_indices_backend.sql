@@ -0,0 +1,90 @@
+{#
+    Comprueba al final de cada ejecución (hook on-run-end) que los patrones de consulta
+    del backend tienen un índice que los soporte. Los patrones se declaran en la variable
+    'indices_backend' de dbt_project.yml: tabla + columnas iniciales del índice (+ tipo,
+    btree por defecto). Un índice sirve si sus primeras columnas son exactamente esas.
+
+    Solo se comprueban las tablas de los modelos que esta ejecución ha construido (results)
+    y las que ya existen: un 'dbt run --select ...' parcial o un solo carril no falla por
+    modelos que no le tocan. Si falla, se distingue entre modelos construidos cuya tabla no
+    aparece y tablas sin el índice que necesita la consulta.
+#}
+{% macro verificar_indices_backend(results) -%}
+    {%- if execute -%}
+        {%- set esquemas = [] -%}
+        {%- for patron in var('indices_backend', []) -%}
+            {%- do esquemas.append(patron.tabla.split('.')[0]) -%}
+        {%- endfor -%}
+
+        {#- Tablas que esta ejecución ha construido correctamente -#}
+        {%- set construidas = [] -%}
+        {%- for res in results if res.node.resource_type == 'model' and res.status == 'success' -%}
+            {%- do construidas.append(res.node.schema ~ '.' ~ (res.node.alias or res.node.name)) -%}
+        {%- endfor -%}
+
+        {%- set consulta_tablas -%}
+            select n.nspname || '.' || c.relname as tabla
+            from pg_class c
+            join pg_namespace n on n.oid = c.relnamespace
+            where c.relkind in ('r', 'p', 'm', 'v')
+              and n.nspname in ('{{ esquemas | unique | join("', '") }}')
+        {%- endset -%}
+        {%- set existentes = run_query(consulta_tablas).columns[0].values() if esquemas else [] -%}
+
+        {%- set consulta -%}
+            select
+                n.nspname || '.' || t.relname as tabla,
+                am.amname as tipo,
+                array_to_string(array(
+                    select a.attname
+                    from unnest(i.indkey::int2[]) with ordinality as k(attnum, posicion)
+                    join pg_attribute a on a.attrelid = t.oid and a.attnum = k.attnum
+                    order by k.posicion
+                ), ',') as columnas
+            from pg_index i
+            join pg_class t on t.oid = i.indrelid
+            join pg_namespace n on n.oid = t.relnamespace
+            join pg_class ic on ic.oid = i.indexrelid
+            join pg_am am on am.oid = ic.relam
+            where n.nspname in ('{{ esquemas | unique | join("', '") }}')
+        {%- endset -%}
+
+        {%- set indices = run_query(consulta) if esquemas else [] -%}
+
+        {%- set sin_tabla = [] -%}
+        {%- set faltan = [] -%}
+        {%- for patron in var('indices_backend', []) -%}
+            {%- set requeridas = patron.columnas | join(',') -%}
+            {%- set tipo = patron.get('tipo', 'btree') -%}
+            {%- if patron.tabla not in existentes -%}
+                {#- Sin tabla: solo es un error si esta ejecución ha construido el modelo -#}
+                {%- if patron.tabla in construidas -%}
+                    {%- do sin_tabla.append(patron.tabla ~ ' ← ' ~ patron.uso) -%}
+                {%- endif -%}
+            {%- else -%}
+                {%- set ns = namespace(cubierto=false) -%}
+                {%- for fila in indices -%}
+                    {%- if fila['tabla'] == patron.tabla and fila['tipo'] == tipo
+                          and (fila['columnas'] == requeridas or fila['columnas'].startswith(requeridas ~ ',')) -%}
+                        {%- set ns.cubierto = true -%}
+                    {%- endif -%}
+                {%- endfor -%}
+                {%- if not ns.cubierto -%}
+                    {%- do faltan.append(patron.tabla ~ ' (' ~ requeridas ~ ') [' ~ tipo ~ '] ← ' ~ patron.uso) -%}
+                {%- endif -%}
+            {%- endif -%}
+        {%- endfor -%}
+
+        {%- set errores = [] -%}
+        {%- if sin_tabla | length > 0 -%}
+            {%- do errores.append("Modelos construidos cuya tabla no existe:\n  - " ~ (sin_tabla | join("\n  - "))) -%}
+        {%- endif -%}
+        {%- if faltan | length > 0 -%}
+            {%- do errores.append("Consultas del backend sin índice que las soporte:\n  - " ~ (faltan | join("\n  - "))) -%}
+        {%- endif -%}
+        {%- if errores | length > 0 -%}
+            {{ exceptions.raise_compiler_error(errores | join("\n")) }}
+        {%- endif -%}
+    {%- endif -%}
+    select 1
+{%- endmacro %}
@@ -1,36 +1,88 @@
 -- int_air_quality_union.sql
+--
+-- Materialización INCREMENTAL (delete+insert por estación y hora):
+-- en cada ejecución solo se procesan las (estación, hora) que han recibido filas nuevas
+-- desde la última ejecución (marca de agua = max(ultima_ingesta) menos un margen de
+-- 'lookback_horas' para filas que lleguen tarde). Para esas claves se vuelven a leer
+-- TODAS sus filas reales y simuladas, así que el dato 'real' sigue ganando al simulado
+-- aunque uno de los dos haya llegado en una ejecución anterior.
+-- Reconstrucción completa: dbt run --full-refresh --select int_air_quality_union_hourly
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'fecha_hora_medicion'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_hora_medicion'], 'unique': True},
+            {'columns': ['ultima_ingesta']},
+            {'columns': ['fecha_hora_medicion'], 'type': 'brin'},
+        ]
+    )
+}}
 
 WITH combined_data AS (
     -- 1. Datos reales: Marcados como 'real' y con prioridad 1
-    SELECT 
+    SELECT
         *,
         'real' AS origen,
-        1 AS prioridad 
+        1 AS prioridad
     FROM {{ ref('stg_valencia_air') }}
 
     UNION ALL
 
     -- 2. Datos simulados: Marcados como 'simulated' y con prioridad 2
-    SELECT 
+    SELECT
         *,
         'simulated' AS origen,
-        2 AS prioridad 
+        2 AS prioridad
     FROM {{ ref('stg_valencia_air_historical_simulated_hourly') }}
 ),
 
+{% if is_incremental() %}
+claves_afectadas AS (
+    -- Estación y hora de las filas ingeridas después de la marca de agua
+    SELECT DISTINCT id_estacion, fecha_hora_medicion
+    FROM combined_data
+    WHERE fecha_ingesta > (
+        SELECT COALESCE(MAX(ultima_ingesta), '-infinity'::timestamptz)
+               - INTERVAL '{{ var("lookback_horas", 3) }} hours'
+        FROM {{ this }}
+    )
+),
+
+candidatos AS (
+    -- Todas las filas (reales y simuladas) de esas claves, no solo las nuevas
+    SELECT c.*
+    FROM combined_data c
+    INNER JOIN claves_afectadas k
+        ON c.id_estacion = k.id_estacion
+       AND c.fecha_hora_medicion = k.fecha_hora_medicion
+),
+{% else %}
+candidatos AS (
+    SELECT * FROM combined_data
+),
+{% endif %}
+
 deduplicated AS (
     -- 3. Identificamos duplicados (misma estación y hora) priorizando el dato 'real'
-    SELECT 
+    SELECT
         *,
         ROW_NUMBER() OVER (
-            PARTITION BY id_estacion, fecha_hora_medicion 
+            PARTITION BY id_estacion, fecha_hora_medicion
             ORDER BY prioridad ASC
-        ) AS fila_numero
-    FROM combined_data
+        ) AS fila_numero,
+        -- Ingesta más reciente de la clave (sea cual sea la fila ganadora): marca de agua
+        MAX(fecha_ingesta) OVER (
+            PARTITION BY id_estacion, fecha_hora_medicion
+        ) AS ultima_ingesta
+    FROM candidatos
 )
 
 -- 4. Selección final con la nueva columna 'origen'
-SELECT 
+SELECT
     id_estacion,
     nombre_estacion,
     'Valencia' AS ciudad,
@@ -49,6 +101,8 @@ SELECT
     longitud,
     fecha_hora_medicion,
     fecha_ingesta,
+    ultima_ingesta,
     fiware_id
 FROM deduplicated
-WHERE fila_numero = 1
\ No newline at end of file
+WHERE fila_numero = 1
+ORDER BY fecha_hora_medicion
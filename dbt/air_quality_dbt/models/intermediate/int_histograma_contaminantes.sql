@@ -0,0 +1,104 @@
+-- Histograma de mediciones por (estación, hora del día, contaminante, cubeta).
+--
+-- Es el resumen "mezclable" del que sale fct_limites_de_contaminacion: en lugar de
+-- recalcular percentile_cont sobre todo el histórico, cada ejecución solo aplica las
+-- diferencias de las mediciones pendientes de int_mediciones_contadas_histograma:
+-- +1 en su cubeta actual y -1 en la cubeta en la que estaban contadas (si lo estaban).
+-- El coste depende de lo que ha cambiado, no del tamaño del histórico. El post-hook marca
+-- esas mediciones como contadas en la misma transacción que escribe el histograma, así que
+-- repetir una ejecución (o lanzar este modelo solo) no cuenta nada dos veces. Las cubetas
+-- que se quedan sin mediciones pasan a n = 0.
+-- Reconstrucción completa: dbt run --full-refresh --select int_histograma_contaminantes
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'hora', 'contaminante', 'cubeta'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'hora', 'contaminante', 'cubeta'], 'unique': True},
+        ],
+        post_hook="""
+            update {{ ref('int_mediciones_contadas_histograma') }}
+            set contada = true,
+                {%- for contaminante in var('resolucion_histograma') %}
+                cubeta_contada_{{ contaminante }} = cubeta_{{ contaminante }},
+                {%- endfor %}
+                pendiente = false
+            where pendiente
+        """
+    )
+}}
+
+{% if is_incremental() %}
+with
+
+pendientes as (
+
+    select * from {{ ref('int_mediciones_contadas_histograma') }}
+    where pendiente
+
+),
+
+diferencias as (
+
+    -- +1 en la cubeta actual
+    select p.id_estacion, p.hora, v.contaminante, v.cubeta, 1 as delta, p.ultima_ingesta
+    from pendientes p
+    cross join lateral (values {{ valores_histograma('p.cubeta_') }}) as v(contaminante, cubeta)
+    where v.cubeta is not null
+
+    union all
+
+    -- -1 en la cubeta en la que estaba contada
+    select p.id_estacion, p.hora, v.contaminante, v.cubeta, -1 as delta, null::timestamptz as ultima_ingesta
+    from pendientes p
+    cross join lateral (values {{ valores_histograma('p.cubeta_contada_') }}) as v(contaminante, cubeta)
+    where p.contada
+      and v.cubeta is not null
+
+),
+
+netas as (
+
+    select
+        id_estacion,
+        hora,
+        contaminante,
+        cubeta,
+        sum(delta) as delta,
+        max(ultima_ingesta) as ultima_ingesta
+    from diferencias
+    group by id_estacion, hora, contaminante, cubeta
+    having sum(delta) <> 0
+
+)
+
+select
+    d.id_estacion,
+    d.hora,
+    d.contaminante,
+    d.cubeta,
+    (coalesce(h.n, 0) + d.delta)::bigint as n,
+    greatest(h.ultima_ingesta, d.ultima_ingesta) as ultima_ingesta
+from netas d
+left join {{ this }} h
+    on h.id_estacion = d.id_estacion
+   and h.hora = d.hora
+   and h.contaminante = d.contaminante
+   and h.cubeta = d.cubeta
+
+{% else %}
+select
+    m.id_estacion,
+    m.hora,
+    v.contaminante,
+    v.cubeta,
+    count(*)::bigint as n,
+    max(m.ultima_ingesta) as ultima_ingesta
+from {{ ref('int_mediciones_contadas_histograma') }} m
+cross join lateral (values {{ valores_histograma('m.cubeta_') }}) as v(contaminante, cubeta)
+where v.cubeta is not null
+group by m.id_estacion, m.hora, v.contaminante, v.cubeta
+{% endif %}
@@ -0,0 +1,74 @@
+-- Estado por medición del histograma: una fila por (estación, hora) con la cubeta de cada
+-- contaminante (cubeta_<contaminante>) y la cubeta en la que int_histograma_contaminantes
+-- la tiene contada ahora mismo (cubeta_contada_<contaminante>, 'contada').
+-- 'pendiente' marca las mediciones cuyo recuento falta por aplicar en el histograma: nuevas,
+-- o que han cambiado de cubeta (dato real que sustituye a uno simulado, correcciones).
+-- El histograma aplica solo esas diferencias y, en la misma transacción (post-hook), copia
+-- cubeta_* a cubeta_contada_* y quita 'pendiente'; aquí se conserva lo contado al sustituir
+-- una fila, así que si el histograma falla lo pendiente sigue pendiente.
+-- Reconstruirlo obliga a reconstruir también el histograma (lo contado se pierde):
+--   dbt run --full-refresh --select int_mediciones_contadas_histograma+
+
+{% set contaminantes = var('resolucion_histograma').keys() | list %}
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'fecha_hora_medicion'],
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_hora_medicion'], 'unique': True},
+            {'columns': ['pendiente']},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
+with
+
+nuevas as (
+
+    select
+        id_estacion,
+        fecha_hora_medicion,
+        extract(hour from fecha_hora_medicion)::int as hora,
+        ultima_ingesta,
+        {{ cubetas_histograma() }}
+    from {{ ref('int_air_quality_union_hourly') }}
+    where fecha_hora_medicion is not null
+    {% if is_incremental() %}
+      and ultima_ingesta > (
+          select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+                 - interval '{{ var("lookback_horas", 3) }} hours'
+          from {{ this }}
+      )
+    {% endif %}
+
+)
+
+{% if is_incremental() %}
+select
+    n.*,
+    -- Lo que ya estaba contado se mantiene hasta que el histograma aplique el cambio
+    coalesce(a.contada, false) as contada,
+    {%- for contaminante in contaminantes %}
+    a.cubeta_contada_{{ contaminante }},
+    {%- endfor %}
+    not coalesce(a.contada, false)
+    {%- for contaminante in contaminantes %}
+        or n.cubeta_{{ contaminante }} is distinct from a.cubeta_contada_{{ contaminante }}
+    {%- endfor %} as pendiente
+from nuevas n
+left join {{ this }} a
+    on a.id_estacion = n.id_estacion
+   and a.fecha_hora_medicion = n.fecha_hora_medicion
+{% else %}
+select
+    n.*,
+    false as contada,
+    {%- for contaminante in contaminantes %}
+    null::bigint as cubeta_contada_{{ contaminante }},
+    {%- endfor %}
+    true as pendiente
+from nuevas n
+{% endif %}
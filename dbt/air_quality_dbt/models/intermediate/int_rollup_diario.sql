@@ -0,0 +1,80 @@
+-- Segundo nivel de la cadena de agregados: una fila por estación y día combinando las
+-- filas de int_rollup_horario (como mucho 24 por día en lugar de todas las mediciones).
+-- Alimenta fct_air_quality_daily, fct_calidad_aire_semanal y fct_dim_estaciones.
+-- Materialización INCREMENTAL (delete+insert por estación y día): solo se recalculan los
+-- días con horas actualizadas desde la última ejecución (menos 'lookback_horas').
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'dia'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'dia'], 'unique': True},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
+with
+
+source as (
+
+    select * from {{ ref('int_rollup_horario') }}
+
+),
+
+{% if is_incremental() %}
+dias_afectados as (
+
+    select distinct
+        id_estacion,
+        fecha_hora::date as dia
+    from source
+    where ultima_ingesta > (
+        select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+               - interval '{{ var("lookback_horas", 3) }} hours'
+        from {{ this }}
+    )
+
+),
+
+filtrado as (
+
+    -- Rango de horas del día (usa el índice (id_estacion, fecha_hora) de int_rollup_horario)
+    select s.*
+    from source s
+    inner join dias_afectados d
+        on s.id_estacion = d.id_estacion
+       and s.fecha_hora >= d.dia::timestamptz
+       and s.fecha_hora < (d.dia + 1)::timestamptz
+
+),
+{% else %}
+filtrado as (
+
+    select * from source
+
+),
+{% endif %}
+
+agregados as (
+
+    select
+        fecha_hora::date as dia,
+        ciudad,
+        id_estacion,
+        max(nombre_estacion) as nombre_estacion,
+        {{ agregados_desde_rollup() }},
+        min(primera_medicion) as primera_medicion,
+        max(ultima_medicion) as ultima_medicion,
+        sum(total_mediciones)::bigint as total_mediciones,
+        max(ultima_ingesta) as ultima_ingesta
+    from filtrado
+    group by 1, 2, 3
+
+)
+
+select * from agregados
+order by dia
@@ -0,0 +1,83 @@
+-- Primer nivel de la cadena de agregados hora -> día -> semana.
+--
+-- Una fila por estación y hora con suma, número de valores, mínimo y máximo de cada
+-- contaminante (macros/rollup_contaminantes.sql). fct_air_quality_hourly e
+-- int_rollup_diario se calculan a partir de estas filas y no de las mediciones.
+-- Materialización INCREMENTAL (delete+insert por estación y hora): solo se recalculan las
+-- horas con filas nuevas en int_air_quality_union_hourly desde la última ejecución
+-- (menos 'lookback_horas' de margen), cada una entera a partir de todas sus filas.
+-- Reconstrucción completa: dbt run --full-refresh --select int_rollup_horario+
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'fecha_hora'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_hora'], 'unique': True},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
+with
+
+source as (
+
+    select * from {{ ref('int_air_quality_union_hourly') }}
+    where fecha_hora_medicion is not null
+
+),
+
+{% if is_incremental() %}
+horas_afectadas as (
+
+    select distinct
+        id_estacion,
+        date_trunc('hour', fecha_hora_medicion) as fecha_hora
+    from source
+    where ultima_ingesta > (
+        select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+               - interval '{{ var("lookback_horas", 3) }} hours'
+        from {{ this }}
+    )
+
+),
+
+filtrado as (
+
+    select s.*
+    from source s
+    inner join horas_afectadas h
+        on s.id_estacion = h.id_estacion
+       and date_trunc('hour', s.fecha_hora_medicion) = h.fecha_hora
+
+),
+{% else %}
+filtrado as (
+
+    select * from source
+
+),
+{% endif %}
+
+agregados as (
+
+    select
+        date_trunc('hour', fecha_hora_medicion) as fecha_hora,
+        ciudad,
+        id_estacion,
+        max(nombre_estacion) as nombre_estacion,
+        {{ agregados_desde_mediciones() }},
+        min(fecha_hora_medicion) as primera_medicion,
+        max(fecha_hora_medicion) as ultima_medicion,
+        count(*) as total_mediciones,
+        max(ultima_ingesta) as ultima_ingesta
+    from filtrado
+    group by 1, 2, 3
+
+)
+
+select * from agregados
+order by fecha_hora
@@ -1,57 +1,103 @@
+-- Promedios diarios por estación a partir de int_rollup_diario (cadena hora -> día -> semana)
+-- más los históricos reales diarios, que tienen prioridad cuando coinciden.
+-- Materialización INCREMENTAL (delete+insert por estación y día): solo se recalculan los
+-- días con filas nuevas en int_rollup_diario o en los históricos desde la última ejecución
+-- (menos 'lookback_horas').
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'fecha_medicion'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_medicion']},
+            {'columns': ['fecha_medicion'], 'type': 'brin'},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
 with
 
--- 1: Obtener datos horarios de intermediate
-source_hourly as (
+{% if is_incremental() %}
+marca_agua as (
 
-    select * from {{ ref('int_air_quality_union_hourly') }}
-    where fecha_hora_medicion is not null
+    select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+           - interval '{{ var("lookback_horas", 3) }} hours' as marca
+    from {{ this }}
 
 ),
 
--- 2: Agregar datos horarios a diarios
--- Calculamos promedios, picos y conteo de mediciones por día
+dias_afectados as (
+
+    select id_estacion, dia as fecha_medicion
+    from {{ ref('int_rollup_diario') }}
+    where ultima_ingesta > (select marca from marca_agua)
+
+    union
+
+    select id_estacion, fecha_hora_medicion::date
+    from {{ ref('stg_valencia_air_historical_real_daily') }}
+    where fecha_ingesta > (select marca from marca_agua)
+
+),
+{% endif %}
+
+-- 1: Días agregados a partir de las horas (promedios exactos: suma / n)
 daily_from_intermediate as (
 
     select
-        fecha_hora_medicion::date as fecha_medicion,
-        ciudad,
-        id_estacion,
-        nombre_estacion,
-        round(avg(no2)::numeric, 2)::float as promedio_diario_no2,
-        round(avg(pm10)::numeric, 2)::float as promedio_diario_pm10,
-        round(avg(pm25)::numeric, 2)::float as promedio_diario_pm25,
-        round(max(no2)::numeric, 2)::float as pico_no2,
-        round(max(pm10)::numeric, 2)::float as pico_pm10,
-        count(*) as total_mediciones_dia,
+        r.dia as fecha_medicion,
+        r.ciudad,
+        r.id_estacion,
+        r.nombre_estacion,
+        {{ promedio_rollup('no2') }} as promedio_diario_no2,
+        {{ promedio_rollup('pm10') }} as promedio_diario_pm10,
+        {{ promedio_rollup('pm25') }} as promedio_diario_pm25,
+        round(r.max_no2::numeric, 2)::float as pico_no2,
+        round(r.max_pm10::numeric, 2)::float as pico_pm10,
+        r.total_mediciones as total_mediciones_dia,
         'intermediate' as origen,
-        2 as prioridad
-    from source_hourly
-    group by 1, 2, 3, 4
+        2 as prioridad,
+        r.ultima_ingesta
+    from {{ ref('int_rollup_diario') }} r
+    {% if is_incremental() %}
+    inner join dias_afectados d
+        on r.id_estacion = d.id_estacion
+       and r.dia = d.fecha_medicion
+    {% endif %}
 
 ),
 
--- 3: Datos históricos reales diarios de Valencia (ya vienen agregados)
+-- 2: Datos históricos reales diarios de Valencia (ya vienen agregados)
 
 daily_from_historical as (
 
     select
-        fecha_hora_medicion::date as fecha_medicion,
+        h.fecha_hora_medicion::date as fecha_medicion,
         'Valencia' as ciudad,
-        id_estacion,
-        nombre_estacion,
-        round(no2::numeric, 2)::float as promedio_diario_no2,
-        round(pm10::numeric, 2)::float as promedio_diario_pm10,
-        round(pm25::numeric, 2)::float as promedio_diario_pm25,
-        round(no2::numeric, 2)::float as pico_no2,
-        round(pm10::numeric, 2)::float as pico_pm10,
+        h.id_estacion,
+        h.nombre_estacion,
+        round(h.no2::numeric, 2)::float as promedio_diario_no2,
+        round(h.pm10::numeric, 2)::float as promedio_diario_pm10,
+        round(h.pm25::numeric, 2)::float as promedio_diario_pm25,
+        round(h.no2::numeric, 2)::float as pico_no2,
+        round(h.pm10::numeric, 2)::float as pico_pm10,
         1 as total_mediciones_dia,
         'historical_real' as origen,
-        1 as prioridad
-    from {{ ref('stg_valencia_air_historical_real_daily') }}
+        1 as prioridad,
+        h.fecha_ingesta as ultima_ingesta
+    from {{ ref('stg_valencia_air_historical_real_daily') }} h
+    {% if is_incremental() %}
+    inner join dias_afectados d
+        on h.id_estacion = d.id_estacion
+       and h.fecha_hora_medicion::date = d.fecha_medicion
+    {% endif %}
 
 ),
 
--- 4: Unir ambas fuentes (ambas ya son diarias)
+-- 3: Unir ambas fuentes (ambas ya son diarias)
 
 combined_data as (
 
@@ -61,7 +107,7 @@ combined_data as (
 
 ),
 
--- 5: Deduplicar priorizando datos históricos reales (prioridad 1)
+-- 4: Deduplicar priorizando datos históricos reales (prioridad 1)
 -- Si hay duplicados por id_estacion + fecha_medicion, prevalece historical_real
 
 deduplicated as (
@@ -87,7 +133,8 @@ select
     pico_no2,
     pico_pm10,
     total_mediciones_dia,
-    origen
+    origen,
+    ultima_ingesta
 from deduplicated
 where fila_numero = 1
 order by fecha_medicion desc, ciudad
@@ -1,30 +1,64 @@
+-- Materialización INCREMENTAL (delete+insert por id_unico_hora): solo se recalculan las
+-- horas de int_rollup_horario actualizadas desde la última ejecución (menos 'lookback_horas'
+-- de margen). int_rollup_horario ya trae cada hora agregada entera, así que aquí solo se
+-- pasa de suma / n a promedio.
+-- Reconstrucción completa: dbt run --full-refresh --select fct_air_quality_hourly
+-- Índices: (id_estacion, fecha_hora) para los filtros por estación y (fecha_hora, id_estacion)
+-- para la paginación por keyset de /api/hourly-metrics sin filtro de estación.
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key='id_unico_hora',
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_unico_hora'], 'unique': True},
+            {'columns': ['id_estacion', 'fecha_hora']},
+            {'columns': ['fecha_hora', 'id_estacion']},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
 with
 
 source as (
 
-    select * from {{ ref('int_air_quality_union_hourly') }}
-    where fecha_hora_medicion is not null
+    select * from {{ ref('int_rollup_horario') }}
+    {% if is_incremental() %}
+    where ultima_ingesta > (
+        select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+               - interval '{{ var("lookback_horas", 3) }} hours'
+        from {{ this }}
+    )
+    {% endif %}
 
 ),
 
 hourly_aggregates as (
 
     select
-        date_trunc('hour', fecha_hora_medicion) as fecha_hora,
+        fecha_hora,
         ciudad,
         id_estacion,
         nombre_estacion,
-        round(avg(no2)::numeric, 2)::float as promedio_no2,
-        round(avg(pm10)::numeric, 2)::float as promedio_pm10,
-        round(avg(pm25)::numeric, 2)::float as promedio_pm25,
-        round(avg(so2)::numeric, 2)::float as promedio_so2,
-        round(avg(o3)::numeric, 2)::float as promedio_ozono,
-        round(avg(co)::numeric, 2)::float as promedio_co,
-        count(*) as total_mediciones_hora
+        {{ promedio_rollup('no2') }} as promedio_no2,
+        {{ promedio_rollup('pm10') }} as promedio_pm10,
+        {{ promedio_rollup('pm25') }} as promedio_pm25,
+        {{ promedio_rollup('so2') }} as promedio_so2,
+        {{ promedio_rollup('o3') }} as promedio_ozono,
+        {{ promedio_rollup('co') }} as promedio_co,
+        total_mediciones as total_mediciones_hora,
+        ultima_ingesta
     from source
-    group by 1, 2, 3, 4
 
 )
 
-select * from hourly_aggregates
-order by fecha_hora desc, ciudad
+select
+    -- Epoch en lugar de la hora local: no se repite en el cambio de horario de octubre
+    ciudad || '_' || id_estacion || '_' || extract(epoch from fecha_hora)::bigint as id_unico_hora,
+    *
+from hourly_aggregates
+-- Filas físicamente ordenadas por tiempo (también las que añaden las ejecuciones incrementales)
+order by fecha_hora
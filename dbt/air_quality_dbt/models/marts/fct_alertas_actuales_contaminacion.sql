@@ -1,3 +1,39 @@
+-- Materialización INCREMENTAL: cada ejecución solo evalúa las mediciones ingeridas después
+-- de la marca de agua de la ejecución anterior (menos 'lookback_horas' de margen) y añade
+-- sus alertas. Como la tabla solo guarda las mediciones que generan alerta, la marca se
+-- guarda aparte en monitoring.dbt_marcas_agua:
+--   pre-hook:  marca_pendiente = max(ingested_at) de raw en ese momento; la ejecución solo
+--              evalúa las mediciones ingeridas hasta ahí (límite superior)
+--   post-hook: marca = marca_pendiente, es decir, exactamente hasta donde se ha evaluado.
+-- Lo que se ingiere mientras el modelo se ejecuta queda para la siguiente ejecución.
+-- Reconstrucción completa: dbt run --full-refresh --select fct_alertas_actuales_contaminacion
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'fecha_hora_alerta'],
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_hora_alerta'], 'unique': True},
+            {'columns': ['fecha_hora_alerta']},
+        ],
+        pre_hook="""
+            insert into monitoring.dbt_marcas_agua (modelo, marca_pendiente, updated_at)
+            select '{{ this.name }}', max(ingested_at), current_timestamp
+            from {{ source('air_quality', 'valencia_air_real_hourly') }}
+            on conflict (modelo) do update
+            set marca_pendiente = excluded.marca_pendiente,
+                updated_at = excluded.updated_at
+        """,
+        post_hook="""
+            update monitoring.dbt_marcas_agua
+            set marca = coalesce(marca_pendiente, marca),
+                updated_at = current_timestamp
+            where modelo = '{{ this.name }}'
+        """
+    )
+}}
+
 with
 
 mediciones as (
@@ -9,6 +45,16 @@ mediciones as (
         no2, pm10, pm25, so2, o3, co
     from {{ ref('stg_valencia_air') }}
     where fecha_hora_medicion is not null
+      and fecha_ingesta <= coalesce(
+          (select marca_pendiente from monitoring.dbt_marcas_agua where modelo = '{{ this.name }}'),
+          'infinity'::timestamptz
+      )
+    {% if is_incremental() %}
+      and fecha_ingesta > coalesce(
+          (select marca from monitoring.dbt_marcas_agua where modelo = '{{ this.name }}'),
+          '-infinity'::timestamptz
+      ) - interval '{{ var("lookback_horas", 3) }} hours'
+    {% endif %}
 ),
 
 limites as (
@@ -49,4 +95,3 @@ where
     or m.so2 > l.p75_so2
     or m.o3 > l.p75_o3
     or m.co > l.p75_co
-order by fecha_hora_alerta desc
@@ -1,45 +1,117 @@
+-- Resumen semanal por estación a partir de int_rollup_diario (cadena hora -> día -> semana):
+-- como mucho 7 filas por semana en lugar de todas las mediciones, con los mismos
+-- promedios exactos (suma / n) y extremos (mínimo de mínimos, máximo de máximos).
+-- Materialización INCREMENTAL (delete+insert por estación, semana y año): solo se
+-- recalculan las semanas con días actualizados desde la última ejecución.
+-- Como antes, una semana que cruza el cambio de año da una fila por año.
+
+{{
+    config(
+        materialized='incremental',
+        incremental_strategy='delete+insert',
+        unique_key=['id_estacion', 'inicio_semana', 'anio'],
+        on_schema_change='append_new_columns',
+        indexes=[
+            {'columns': ['id_estacion', 'inicio_semana']},
+            {'columns': ['inicio_semana'], 'type': 'brin'},
+            {'columns': ['ultima_ingesta']},
+        ]
+    )
+}}
+
 with
 
 source as (
 
-    select * from {{ ref('int_air_quality_union_hourly') }}
-    where fecha_hora_medicion is not null
+    select * from {{ ref('int_rollup_diario') }}
+
+),
+
+{% if is_incremental() %}
+semanas_afectadas as (
+
+    select distinct
+        id_estacion,
+        date_trunc('week', dia)::date as lunes
+    from source
+    where ultima_ingesta > (
+        select coalesce(max(ultima_ingesta), '-infinity'::timestamptz)
+               - interval '{{ var("lookback_horas", 3) }} hours'
+        from {{ this }}
+    )
+
+),
+
+filtrado as (
+
+    select s.*
+    from source s
+    inner join semanas_afectadas w
+        on s.id_estacion = w.id_estacion
+       and s.dia >= w.lunes
+       and s.dia < w.lunes + 7
+
+),
+{% else %}
+filtrado as (
+
+    select * from source
+
+),
+{% endif %}
+
+semanas as (
+
+    select
+        date_trunc('week', dia::timestamptz) as inicio_semana,
+        date_trunc('week', dia::timestamptz) + interval '6 days' as fin_semana,
+        extract(week from dia) as numero_semana,
+        extract(year from dia) as anio,
+        id_estacion,
+        max(nombre_estacion) as nombre_estacion,
+        ciudad,
+        {{ agregados_desde_rollup() }},
+        sum(total_mediciones)::bigint as total_mediciones_semana,
+        count(*) as dias_con_datos,
+        max(ultima_ingesta) as ultima_ingesta
+    from filtrado
+    group by 1, 2, 3, 4, id_estacion, ciudad
 
 ),
 
 weekly_aggregates as (
 
     select
-        date_trunc('week', fecha_hora_medicion) as inicio_semana,
-        date_trunc('week', fecha_hora_medicion) + interval '6 days' as fin_semana,
-        extract(week from fecha_hora_medicion) as numero_semana,
-        extract(year from fecha_hora_medicion) as anio,
+        inicio_semana,
+        fin_semana,
+        numero_semana,
+        anio,
         id_estacion,
         nombre_estacion,
         ciudad,
-        round(avg(no2)::numeric, 2)::float as promedio_semanal_no2,
-        round(avg(pm10)::numeric, 2)::float as promedio_semanal_pm10,
-        round(avg(pm25)::numeric, 2)::float as promedio_semanal_pm25,
-        round(avg(so2)::numeric, 2)::float as promedio_semanal_so2,
-        round(avg(o3)::numeric, 2)::float as promedio_semanal_ozono,
-        round(avg(co)::numeric, 2)::float as promedio_semanal_co,
-        round(max(pm25)::numeric, 2)::float as maximo_pm25_semana,
-        round(max(pm10)::numeric, 2)::float as maximo_pm10_semana,
-        round(max(no2)::numeric, 2)::float as maximo_no2_semana,
-        round(min(pm25)::numeric, 2)::float as minimo_pm25_semana,
-        round(min(pm10)::numeric, 2)::float as minimo_pm10_semana,
-        round(min(no2)::numeric, 2)::float as minimo_no2_semana,
-        count(*) as total_mediciones_semana,
-        count(distinct date(fecha_hora_medicion)) as dias_con_datos,
+        {{ promedio_rollup('no2') }} as promedio_semanal_no2,
+        {{ promedio_rollup('pm10') }} as promedio_semanal_pm10,
+        {{ promedio_rollup('pm25') }} as promedio_semanal_pm25,
+        {{ promedio_rollup('so2') }} as promedio_semanal_so2,
+        {{ promedio_rollup('o3') }} as promedio_semanal_ozono,
+        {{ promedio_rollup('co') }} as promedio_semanal_co,
+        round(max_pm25::numeric, 2)::float as maximo_pm25_semana,
+        round(max_pm10::numeric, 2)::float as maximo_pm10_semana,
+        round(max_no2::numeric, 2)::float as maximo_no2_semana,
+        round(min_pm25::numeric, 2)::float as minimo_pm25_semana,
+        round(min_pm10::numeric, 2)::float as minimo_pm10_semana,
+        round(min_no2::numeric, 2)::float as minimo_no2_semana,
+        total_mediciones_semana,
+        dias_con_datos,
         case
-            when avg(pm25) is null then 'Sin Datos'
-            when avg(pm25) <= 10 then 'Semana Buena'
-            when avg(pm25) <= 15 then 'Semana Moderada'
-            when avg(pm25) <= 25 then 'Semana Pobre'
+            when n_pm25 = 0 then 'Sin Datos'
+            when suma_pm25 / n_pm25 <= 10 then 'Semana Buena'
+            when suma_pm25 / n_pm25 <= 15 then 'Semana Moderada'
+            when suma_pm25 / n_pm25 <= 25 then 'Semana Pobre'
             else 'Semana Muy Contaminada'
-        end as clasificacion_semana
-    from source
-    group by 1, 2, 3, 4, 5, 6, 7
+        end as clasificacion_semana,
+        ultima_ingesta
+    from semanas
 
 )
 
@@ -1,3 +1,12 @@
+{{
+    config(
+        indexes=[
+            {'columns': ['id_estacion', 'fecha_hora_medicion']},
+            {'columns': ['fecha_hora_medicion'], 'type': 'brin'},
+        ]
+    )
+}}
+
 with
 
 source as (
@@ -1,26 +1,46 @@
+-- Dimensión de estaciones: nombre y coordenadas de stg_estaciones (raw.estaciones, una
+-- fila por estación) y actividad a partir de int_rollup_diario (una fila por estación y
+-- día), sin recorrer todas las mediciones de int_air_quality_union_hourly.
+
+{{
+    config(
+        indexes=[
+            {'columns': ['id_estacion']},
+        ]
+    )
+}}
+
 with
 
-source as (
+actividad as (
 
-    select * from {{ ref('int_air_quality_union_hourly') }}
-    where fecha_hora_medicion is not null
+    select
+        id_estacion,
+        ciudad,
+        max(nombre_estacion) as nombre_estacion,
+        min(primera_medicion) as primera_medicion,
+        max(ultima_medicion) as ultima_medicion,
+        sum(total_mediciones)::bigint as total_mediciones
+    from {{ ref('int_rollup_diario') }}
+    group by id_estacion, ciudad
 
 ),
 
 estaciones_agregadas as (
 
     select
-        id_estacion,
-        nombre_estacion,
-        ciudad,
-        max(latitud) as latitud,
-        max(longitud) as longitud,
-        min(fecha_hora_medicion) as primera_medicion,
-        max(fecha_hora_medicion) as ultima_medicion,
-        count(*) as total_mediciones,
-        date_part('day', max(fecha_hora_medicion) - min(fecha_hora_medicion)) as dias_activa
-    from source
-    group by id_estacion, nombre_estacion, ciudad
+        a.id_estacion,
+        coalesce(e.nombre_estacion, a.nombre_estacion) as nombre_estacion,
+        a.ciudad,
+        e.latitud,
+        e.longitud,
+        a.primera_medicion,
+        a.ultima_medicion,
+        a.total_mediciones,
+        date_part('day', a.ultima_medicion - a.primera_medicion) as dias_activa
+    from actividad a
+    left join {{ ref('stg_estaciones') }} e
+        on e.id_estacion = a.id_estacion
 
 )
 
@@ -0,0 +1,50 @@
+-- Estado actual de cada estación: última fila horaria + coordenadas (1 fila por estación).
+-- Tabla diminuta pensada para servir a la API (zonas verdes, última hora, snapshot)
+-- sin recorrer todo fct_air_quality_hourly en cada petición.
+
+{{
+    config(
+        indexes=[
+            {'columns': ['id_estacion'], 'unique': True},
+            {'columns': ['indice_contaminacion']},
+        ]
+    )
+}}
+
+with
+
+ultima_hora as (
+
+    select distinct on (id_estacion)
+        *
+    from {{ ref('fct_air_quality_hourly') }}
+    order by id_estacion, fecha_hora desc
+
+),
+
+coordenadas as (
+
+    select id_estacion, latitud, longitud
+    from {{ ref('stg_estaciones') }}
+
+)
+
+select
+    u.fecha_hora,
+    u.ciudad,
+    u.id_estacion,
+    u.nombre_estacion,
+    u.promedio_no2,
+    u.promedio_pm10,
+    u.promedio_pm25,
+    u.promedio_so2,
+    u.promedio_ozono,
+    u.promedio_co,
+    u.total_mediciones_hora,
+    coalesce(u.promedio_no2, 0) + coalesce(u.promedio_pm25, 0) + coalesce(u.promedio_pm10, 0) +
+    coalesce(u.promedio_ozono, 0) + coalesce(u.promedio_so2, 0) as indice_contaminacion,
+    c.latitud,
+    c.longitud
+from ultima_hora u
+left join coordenadas c
+    on u.id_estacion = c.id_estacion
@@ -1,22 +1,97 @@
-with source as (
+-- Límites dinámicos P75 por estación y hora del día.
+--
+-- El P75 se calcula a partir de int_histograma_contaminantes (que se mantiene de forma
+-- incremental) con la misma definición que percentile_cont(0.75): posición
+-- p = 0.75 * (N - 1) sobre los valores ordenados e interpolación lineal entre los
+-- valores de las posiciones floor(p) y ceil(p). Cada valor se sustituye por el de su
+-- cubeta, así que el resultado difiere del exacto en como mucho resolución / 2
+-- (var 'resolucion_histograma'); si las mediciones ya vienen con esa resolución es exacto.
 
-    select * from {{ ref('int_air_quality_union_hourly') }}
-    where fecha_hora_medicion is not null
+{{
+    config(
+        indexes=[
+            {'columns': ['id_estacion', 'hora']},
+        ]
+    )
+}}
+
+with
+
+histograma as (
+
+    select
+        id_estacion,
+        hora,
+        contaminante,
+        cubeta * {{ resolucion_histograma('contaminante') }} as valor,
+        sum(n) over (partition by id_estacion, hora, contaminante order by cubeta) as acumulado,
+        sum(n) over (partition by id_estacion, hora, contaminante) as total
+    from {{ ref('int_histograma_contaminantes') }}
+    where n > 0
+      and contaminante <> '_filas'
+
+),
+
+posiciones as (
+
+    select *, 0.75 * (total - 1) as posicion
+    from histograma
+
+),
+
+percentiles as (
+
+    -- El valor de índice k (empezando en 0) está en la primera cubeta con acumulado > k
+    select
+        id_estacion,
+        hora,
+        contaminante,
+        min(valor) filter (where acumulado > floor(posicion)) as valor_inferior,
+        min(valor) filter (where acumulado > ceil(posicion)) as valor_superior,
+        max(posicion - floor(posicion)) as fraccion
+    from posiciones
+    group by id_estacion, hora, contaminante
+
+),
+
+p75 as (
+
+    select
+        id_estacion,
+        hora,
+        contaminante,
+        valor_inferior + fraccion * (valor_superior - valor_inferior) as p75
+    from percentiles
+
+),
+
+filas as (
+
+    select id_estacion, hora, sum(n) as total_mediciones
+    from {{ ref('int_histograma_contaminantes') }}
+    where contaminante = '_filas'
+    group by id_estacion, hora
+    having sum(n) > 0
 
 )
 
 select
-    id_estacion,
-    nombre_estacion,
-    ciudad,
-    extract(hour from fecha_hora_medicion)::int as hora,
-    round(percentile_cont(0.75) within group (order by no2)::numeric, 2)::float as p75_no2,
-    round(percentile_cont(0.75) within group (order by pm10)::numeric, 2)::float as p75_pm10,
-    round(percentile_cont(0.75) within group (order by pm25)::numeric, 2)::float as p75_pm25,
-    round(percentile_cont(0.75) within group (order by so2)::numeric, 2)::float as p75_so2,
-    round(percentile_cont(0.75) within group (order by o3)::numeric, 2)::float as p75_o3,
-    round(percentile_cont(0.75) within group (order by co)::numeric, 2)::float as p75_co,
-    count(*) as total_mediciones
-from source
-group by id_estacion, nombre_estacion, ciudad, hora
-order by id_estacion, hora
+    f.id_estacion,
+    e.nombre_estacion,
+    e.ciudad,
+    f.hora,
+    round(max(p.p75) filter (where p.contaminante = 'no2')::numeric, 2)::float as p75_no2,
+    round(max(p.p75) filter (where p.contaminante = 'pm10')::numeric, 2)::float as p75_pm10,
+    round(max(p.p75) filter (where p.contaminante = 'pm25')::numeric, 2)::float as p75_pm25,
+    round(max(p.p75) filter (where p.contaminante = 'so2')::numeric, 2)::float as p75_so2,
+    round(max(p.p75) filter (where p.contaminante = 'o3')::numeric, 2)::float as p75_o3,
+    round(max(p.p75) filter (where p.contaminante = 'co')::numeric, 2)::float as p75_co,
+    f.total_mediciones
+from filas f
+left join p75 p
+    on p.id_estacion = f.id_estacion
+   and p.hora = f.hora
+left join {{ ref('fct_estado_actual_estaciones') }} e
+    on e.id_estacion = f.id_estacion
+group by f.id_estacion, e.nombre_estacion, e.ciudad, f.hora, f.total_mediciones
+order by f.id_estacion, f.hora
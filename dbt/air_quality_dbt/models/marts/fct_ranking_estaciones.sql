@@ -1,3 +1,11 @@
+{{
+    config(
+        indexes=[
+            {'columns': ['id_estacion']},
+        ]
+    )
+}}
+
 with
 
 source as (
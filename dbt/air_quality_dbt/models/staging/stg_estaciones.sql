@@ -0,0 +1,15 @@
+-- Staging de la dimensión de estaciones (raw.estaciones)
+-- Una fila por estación: la mantienen /api/ingest y las cargas de históricos, así que
+-- las mediciones solo traen el objectid y las coordenadas ya vienen como columnas.
+
+SELECT
+    objectid AS id_estacion,
+    nombre AS nombre_estacion,
+    direccion,
+    tipozona AS tipo_zona,
+    tipoemisio AS tipo_emision,
+    latitud,
+    longitud,
+    fiwareid AS fiware_id
+
+FROM {{ source('air_quality', 'estaciones') }}
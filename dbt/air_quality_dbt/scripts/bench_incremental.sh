@@ -0,0 +1,30 @@
+#!/bin/sh
+# Compara el tiempo de la reconstrucción completa con el de una ejecución incremental
+# de int_air_quality_union_hourly y fct_air_quality_hourly.
+#
+# Ejecutar dentro del contenedor de dbt (tras haber cargado los históricos):
+#   docker compose exec dbt sh scripts/bench_incremental.sh
+#
+# Para medir un caso realista, deja que el ingestor inserte alguna hora nueva entre la
+# reconstrucción y la ejecución incremental (o lanza ésta dos veces).
+set -e
+
+MODELS="int_air_quality_union_hourly fct_air_quality_hourly"
+
+resumen() {
+    python3 - "$1" <<'PY'
+import json, sys
+with open("target/run_results.json") as f:
+    results = json.load(f)["results"]
+for r in results:
+    model = r["unique_id"].split(".")[-1]
+    rows = (r.get("adapter_response") or {}).get("rows_affected")
+    print(f"{sys.argv[1]:<14}{model:<34}{r['execution_time']:>8.2f}s  filas={rows}")
+PY
+}
+
+dbt run --select $MODELS --full-refresh --quiet
+resumen "completa"
+
+dbt run --select $MODELS --quiet
+resumen "incremental"
@@ -1,5 +1,378 @@
+"""
+Planificador de dbt dirigido por eventos.
+
+En lugar de lanzar `dbt run` a ciegas cada 5 minutos, espera a que el backend avise
+(NOTIFY raw_data_ingested) de que /api/ingest ha insertado filas nuevas en raw:
+
+- Debounce: tras el primer aviso espera DBT_DEBOUNCE_SECONDS sin avisos nuevos (como
+  mucho DBT_MAX_WAIT_SECONDS desde el primero) y lanza una sola ejecución para todos.
+- Sin cambios no hay ejecución: al arrancar, al reconectar y cada DBT_SAFETY_INTERVAL_SECONDS
+  se compara una huella de las tablas raw (max(id), max(ingested_at)) con la de la última
+  ejecución correcta, por si se perdió algún aviso mientras no había escucha.
+- Dos carriles (selectors.yml): el carril rápido (alertas, límites, estado actual) se
+  ejecuta con cada aviso; el carril lento (marts analíticos) como mucho una vez cada
+  DBT_SLOW_LANE_INTERVAL_SECONDS y solo si han llegado datos nuevos desde entonces (aunque
+  el carril rápido haya fallado).
+- Si faltan las tablas del carril lento (BD nueva, --full-refresh a mano...) se lanza un
+  `dbt run` completo en lugar de los carriles: el rápido no se ejecuta sobre un proyecto a medias.
+- Migración: los modelos que pasaron de 'table' a 'incremental' se reconstruyen una vez con
+  --full-refresh si su tabla es anterior al cambio (le falta la columna de la marca de agua).
+- Estado: GET /status (puerto DBT_SCHEDULER_PORT) devuelve la última ejecución de cada
+  carril, su duración y resultado; GET /health sirve de healthcheck del contenedor. Cada
+  ejecución también queda registrada en monitoring.dbt_ejecuciones_carril.
+
+Se ejecuta dentro del contenedor de dbt (ver docker-compose.yml).
+"""
+
+import json
+import os
+import select
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import psycopg2.extensions
+from dbt.cli.main import dbtRunner
+
+# Canal que notifica el backend al insertar filas nuevas (ver backend/ingest.py)
+RAW_INGESTED_CHANNEL = "raw_data_ingested"
+
+DEBOUNCE_SECONDS = float(os.getenv("DBT_DEBOUNCE_SECONDS", "20"))
+MAX_WAIT_SECONDS = float(os.getenv("DBT_MAX_WAIT_SECONDS", "120"))
+SAFETY_INTERVAL_SECONDS = float(os.getenv("DBT_SAFETY_INTERVAL_SECONDS", "900"))
+SLOW_LANE_INTERVAL_SECONDS = float(os.getenv("DBT_SLOW_LANE_INTERVAL_SECONDS", "3600"))
+STATUS_PORT = int(os.getenv("DBT_SCHEDULER_PORT", "8080"))
+
+
+def _argumentos_carril(selector: str, threads_env: str) -> list[str]:
+    args = ["run", "--selector", selector]
+    if os.getenv(threads_env):
+        args += ["--threads", os.getenv(threads_env)]
+    return args
+
+
+# Argumentos de dbt por carril (los hilos por defecto salen de profiles.yml)
+CARRILES = {
+    "rapido": _argumentos_carril("carril_rapido", "DBT_THREADS_RAPIDO"),
+    "lento": _argumentos_carril("carril_lento", "DBT_THREADS_LENTO"),
+    "completo": ["run"],
+    "migracion": ["run", "--full-refresh", "--select"],   # + modelos a reconstruir
+}
+
+# Modelos incrementales cuya tabla puede venir de una versión en la que eran 'table':
+# modelo -> (tabla, columna de la marca de agua o None si la marca se guarda fuera de la
+# tabla; entonces lo que delata la versión anterior es que falta el índice único de
+# unique_key). Si la tabla existe sin esa columna (o índice),
+# is_incremental() fallaría al leer la marca y dbt no añade índices a una tabla que ya existe,
+# así que se reconstruyen (junto con sus padres) con --full-refresh antes de cualquier otra ejecución.
+MODELOS_MIGRACION = {
+    "int_air_quality_union_hourly": ("intermediate.int_air_quality_union_hourly", "ultima_ingesta"),
+    "fct_air_quality_hourly": ("marts.fct_air_quality_hourly", "ultima_ingesta"),
+    "fct_air_quality_daily": ("marts.fct_air_quality_daily", "ultima_ingesta"),
+    "fct_calidad_aire_semanal": ("marts.fct_calidad_aire_semanal", "ultima_ingesta"),
+    "fct_alertas_actuales_contaminacion": ("marts.fct_alertas_actuales_contaminacion", None),
+}
+
+# Tablas que solo construye el carril lento: si falta alguna hace falta un dbt run completo
+RELACIONES_CARRIL_LENTO = (
+    "intermediate.int_rollup_diario",
+    "marts.fct_dim_estaciones",
+    "marts.fct_calidad_aire_semanal",
+    "marts.fct_ranking_estaciones",
+    "marts.fct_air_quality_daily",
+    "marts.fct_calidad_del_aire_detallado",
+)
+
+DSN = (
+    f"host={os.getenv('POSTGRES_HOST', 'db')} port={os.getenv('POSTGRES_PORT', '5432')} "
+    f"dbname={os.getenv('POSTGRES_DB')} user={os.getenv('POSTGRES_USER')} "
+    f"password={os.getenv('POSTGRES_PASSWORD')}"
+)
+
+# Huella de los datos crudos: si no cambia desde la última ejecución correcta, no hay nada que transformar
+HUELLA_SQL = """
+    SELECT
+        (SELECT max(id) FROM raw.valencia_air_real_hourly),
+        (SELECT max(ingested_at) FROM raw.valencia_air_real_hourly),
+        (SELECT max(id) FROM raw.valencia_air_historical_simulated_hourly),
+        (SELECT max(ingested_at) FROM raw.valencia_air_historical_simulated_hourly),
+        (SELECT max(id) FROM raw.valencia_air_historical_real_daily),
+        (SELECT max(ingested_at) FROM raw.valencia_air_historical_real_daily)
+"""
+
+TABLA_SIN_COLUMNA_SQL = """
+    SELECT to_regclass(%(tabla)s) IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM pg_attribute
+        WHERE attrelid = to_regclass(%(tabla)s) AND attname = %(columna)s AND NOT attisdropped
+    )
+"""
+
+TABLA_SIN_INDICE_UNICO_SQL = """
+    SELECT to_regclass(%(tabla)s) IS NOT NULL AND NOT EXISTS (
+        SELECT 1 FROM pg_index WHERE indrelid = to_regclass(%(tabla)s) AND indisunique
+    )
+"""
+
+FALTAN_RELACIONES_SQL = """
+    SELECT count(*) FROM unnest(%s::text[]) AS r(nombre) WHERE to_regclass(r.nombre) IS NULL
+"""
+
+REGISTRAR_EJECUCION_SQL = """
+    INSERT INTO monitoring.dbt_ejecuciones_carril (carril, inicio, duracion_s, resultado, motivo)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+class Estado:
+    """Estado del planificador que se expone por HTTP (protegido por un lock)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datos = {
+            "estado": "arrancando",
+            "omitidas_sin_cambios": 0,
+            "notificaciones": 0,
+            "carriles": {
+                carril: {
+                    "ultima_ejecucion": None,      # inicio (ISO 8601, UTC)
+                    "ultima_duracion_s": None,
+                    "ultimo_resultado": None,      # success | error
+                    "ultimo_motivo": None,
+                    "ejecuciones": 0,
+                }
+                for carril in CARRILES
+            },
+        }
+
+    def actualizar(self, **cambios):
+        with self._lock:
+            self._datos.update(cambios)
+
+    def actualizar_carril(self, carril: str, **cambios):
+        with self._lock:
+            self._datos["carriles"][carril].update(cambios)
+
+    def registrar_fin(self, carril: str, duracion: float, resultado: str):
+        with self._lock:
+            self._datos["estado"] = "esperando"
+            self._datos["carriles"][carril]["ejecuciones"] += 1
+            self._datos["carriles"][carril].update(ultima_duracion_s=round(duracion, 2), ultimo_resultado=resultado)
+
+    def incrementar(self, clave: str, n: int = 1):
+        with self._lock:
+            self._datos[clave] += n
+
+    def foto(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._datos))   # copia profunda
+
+
+estado = Estado()
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            self._responder(200, {"status": "ok"})
+        elif self.path == "/status":
+            self._responder(200, estado.foto())
+        else:
+            self._responder(404, {"detail": "Not found"})
+
+    def _responder(self, codigo: int, cuerpo: dict):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def log_message(self, *args):
+        pass  # sin log por petición (el healthcheck llama cada pocos segundos)
+
+
+def esperar_notificaciones(conn, timeout: float) -> int:
+    """Espera hasta timeout segundos a que lleguen NOTIFY. Retorna cuántos han llegado."""
+    if timeout > 0:
+        select.select([conn], [], [], timeout)
+    conn.poll()
+    recibidas = len(conn.notifies)
+    conn.notifies.clear()
+    if recibidas:
+        estado.incrementar("notificaciones", recibidas)
+    return recibidas
+
+
+def leer_huella(conn) -> tuple:
+    with conn.cursor() as cur:
+        cur.execute(HUELLA_SQL)
+        return tuple(cur.fetchone())
+
+
+def modelos_a_migrar(conn) -> list[str]:
+    """Modelos de MODELOS_MIGRACION cuya tabla existe pero es anterior a la versión incremental."""
+    pendientes = []
+    with conn.cursor() as cur:
+        for modelo, (tabla, columna) in MODELOS_MIGRACION.items():
+            sql = TABLA_SIN_COLUMNA_SQL if columna else TABLA_SIN_INDICE_UNICO_SQL
+            cur.execute(sql, {"tabla": tabla, "columna": columna})
+            if cur.fetchone()[0]:
+                pendientes.append(modelo)
+    return pendientes
+
+
+def faltan_relaciones_lento(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute(FALTAN_RELACIONES_SQL, (list(RELACIONES_CARRIL_LENTO),))
+        return cur.fetchone()[0] > 0
+
+
+class Planificador:
+
+    def __init__(self):
+        self._runner = dbtRunner()
+        self._ultima_huella = None
+        self._ultimo_lento = None       # time.monotonic() de la última ejecución del carril lento
+        self._lento_pendiente = False   # el carril rápido ha procesado datos que el lento aún no
+
+    def ejecutar_carril(self, conn, carril: str, motivo: str, extra: tuple = ()) -> bool:
+        """Lanza dbt con el selector del carril, registra su duración y retorna si fue bien."""
+        args = CARRILES[carril] + list(extra)
+        inicio_utc = datetime.now(timezone.utc)
+        inicio = time.monotonic()
+        estado.actualizar(estado=f"ejecutando ({carril})")
+        estado.actualizar_carril(carril, ultimo_motivo=motivo, ultima_ejecucion=inicio_utc.isoformat())
+        print(f"▶️ [{carril}] dbt {' '.join(args)} ({motivo})")
+
+        try:
+            ok = self._runner.invoke(args).success
+        except Exception as e:
+            print(f"❌ Error lanzando dbt: {e}")
+            ok = False
+
+        duracion = time.monotonic() - inicio
+        resultado = "success" if ok else "error"
+        estado.registrar_fin(carril, duracion, resultado)
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute(REGISTRAR_EJECUCION_SQL, (carril, inicio_utc, round(duracion, 3), resultado, motivo))
+        except psycopg2.errors.UndefinedTable:
+            print("⚠️ Falta monitoring.dbt_ejecuciones_carril (la crea el backend al arrancar)")
+
+        if ok:
+            print(f"✅ [{carril}] Transformación completada en {duracion:.1f}s")
+        else:
+            print(f"⚠️ [{carril}] dbt terminó con errores tras {duracion:.1f}s (se reintentará más adelante)")
+        return ok
+
+    def ejecutar(self, conn, motivo: str):
+        """
+        Carril rápido (o dbt run completo si faltan las tablas del lento). La huella se lee
+        ANTES: lo que llegue durante la ejecución dispara la siguiente. Se guarda aunque dbt
+        falle: el reintento llega con el siguiente aviso de ingesta, no en cada comprobación
+        periódica sobre los mismos datos.
+        """
+        huella = leer_huella(conn)
+        self._ultima_huella = huella
+
+        # Tablas de una versión anterior: primero se reconstruyen (una sola vez)
+        migrar = modelos_a_migrar(conn)
+        if migrar:
+            # Con sus padres (+modelo): pueden depender de modelos nuevos que aún no existen
+            padres = [f"+{modelo}" for modelo in migrar]
+            if not self.ejecutar_carril(conn, "migracion", "tablas anteriores a la versión incremental", padres):
+                return
+
+        if faltan_relaciones_lento(conn):
+            self._ultimo_lento = time.monotonic()
+            self._lento_pendiente = not self.ejecutar_carril(conn, "completo", f"{motivo}; faltan tablas del carril lento")
+            return
+
+        # Hay datos nuevos: el carril lento los procesará a su hora aunque el rápido falle
+        self._lento_pendiente = True
+        self.ejecutar_carril(conn, "rapido", motivo)
+        self.ejecutar_lento_si_toca(conn)
+
+    def ejecutar_si_hay_cambios(self, conn, motivo: str):
+        if leer_huella(conn) == self._ultima_huella:
+            estado.incrementar("omitidas_sin_cambios")
+            self.ejecutar_lento_si_toca(conn)
+            return
+        self.ejecutar(conn, motivo)
+
+    def _segundos_hasta_lento(self) -> float:
+        if not self._lento_pendiente:
+            return float("inf")
+        if self._ultimo_lento is None:
+            return 0.0
+        return SLOW_LANE_INTERVAL_SECONDS - (time.monotonic() - self._ultimo_lento)
+
+    def ejecutar_lento_si_toca(self, conn):
+        if self._segundos_hasta_lento() > 0:
+            return
+        self._ultimo_lento = time.monotonic()
+        if self.ejecutar_carril(conn, "lento", "cadencia del carril lento"):
+            self._lento_pendiente = False
+
+    def escuchar(self, conn):
+        """Bucle principal sobre una conexión con LISTEN activo."""
+        ultima_comprobacion = time.monotonic()
+        while True:
+            restante = min(
+                SAFETY_INTERVAL_SECONDS - (time.monotonic() - ultima_comprobacion),
+                self._segundos_hasta_lento(),
+            )
+            recibidas = esperar_notificaciones(conn, restante)
+
+            if recibidas:
+                # Debounce: agrupamos los avisos que lleguen seguidos en una sola ejecución
+                primera = ultima = time.monotonic()
+                while True:
+                    ahora = time.monotonic()
+                    espera = min(DEBOUNCE_SECONDS - (ahora - ultima), MAX_WAIT_SECONDS - (ahora - primera))
+                    if espera <= 0:
+                        break
+                    nuevas = esperar_notificaciones(conn, espera)
+                    if nuevas:
+                        recibidas += nuevas
+                        ultima = time.monotonic()
+                self.ejecutar(conn, f"ingesta ({recibidas} avisos)")
+                ultima_comprobacion = time.monotonic()
+
+            elif time.monotonic() - ultima_comprobacion >= SAFETY_INTERVAL_SECONDS:
+                self.ejecutar_si_hay_cambios(conn, "comprobación periódica")
+                ultima_comprobacion = time.monotonic()
+
+            else:
+                self.ejecutar_lento_si_toca(conn)
+
+    def run(self):
+        while True:
+            try:
+                conn = psycopg2.connect(DSN)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{RAW_INGESTED_CHANNEL}"')
+                print(f"👂 Escuchando '{RAW_INGESTED_CHANNEL}'")
+
+                # Al arrancar o reconectar pudo perderse algún aviso: se compara la huella
+                self.ejecutar_si_hay_cambios(conn, "arranque / reconexión")
+                estado.actualizar(estado="esperando")
+                self.escuchar(conn)
+
+            except psycopg2.Error as e:
+                print(f"⚠️ Conexión con la BD perdida ({e}). Reintentando en 5s...")
+                estado.actualizar(estado="reconectando")
+                time.sleep(5)
+
+
 def main():
-    print("Hello from dbt!")
+    servidor = ThreadingHTTPServer(("0.0.0.0", STATUS_PORT), StatusHandler)
+    threading.Thread(target=servidor.serve_forever, name="dbt-scheduler-status", daemon=True).start()
+    Planificador().run()
 
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ from dash import dcc, html, Input, Output, no_update
 from requests.exceptions import HTTPError
 import plotly.graph_objects as go
 import math
+import json
 from config import BARRIER_API_URL, FRONTEND_API_KEY
 
 
@@ -163,17 +164,15 @@ def severity_style(nivel: int):
     return ("#7f8c8d", "⚪ Sin datos")
 
 
-def fetch_alert_now(station_id: int):
+#foto completa de la estación (última hora, límites, alerta y coordenadas) en una sola llamada
+def fetch_station_snapshot(station_id: int) -> dict:
     r = requests.get(
-        f"{BARRIER_API_URL}/api/alerts/now",
-        params={"station_id": int(station_id)},
+        f"{BARRIER_API_URL}/api/station/{int(station_id)}/snapshot",
         headers={"X-API-Key": FRONTEND_API_KEY},
-        timeout=10
+        timeout=15
     )
-    if r.status_code == 404:
-        return None  # no hay alerta
     r.raise_for_status() #si backend devuelve 400/500 salta un error
-    return r.json() #convierte la respuesta JSON en dict/list de Python
+    return r.json() #convierte la respuesta JSON en dict de Python
 
 #tarjeta ranking estaciones con menor contaminación
 def menos_contaminacion(limit: int = 3) -> dict:
@@ -218,10 +217,15 @@ def choose_zoom(window: str) -> float:
 
 
 
-def fetch_hourly(limit=5000) -> pd.DataFrame:
-    r = requests.get(f"{BARRIER_API_URL}/api/hourly-metrics", params={"limit": limit}, headers={"X-API-Key": FRONTEND_API_KEY}, timeout=20)
-    r.raise_for_status()
-    return pd.DataFrame(r.json())
+def fetch_hourly(limit=5000, station_id=None) -> pd.DataFrame:
+    #el backend responde en NDJSON (una fila JSON por línea), lo leemos en streaming
+    params = {"limit": limit}
+    if station_id is not None:
+        params["station_id"] = int(station_id)
+    with requests.get(f"{BARRIER_API_URL}/api/hourly-metrics", params=params, headers={"X-API-Key": FRONTEND_API_KEY}, timeout=20, stream=True) as r:
+        r.raise_for_status()
+        rows = [json.loads(line) for line in r.iter_lines() if line]
+    return pd.DataFrame(rows)
 
 
 def fetch_history(station_id: int, days: int, metric: str) -> pd.DataFrame:
@@ -234,32 +238,6 @@ def fetch_history(station_id: int, days: int, metric: str) -> pd.DataFrame:
     r.raise_for_status()
     return pd.DataFrame(r.json())
 
-def fetch_station_latest_hourly(station_id: int) -> dict:
-    url = f"{BARRIER_API_URL}/api/station/latest-hourly"
-    r = requests.get(url, params={"station_id": station_id}, headers={"X-API-Key": FRONTEND_API_KEY}, timeout=10)
-    r.raise_for_status()
-    return r.json()
-
-def fetch_limites_estacion(station_id: int) -> dict:
-    """Obtiene los límites dinámicos (P75) para una estación específica"""
-    url = f"{BARRIER_API_URL}/api/limites/{station_id}"
-    r = requests.get(url, headers={"X-API-Key": FRONTEND_API_KEY}, timeout=10)
-    r.raise_for_status()
-    return r.json()
-
-#fetch del mapa
-def fetch_station_history(station_id: int, window: str) -> pd.DataFrame:
-    r = requests.get(
-        f"{BARRIER_API_URL}/air_quality/history",
-        params={"station_id": int(station_id), "window": window},
-        headers={"X-API-Key": FRONTEND_API_KEY},
-        timeout=15,
-    )
-    r.raise_for_status()
-    df = pd.DataFrame(r.json())
-    if "timestamp" in df.columns:
-        df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    return df
 
 #Bloques 
 
@@ -357,6 +335,7 @@ app.layout = html.Div(
         html.Div(id="status", style={"marginTop": "12px", "opacity": "0.8"}),
 
         dcc.Store(id="init", data=True),
+        dcc.Store(id="station-snapshot"),  # foto de la estación seleccionada, compartida por los callbacks
     ]
 )
 
@@ -495,25 +474,40 @@ def load_zonas_verdes(_):
     except Exception as e:
         return html.Div(f"Error: {e}", style={"color": "red", "fontSize": "12px"})
 
-#CALLBACK DEL BANNER DE ALERTA POR ZONA
+#CALLBACK SNAPSHOT: una sola llamada al backend por cambio de estación
 @app.callback(
-    Output("alert-banner", "children"),
+    Output("station-snapshot", "data"),
     Input("dd-station", "value"),
 )
-def render_banner(station_id):
+def load_station_snapshot(station_id):
     if station_id is None:
+        return None
+    try:
+        return fetch_station_snapshot(int(station_id))
+    except HTTPError as e:
+        # errores 4xx/5xx
+        return {"id_estacion": station_id, "error": f"❌ Error cargando la estación: {e}"}
+    except Exception as e:
+        return {"id_estacion": station_id, "error": f"❌ Error inesperado: {e}"}
+
+
+#CALLBACK DEL BANNER DE ALERTA POR ZONA
+@app.callback(
+    Output("alert-banner", "children"),
+    Input("station-snapshot", "data"),
+)
+def render_banner(snapshot):
+    if snapshot is None:
         return html.Div("Selecciona una estación.", style={"opacity": "0.7"})
 
-    try:
-        r = requests.get(
-            f"{BARRIER_API_URL}/api/alerts/now",
-            params={"station_id": int(station_id)},
-            headers={"X-API-Key": FRONTEND_API_KEY},
-            timeout=15
-        )
+    if snapshot.get("error"):
+        return html.Div(snapshot["error"], style={"color": "red"})
 
+    station_id = snapshot.get("id_estacion")
+    data = snapshot.get("alerta")
 
-        if r.status_code == 404:
+    try:
+        if data is None:
             return html.Div(
                 style={
                     "backgroundColor": "#34a853",
@@ -530,10 +524,6 @@ def render_banner(station_id):
                 ],
             )
 
-       
-        r.raise_for_status()
-        data = r.json()
-
         nivel = int(data.get("nivel_severidad", 0))
         color, title = severity_style(nivel)
 
@@ -553,10 +543,6 @@ def render_banner(station_id):
             ],
         )
 
-    except HTTPError as e:
-        # errores 4xx/5xx (distintos de 404)
-        return html.Div(f"❌ Error cargando alerta: {e}", style={"color": "red"})
-
     except Exception as e:
         return html.Div(f"❌ Error inesperado: {e}", style={"color": "red"})
 
@@ -564,9 +550,9 @@ def render_banner(station_id):
 @app.callback(
     Output("pollutants-bar", "figure"),
     Output("pollutants-subtitle", "children"),
-    Input("dd-station", "value"),
+    Input("station-snapshot", "data"),
 )
-def update_pollutants_bar(station_id):
+def update_pollutants_bar(snapshot):
     import plotly.graph_objects as go
 
     # --- Figura base (por si hay errores) ---
@@ -579,19 +565,20 @@ def update_pollutants_bar(station_id):
         )
         return fig
 
-    if not station_id:
+    if not snapshot:
         return empty_fig(), "Selecciona una estación para ver los contaminantes."
 
-    data = fetch_station_latest_hourly(int(station_id))
+    station_id = snapshot.get("id_estacion")
+    data = snapshot.get("ultima_hora")
     if not data:
         return empty_fig(), "No hay datos disponibles para esta estación."
 
     station_name = data.get("nombre_estacion", f"Estación {station_id}")
     measure_hour = data.get("fecha_hora", "")
 
-    # Obtener límites dinámicos de la estación
-    try:
-        limites = fetch_limites_estacion(int(station_id))
+    # Límites dinámicos de la estación (el backend ya devuelve los OMS si no hay)
+    limites = snapshot.get("limites")
+    if limites:
         # Mapear los límites del backend al formato que necesita el frontend
         VALOR_LÍMITE_DINAMICO = {
             "PM2.5": limites.get("limite_pm25"),
@@ -601,9 +588,8 @@ def update_pollutants_bar(station_id):
             "SO2": limites.get("limite_so2"),
             "CO": limites.get("limite_co"),
         }
-    except Exception as e:
-        print(f"Error cargando límites dinámicos: {e}. Usando límites OMS por defecto.")
-        # Fallback a límites OMS si falla la consulta
+    else:
+        # Fallback a límites OMS si no vienen en el snapshot
         VALOR_LÍMITE_DINAMICO = VALOR_LÍMITE.copy()
         VALOR_LÍMITE_DINAMICO["CO"] = 10.0
 
@@ -701,25 +687,23 @@ def update_pollutants_bar(station_id):
 #callback mapa
 @app.callback(
     Output("map-graph", "figure"),
-    Input("dd-station", "value"),
+    Input("station-snapshot", "data"),
     Input("time-range", "value"),
 )
-def update_map(station_id, window):
-    if not station_id:
+def update_map(snapshot, window):
+    if not snapshot:
         return no_update
 
-    df = fetch_station_history(int(station_id), window)
-    if df.empty or "lat" not in df.columns or "lon" not in df.columns:
+    station_id = snapshot.get("id_estacion")
+    coords = snapshot.get("coordenadas")
+    if not coords or coords.get("lat") is None or coords.get("lon") is None:
         return go.Figure()
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    row = df.sort_values("timestamp").iloc[-1]
-
-    lat = float(row["lat"])
-    lon = float(row["lon"])
+    lat = float(coords["lat"])
+    lon = float(coords["lon"])
 
-    # Color del círculo basado en ALERTA ACTIVA (igual que el banner)
-    alert = fetch_alert_now(int(station_id))
+    # Color del círculo basado en ALERTA ACTIVA (misma alerta que el banner)
+    alert = snapshot.get("alerta")
 
     if alert is None:
         fill_color = "rgba(52,168,83,0.30)"   # verde
@@ -1,41 +1,84 @@
-import requests
-from utils import f_llamada_api
-from config import API_KEY
+import httpx
+from utils import BackendNoDisponible, f_enviar_lote, f_paginas_api
 
-# Headers para autenticación M2M
-AUTH_HEADERS = {"X-API-Key": API_KEY}
 
-def f_run_ingestion_valencia(valencia_api_url, barrier_api_url):
+async def f_entregar_lote(client: httpx.AsyncClient, barrier_api_url, api_key, lote, huellas=None, spool=None):
     """
-    1. Obtiene datos de la API de Valencia.
-    2. Los envía a nuestra API de Barrera mediante un POST.
+    Entrega un lote al backend o, si no está disponible, lo deja en el spool en disco.
+    Mientras el spool tenga datos pendientes los lotes nuevos van detrás (se conserva el orden).
+    Retorna cuántos registros eran nuevos en el backend (0 si se han guardado en el spool).
+    """
+    nuevos = 0
+    if spool is not None and spool.pendiente():
+        spool.guardar(lote)
+        print(f"💾 Spool pendiente de reenvío: {len(lote)} registros añadidos detrás")
+    else:
+        try:
+            nuevos = await f_enviar_lote(client, barrier_api_url, api_key, lote)
+        except BackendNoDisponible as e:
+            if spool is None:
+                raise
+            spool.guardar(lote)
+            print(f"💾 Backend no disponible ({e}): {len(lote)} registros guardados en el spool")
+
+    # Aceptado por el backend o a salvo en disco: cuenta como enviado
+    if huellas is not None:
+        huellas.confirmar(lote)
+    return nuevos
+
+
+async def f_run_ingestion_valencia(client: httpx.AsyncClient, valencia_api_url, barrier_api_url, api_key,
+                                   page_size=100, batch_size=500, huellas=None, spool=None):
+    """
+    1. Recorre la API de Valencia página a página (limit/offset, ordenada por objectid).
+    2. Descarta las estaciones que no han cambiado desde el último envío (huellas).
+    3. Reenvía el resto a nuestra API de Barrera en lotes de como mucho batch_size; si el
+       backend no responde, los lotes se guardan en el spool y se reenvían más tarde.
+    En memoria solo hay un lote a la vez, así que el consumo no crece con el número de
+    estaciones. El cliente HTTP es el compartido del planificador (conexiones keep-alive).
     """
     try:
-        # --- PASO 1: Obtener datos de la fuente original ---
+        # --- PASO 1: Obtener datos de la fuente original, página a página ---
         print(f">> Conectando con Valencia_API...")
-        response = f_llamada_api(valencia_api_url, "Valencia_API")
-        data = response.json()
-        estaciones = data.get('results', [])
+        lote, recibidos, total, nuevos, lotes = [], 0, 0, 0, 0
 
-        if not estaciones:
-            print("⚠️ No se han obtenido estaciones de la API de Valencia.")
-            return
+        async for pagina in f_paginas_api(client, valencia_api_url, "Valencia_API", page_size, order_by="objectid"):
+            recibidos += len(pagina)
+
+            # --- PASO 2: Solo las estaciones que Valencia ha refrescado ---
+            if huellas is not None:
+                pagina = huellas.filtrar(pagina)
+            lote.extend(pagina)
+
+            # --- PASO 3: Enviar a nuestra API de Barrera cada lote completo ---
+            # barrier_api_url será algo como "http://backend:8000/api/ingest"
+            while len(lote) >= batch_size:
+                nuevos += await f_entregar_lote(client, barrier_api_url, api_key, lote[:batch_size], huellas, spool)
+                total += batch_size
+                lotes += 1
+                lote = lote[batch_size:]
 
-        # --- PASO 2: Enviar los datos a nuestra API de Barrera ---
-        # barrier_api_url será algo como "http://backend:8000/api/ingest"
-        print(f">> Enviando {len(estaciones)} estaciones a la API de Barrera...")
+        # El resto (último lote incompleto)
+        if lote:
+            nuevos += await f_entregar_lote(client, barrier_api_url, api_key, lote, huellas, spool)
+            total += len(lote)
+            lotes += 1
 
-        # Enviamos la lista completa de estaciones.
-        # FastAPI la validará automáticamente con la clase AirQualityInbound
-        api_response = requests.post(barrier_api_url, headers=AUTH_HEADERS, json=estaciones)
+        if not recibidos:
+            print("⚠️ No se han obtenido estaciones de la API de Valencia.")
+            return
 
-        # --- PASO 3: Verificar el resultado ---
-        if api_response.status_code == 201:
-            resultado = api_response.json()
-            print(f"✅ Éxito: {resultado.get('message')}")
-        else:
-            print(f"❌ Error en la API de Barrera (Status {api_response.status_code}): {api_response.text}")
+        # --- PASO 4: Resumen ---
+        print(f"✅ Entregadas {total} de {recibidos} estaciones en {lotes} lote(s) "
+              f"({nuevos} registros nuevos, {recibidos - total} sin cambios omitidas)")
+        if huellas is not None:
+            print(f"📊 Acumulado: {huellas.enviados} enviados, {huellas.omitidos} omitidos sin cambios")
 
     except Exception as e:
         print(f"❌ Error crítico en el flujo de ingesta: {e}")
-        raise
\ No newline at end of file
+        raise
+
+    finally:
+        # Se guardan también las huellas de los lotes confirmados antes de un error
+        if huellas is not None:
+            huellas.guardar()
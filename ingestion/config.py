@@ -3,10 +3,18 @@ import os
 # 1. Diccionario de Configuración por Ciudad
 # Centralizamos las URLs y los nombres de las tablas en un diccionario
 # Esto facilita que el orquestador (main.py) pueda hacer un bucle.
+# - interval_seconds: cada cuánto se ingesta la ciudad (por defecto DEFAULT_INTERVAL_SECONDS)
+# - api_key: API key M2M con la que la ciudad se autentica en el backend
+# - page_size: registros por página al recorrer la API de origen (limit/offset)
+# - batch_size: registros como máximo por POST al backend
 CITIES_CONFIG = {
     "valencia": {
-        "api_url": "https://valencia.opendatasoft.com/api/explore/v2.1/catalog/datasets/estacions-contaminacio-atmosferiques-estaciones-contaminacion-atmosfericas/records?limit=20",
+        "api_url": "https://valencia.opendatasoft.com/api/explore/v2.1/catalog/datasets/estacions-contaminacio-atmosferiques-estaciones-contaminacion-atmosfericas/records",
         "table_name": "raw_valencia_air",
+        "interval_seconds": 1800,
+        "api_key": os.getenv("INGESTION_VALENCIA_API_KEY"),
+        "page_size": 100,   # máximo que admite Opendatasoft por petición
+        "batch_size": 500,
         "active": True
     },
 }
@@ -14,9 +22,37 @@ CITIES_CONFIG = {
 # La URL del endpoint de ingestion de la api backend
 BARRIER_API_URL = os.getenv("BARRIER_API_URL")
 
-# API Key para autenticación M2M
-API_KEY = os.getenv("INGESTION_VALENCIA_API_KEY")
-
 # 2. Configuración Global de Ingesta
 RETRY_ATTEMPTS = 3
-TIMEOUT_SECONDS = 10
\ No newline at end of file
+TIMEOUT_SECONDS = 10
+
+# 3. Planificador (un solo proceso para todas las ciudades activas, ver main.py)
+# Intervalo de las ciudades que no definen interval_seconds
+DEFAULT_INTERVAL_SECONDS = int(os.getenv("INGESTION_DEFAULT_INTERVAL_SECONDS", "1800"))
+# Desfase aleatorio (±) de cada ejecución: evita que todas las ciudades peguen a la vez
+JITTER_SECONDS = float(os.getenv("INGESTION_JITTER_SECONDS", "30"))
+# Ingestas simultáneas como máximo (el resto espera turno)
+MAX_CONCURRENT_INGESTIONS = int(os.getenv("INGESTION_MAX_CONCURRENT", "8"))
+# Conexiones keep-alive que el cliente HTTP compartido mantiene abiertas
+HTTP_MAX_KEEPALIVE = int(os.getenv("INGESTION_HTTP_MAX_KEEPALIVE", "20"))
+
+# 4. Detección de cambios: huella (fecha_carg + hash del contenido) de lo último enviado por
+# estación, persistida en este directorio (volumen en docker-compose) para sobrevivir a reinicios
+STATE_DIR = os.getenv("INGESTION_STATE_DIR", "/ingestion/state")
+
+# 5. Spool en disco: si el backend no responde, los lotes se guardan en STATE_DIR/spool/<ciudad>
+# y se reenvían (en lotes grandes, con espera exponencial entre intentos) cuando se recupera
+BACKEND_TIMEOUT_SECONDS = float(os.getenv("INGESTION_BACKEND_TIMEOUT_SECONDS", "30"))
+SPOOL_SEGMENT_MAX_BYTES = int(os.getenv("INGESTION_SPOOL_SEGMENT_MAX_BYTES", str(8 * 1024 * 1024)))
+SPOOL_REPLAY_BATCH_SIZE = int(os.getenv("INGESTION_SPOOL_REPLAY_BATCH_SIZE", "5000"))
+SPOOL_BACKOFF_INITIAL_SECONDS = float(os.getenv("INGESTION_SPOOL_BACKOFF_INITIAL_SECONDS", "5"))
+SPOOL_BACKOFF_MAX_SECONDS = float(os.getenv("INGESTION_SPOOL_BACKOFF_MAX_SECONDS", "300"))
+SPOOL_REPLAY_TIMEOUT_SECONDS = float(os.getenv("INGESTION_SPOOL_REPLAY_TIMEOUT_SECONDS", "120"))
+
+# 6. Formato de envío al backend (Content-Type / Content-Encoding de /api/ingest):
+# json, json+gzip, msgpack o msgpack+gzip. Los lotes van en forma columnar (nombres de campo
+# una vez por lote); si el backend no admite el formato (415) se vuelve a JSON plano.
+# json+gzip es el más pequeño (benchmarks/bench_transport.py: ~253 KiB frente a ~351 KiB de
+# msgpack+gzip por 10k filas) con el mismo coste de CPU en el backend; msgpack es opcional
+# (pip install msgpack)
+WIRE_FORMAT = os.getenv("INGESTION_WIRE_FORMAT", "json+gzip")
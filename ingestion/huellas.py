@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+
+
+class HuellasEstaciones:
+    """
+    Huella de lo último que se envió al backend por estación: {objectid: [fecha_carg, hash]}.
+    Si Valencia no ha refrescado una estación (misma fecha_carg y mismo contenido) no se
+    vuelve a enviar. Se guarda en un JSON (escritura atómica) para sobrevivir a reinicios,
+    junto con los contadores acumulados de registros enviados y omitidos.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.huellas = {}
+        self.enviados = 0
+        self.omitidos = 0
+        self._cargar()
+
+    def _cargar(self):
+        try:
+            with open(self.ruta, encoding="utf-8") as f:
+                datos = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            # Un estado ilegible solo provoca un reenvío completo, no es motivo para parar
+            print(f"⚠️ No se pudo leer el estado de huellas {self.ruta} ({e}). Se envía todo.")
+            return
+        self.huellas = datos.get("huellas", {})
+        self.enviados = datos.get("enviados", 0)
+        self.omitidos = datos.get("omitidos", 0)
+
+    @staticmethod
+    def _clave(registro):
+        return str(registro.get("objectid"))
+
+    @staticmethod
+    def _huella(registro):
+        contenido = json.dumps(registro, sort_keys=True, separators=(",", ":"), default=str)
+        return [registro.get("fecha_carg"), hashlib.sha1(contenido.encode()).hexdigest()]
+
+    def filtrar(self, registros):
+        """Retorna solo los registros nuevos o cambiados desde el último envío confirmado."""
+        cambiados = [r for r in registros if self.huellas.get(self._clave(r)) != self._huella(r)]
+        self.omitidos += len(registros) - len(cambiados)
+        return cambiados
+
+    def confirmar(self, registros):
+        """Marca como enviados los registros que el backend ha aceptado."""
+        for r in registros:
+            self.huellas[self._clave(r)] = self._huella(r)
+        self.enviados += len(registros)
+
+    def guardar(self):
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"huellas": self.huellas, "enviados": self.enviados, "omitidos": self.omitidos}, f)
+        os.replace(temporal, self.ruta)
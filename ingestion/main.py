@@ -1,25 +1,47 @@
+import asyncio
 import os
+import random
 import sys
-import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from config import CITIES_CONFIG, BARRIER_API_URL
+
+import httpx
+
+from config import (
+    BARRIER_API_URL, CITIES_CONFIG, DEFAULT_INTERVAL_SECONDS, HTTP_MAX_KEEPALIVE,
+    JITTER_SECONDS, MAX_CONCURRENT_INGESTIONS, SPOOL_BACKOFF_INITIAL_SECONDS, SPOOL_BACKOFF_MAX_SECONDS,
+    SPOOL_REPLAY_BATCH_SIZE, SPOOL_REPLAY_TIMEOUT_SECONDS, SPOOL_SEGMENT_MAX_BYTES, STATE_DIR, TIMEOUT_SECONDS,
+)
 from ciudades import f_run_ingestion_valencia
+from huellas import HuellasEstaciones
+from spool import SpoolIngesta
+from utils import f_drenar_spool
 
 # Mapeo de funciones: asocia el nombre de la ciudad con su función de ingesta
 INGESTION_MAP = {
     "valencia": f_run_ingestion_valencia,
 }
 
+SPAIN_TZ = ZoneInfo("Europe/Madrid")
+
+
+def get_spain_time():
+    """Devuelve la hora actual en España"""
+    return datetime.now(SPAIN_TZ)
+
 
-def run_single_ingestion(city, settings, func):
+async def run_single_ingestion(client, city, settings, func, huellas, spool):
     """
     Ejecuta una única ingesta para la ciudad especificada.
     Retorna True si fue exitosa, False si hubo error.
     """
     print(f"--- INGESTA: {city.upper()} ---")
     try:
-        func(settings["api_url"], f"{BARRIER_API_URL}/api/ingest")
+        await func(
+            client, settings["api_url"], f"{BARRIER_API_URL}/api/ingest", settings.get("api_key"),
+            page_size=settings.get("page_size", 100), batch_size=settings.get("batch_size", 500),
+            huellas=huellas, spool=spool,
+        )
         print(f"✅ Completado: {city}")
         return True
     except Exception as e:
@@ -27,65 +49,126 @@ def run_single_ingestion(city, settings, func):
         return False
 
 
-def main():
+async def drain_spool(client, city, settings, spool):
+    """Reenvía el spool de la ciudad. Retorna True si ha quedado vacío."""
+    print(f"📤 [{city}] Reenviando spool ({len(spool.segmentos())} segmentos pendientes)")
+    try:
+        return await f_drenar_spool(
+            client, f"{BARRIER_API_URL}/api/ingest", settings.get("api_key"), spool,
+            SPOOL_REPLAY_BATCH_SIZE, SPOOL_REPLAY_TIMEOUT_SECONDS,
+        )
+    except Exception as e:
+        print(f"❌ [{city}] Error reenviando el spool: {e}")
+        return False
+
+
+async def city_loop(client, semaphore, city, settings, func):
     """
-    Ejecuta la ingesta para la ciudad especificada en la variable de entorno CITY.
-    Cada contenedor Docker define su propia variable CITY.
-    El proceso se ejecuta en un bucle infinito cada 30 minutos.
+    Bucle de una ciudad: ingesta cada interval_seconds (± JITTER_SECONDS).
+    El intervalo se mide desde el inicio de cada ingesta, así que no se va desplazando
+    con lo que tarde la propia ingesta ni con la espera por el semáforo.
+    Si quedan lotes en el spool (backend caído), entre ingestas se reintenta su reenvío con
+    espera exponencial (SPOOL_BACKOFF_INITIAL_SECONDS .. SPOOL_BACKOFF_MAX_SECONDS).
     """
-    city = os.getenv("CITY")
+    interval = settings.get("interval_seconds", DEFAULT_INTERVAL_SECONDS)
+    loop = asyncio.get_running_loop()
+    # Huella de lo último enviado por estación: solo se reenvía lo que ha cambiado
+    huellas = HuellasEstaciones(os.path.join(STATE_DIR, f"{city}.json"))
+    # Lotes que el backend no pudo recibir, pendientes de reenvío
+    spool = SpoolIngesta(os.path.join(STATE_DIR, "spool", city), SPOOL_SEGMENT_MAX_BYTES)
 
-    if not city:
-        print("ERROR: Variable de entorno CITY no definida")
-        sys.exit(1)
+    # Arranque escalonado: las ciudades no empiezan todas en el mismo instante
+    await asyncio.sleep(random.uniform(0, min(JITTER_SECONDS, interval)))
 
-    settings = CITIES_CONFIG.get(city)
-    if not settings:
-        print(f"ERROR: Ciudad '{city}' no existe en CITIES_CONFIG")
-        sys.exit(1)
+    iteration = 0
+    while True:
+        iteration += 1
+        started = loop.time()
+        print(f"\n[{city} #{iteration}] {get_spain_time().strftime('%Y-%m-%d %H:%M:%S')}")
+
+        # Como mucho MAX_CONCURRENT_INGESTIONS ciudades a la vez
+        async with semaphore:
+            # Primero lo pendiente: así los datos llegan al backend en orden
+            if spool.pendiente():
+                await drain_spool(client, city, settings, spool)
+            success = await run_single_ingestion(client, city, settings, func, huellas, spool)
+
+        delay = max(0.0, interval - (loop.time() - started) + random.uniform(-JITTER_SECONDS, JITTER_SECONDS))
+        next_run = datetime.fromtimestamp(get_spain_time().timestamp() + delay, SPAIN_TZ).strftime('%H:%M:%S')
+        if success:
+            print(f"⏳ [{city}] Próxima ingesta a las {next_run} (en {delay / 60:.1f} minutos)")
+        else:
+            print(f"⚠️ [{city}] Reintentando a las {next_run} (en {delay / 60:.1f} minutos)")
 
-    func = INGESTION_MAP.get(city)
-    if not func:
-        print(f"ERROR: No hay funcion de ingesta registrada para '{city}'")
-        sys.exit(1)
+        next_start = loop.time() + delay
+        backoff = SPOOL_BACKOFF_INITIAL_SECONDS
+        while spool.pendiente() and loop.time() + backoff < next_start:
+            await asyncio.sleep(backoff)
+            async with semaphore:
+                if not await drain_spool(client, city, settings, spool):
+                    backoff = min(backoff * 2, SPOOL_BACKOFF_MAX_SECONDS)
 
-    # Configuración del intervalo de ingesta
-    INTERVAL_SECONDS = 1800  # 30 minutos
-    SPAIN_TZ = ZoneInfo("Europe/Madrid")
+        await asyncio.sleep(max(0.0, next_start - loop.time()))
 
-    def get_spain_time():
-        """Devuelve la hora actual en España"""
-        return datetime.now(SPAIN_TZ)
 
-    print(f"🚀 Iniciando servicio de ingesta para {city.upper()}")
-    print(f"📅 Frecuencia: cada {INTERVAL_SECONDS // 60} minutos")
+def select_cities():
+    """
+    Ciudades a ingestar: las de la variable CITIES (separadas por comas) o, si no está
+    definida, todas las activas de CITIES_CONFIG. CITY (una sola ciudad) sigue funcionando.
+    """
+    requested = os.getenv("CITIES") or os.getenv("CITY")
+    if requested:
+        names = [name.strip() for name in requested.split(",") if name.strip()]
+    else:
+        names = [name for name, settings in CITIES_CONFIG.items() if settings.get("active")]
+
+    cities = {}
+    for name in names:
+        settings = CITIES_CONFIG.get(name)
+        if not settings:
+            print(f"ERROR: Ciudad '{name}' no existe en CITIES_CONFIG")
+            sys.exit(1)
+        func = INGESTION_MAP.get(name)
+        if not func:
+            print(f"ERROR: No hay funcion de ingesta registrada para '{name}'")
+            sys.exit(1)
+        cities[name] = (settings, func)
+    return cities
+
+
+async def main():
+    """
+    Ejecuta en un único proceso la ingesta de todas las ciudades seleccionadas.
+    Cada ciudad tiene su propio bucle (asyncio) con su intervalo; comparten un cliente
+    HTTP con conexiones keep-alive y un semáforo que limita las ingestas simultáneas.
+    """
+    cities = select_cities()
+    if not cities:
+        print("ERROR: No hay ciudades activas que ingestar")
+        sys.exit(1)
+
+    print(f"🚀 Iniciando servicio de ingesta para {', '.join(city.upper() for city in cities)}")
+    for city, (settings, _) in cities.items():
+        interval = settings.get("interval_seconds", DEFAULT_INTERVAL_SECONDS)
+        print(f"📅 {city}: cada {interval // 60} minutos (±{JITTER_SECONDS:.0f}s)")
+    print(f"🔀 Ingestas simultáneas como máximo: {MAX_CONCURRENT_INGESTIONS}")
     print(f"⏰ Hora de inicio: {get_spain_time().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
 
-    iteration = 0
-    while True:
-        iteration += 1
-        current_time = get_spain_time()
-        print(f"\n[Iteración #{iteration}] {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-        # Ejecutar ingesta
-        success = run_single_ingestion(city, settings, func)
-
-        # Mostrar resultado y próxima ejecución
-        next_time = datetime.now(SPAIN_TZ).timestamp() + INTERVAL_SECONDS
-        next_run = datetime.fromtimestamp(next_time, SPAIN_TZ).strftime('%H:%M:%S')
-        if success:
-            print(f"⏳ Próxima ingesta a las {next_run} (en {INTERVAL_SECONDS // 60} minutos)")
-        else:
-            print(f"⚠️ Reintentando en {INTERVAL_SECONDS // 60} minutos (a las {next_run})")
-
-        print("=" * 60)
+    # Delay para asegurar que Postgres y Backend han arrancado
+    await asyncio.sleep(5)
 
-        # Esperar antes de la siguiente iteración
-        time.sleep(INTERVAL_SECONDS)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_INGESTIONS)
+    limits = httpx.Limits(
+        max_connections=MAX_CONCURRENT_INGESTIONS * 2,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    )
+    async with httpx.AsyncClient(timeout=TIMEOUT_SECONDS, limits=limits) as client:
+        await asyncio.gather(*(
+            city_loop(client, semaphore, city, settings, func)
+            for city, (settings, func) in cities.items()
+        ))
 
 
 if __name__ == "__main__":
-    # Delay para asegurar que Postgres y Backend han arrancado
-    time.sleep(5)
-    main()
\ No newline at end of file
+    asyncio.run(main())
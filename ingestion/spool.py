@@ -0,0 +1,76 @@
+import glob
+import json
+import os
+import zlib
+
+
+class SpoolIngesta:
+    """
+    Cola en disco (solo se añade) de los lotes que no se han podido entregar al backend.
+
+    Se guarda en segmentos seg-<n>.log de como mucho max_bytes; cada línea es un registro
+    "<crc32> <json>" y cada escritura se sincroniza con fsync antes de darla por guardada.
+    Al leer, las líneas con CRC incorrecto (p. ej. la última de un segmento cortado por un
+    apagado) se descartan con aviso. Un segmento se borra cuando todo su contenido ha sido
+    aceptado por el backend; si falla a mitad se reenvía entero, lo que es seguro porque
+    /api/ingest ignora los duplicados.
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        os.makedirs(directorio, exist_ok=True)
+        # Siempre un segmento nuevo al arrancar: nunca se escribe detrás de una línea cortada
+        self._siguiente = max((self._numero(s) for s in self.segmentos()), default=0) + 1
+        self._actual = None
+
+    @staticmethod
+    def _numero(segmento):
+        return int(os.path.basename(segmento)[4:-4])
+
+    def segmentos(self):
+        """Segmentos pendientes, del más antiguo al más reciente."""
+        return sorted(glob.glob(os.path.join(self.directorio, "seg-*.log")), key=self._numero)
+
+    def pendiente(self):
+        return bool(self.segmentos())
+
+    def _segmento_escritura(self):
+        if self._actual is None or not os.path.exists(self._actual) or os.path.getsize(self._actual) >= self.max_bytes:
+            self._actual = os.path.join(self.directorio, f"seg-{self._siguiente:012d}.log")
+            self._siguiente += 1
+        return self._actual
+
+    def guardar(self, registros):
+        """Añade los registros al spool y no retorna hasta que están en disco (fsync)."""
+        lineas = []
+        for registro in registros:
+            datos = json.dumps(registro, separators=(",", ":"), default=str)
+            lineas.append(f"{zlib.crc32(datos.encode()):08x} {datos}\n")
+
+        with open(self._segmento_escritura(), "a", encoding="utf-8") as f:
+            f.write("".join(lineas))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def leer(self, segmento):
+        """Recorre los registros válidos de un segmento."""
+        with open(segmento, encoding="utf-8") as f:
+            for n, linea in enumerate(f, start=1):
+                crc, _, datos = linea.rstrip("\n").partition(" ")
+                if not linea.endswith("\n") or crc != f"{zlib.crc32(datos.encode()):08x}":
+                    print(f"⚠️ Spool: registro corrupto descartado ({os.path.basename(segmento)}, línea {n})")
+                    continue
+                yield json.loads(datos)
+
+    def confirmar(self, segmento):
+        """El backend ha aceptado todo el segmento: se borra."""
+        if segmento == self._actual:
+            self._actual = None
+        os.remove(segmento)
+
+    def apartar(self, segmento):
+        """El backend ha rechazado el segmento: se conserva como .rechazado para revisarlo a mano."""
+        if segmento == self._actual:
+            self._actual = None
+        os.replace(segmento, segmento[:-4] + ".rechazado")
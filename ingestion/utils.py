@@ -1,14 +1,164 @@
-import requests, time
+import asyncio
+import gzip
+import json
 
-def f_llamada_api(api_url, api_nombre): #Establece la conexión a una API. Devuelve el json de respuesta.
-    for i in range(10):
+import httpx
+
+try:
+    import msgpack
+except ImportError:  # opcional: solo hace falta con INGESTION_WIRE_FORMAT=msgpack[+gzip]
+    msgpack = None
+
+from config import BACKEND_TIMEOUT_SECONDS, RETRY_ATTEMPTS, WIRE_FORMAT
+
+# Opendatasoft (API explore v2.1) rechaza las peticiones con offset + limit > 10000
+MAX_OFFSET_OPENDATASOFT = 10000
+
+
+# Formato con el que se envían los lotes; pasa a "json" si el backend responde 415
+_formato_envio = WIRE_FORMAT
+if _formato_envio.startswith("msgpack") and msgpack is None:
+    print(f"⚠️ INGESTION_WIRE_FORMAT={WIRE_FORMAT} pero msgpack no está instalado. Se envía en json+gzip")
+    _formato_envio = "json+gzip"
+
+
+def f_codificar_lote(lote, formato):
+    """
+    Codifica un lote para /api/ingest. Retorna (cuerpo, cabeceras).
+    Salvo en "json", el lote va en forma columnar {"columns", "rows"}: los nombres de
+    campo una sola vez en lugar de repetidos en cada registro.
+    """
+    if formato == "json":
+        return json.dumps(lote).encode(), {"Content-Type": "application/json"}
+
+    columnas = list(dict.fromkeys(clave for registro in lote for clave in registro))
+    columnar = {"columns": columnas, "rows": [[registro.get(c) for c in columnas] for registro in lote]}
+
+    serializacion, _, compresion = formato.partition("+")
+    if serializacion == "msgpack":
+        cuerpo, cabeceras = msgpack.packb(columnar), {"Content-Type": "application/msgpack"}
+    else:
+        cuerpo, cabeceras = json.dumps(columnar).encode(), {"Content-Type": "application/json"}
+
+    if compresion == "gzip":
+        cuerpo = gzip.compress(cuerpo, compresslevel=6)
+        cabeceras["Content-Encoding"] = "gzip"
+    return cuerpo, cabeceras
+
+
+class BackendNoDisponible(Exception):
+    """El backend no ha aceptado el lote por un motivo pasajero (red, timeout, 5xx, API key...): el lote va al spool."""
+
+
+class LoteRechazado(Exception):
+    """El backend ha rechazado el contenido del lote (422): reenviarlo tal cual no serviría de nada."""
+
+
+async def f_llamada_api(client: httpx.AsyncClient, api_url, api_nombre, params=None): #Establece la conexión a una API. Devuelve la respuesta.
+    for i in range(RETRY_ATTEMPTS):
         try:
-            
-            response = requests.get(api_url)
+            response = await client.get(api_url, params=params)
+            response.raise_for_status()
             print(f"API {api_nombre} conectada con éxito")
             return response
-        
-        except requests.exceptions.RequestException as e:
-            print(f"Intento {i+1}: la API {api_nombre} aún no está lista. Esperando...")
-            time.sleep(2)
-    raise RuntimeError(f"No se pudo conectar a la API {api_nombre} tras 10 intentos")
\ No newline at end of file
+
+        except httpx.HTTPError as e:
+            print(f"Intento {i+1}: la API {api_nombre} no responde ({e}). Esperando...")
+            await asyncio.sleep(2 ** i)
+    raise RuntimeError(f"No se pudo conectar a la API {api_nombre} tras {RETRY_ATTEMPTS} intentos")
+
+
+async def f_paginas_api(client: httpx.AsyncClient, api_url, api_nombre, page_size, order_by=None):
+    """
+    Recorre una API Opendatasoft página a página (limit/offset) y devuelve cada página
+    (lista de 'results') según llega, sin acumular el conjunto completo en memoria.
+    Termina con una página incompleta o al alcanzar total_count. order_by fija el orden
+    para que ningún registro se salte ni se repita entre páginas.
+    """
+    offset = 0
+    while True:
+        limit = min(page_size, MAX_OFFSET_OPENDATASOFT - offset)
+        if limit <= 0:
+            print(f"⚠️ API {api_nombre}: alcanzado el máximo de {MAX_OFFSET_OPENDATASOFT} registros por paginación")
+            return
+
+        params = {"limit": limit, "offset": offset}
+        if order_by:
+            params["order_by"] = order_by
+        data = (await f_llamada_api(client, api_url, api_nombre, params=params)).json()
+        pagina = data.get("results", [])
+        if pagina:
+            yield pagina
+
+        offset += len(pagina)
+        if len(pagina) < limit or offset >= data.get("total_count", offset):
+            return
+
+
+async def f_enviar_lote(client: httpx.AsyncClient, barrier_api_url, api_key, lote, timeout=BACKEND_TIMEOUT_SECONDS):
+    """
+    Envía un lote de registros a la API de Barrera. Retorna cuántos registros eran nuevos.
+    Lanza LoteRechazado si el backend no ha validado el lote (422) y BackendNoDisponible con
+    cualquier otro error: también 401/403 (API key aún no sembrada o rotada) y 413, que se
+    arreglan sin tocar los datos.
+    """
+    global _formato_envio
+
+    # Autenticación M2M con la API key de la ciudad.
+    # El backend validará el lote con la clase AirQualityInbound
+    cuerpo, cabeceras = f_codificar_lote(lote, _formato_envio)
+    try:
+        api_response = await client.post(
+            barrier_api_url, headers={"X-API-Key": api_key, **cabeceras}, content=cuerpo, timeout=timeout,
+        )
+    except httpx.HTTPError as e:
+        raise BackendNoDisponible(f"{type(e).__name__}: {e}") from e
+
+    # Backend sin soporte para el formato: se pasa a JSON plano y se reintenta
+    if api_response.status_code == 415 and _formato_envio != "json":
+        print(f"⚠️ El backend no admite '{_formato_envio}' ({api_response.text}). Se envía en JSON")
+        _formato_envio = "json"
+        return await f_enviar_lote(client, barrier_api_url, api_key, lote, timeout)
+
+    if api_response.status_code == 422:
+        raise LoteRechazado(f"Lote no válido para la API de Barrera (Status 422): {api_response.text}")
+    if api_response.status_code != 201:
+        raise BackendNoDisponible(f"Status {api_response.status_code}: {api_response.text}")
+
+    resultado = api_response.json()
+    print(f"✅ Lote enviado: {resultado.get('message')}")
+    return resultado.get("insertados", 0)
+
+
+async def f_drenar_spool(client: httpx.AsyncClient, barrier_api_url, api_key, spool, batch_size, timeout):
+    """
+    Reenvía el spool en orden, segmento a segmento, en lotes de hasta batch_size registros.
+    Retorna True si ha quedado vacío y False si el backend sigue sin estar disponible.
+    Un segmento que el backend rechaza por su contenido (422) se aparta (.rechazado) para no
+    bloquear al resto; con cualquier otro error se para y el segmento sigue pendiente.
+    """
+    total = 0
+    for segmento in spool.segmentos():
+        try:
+            lote = []
+            for registro in spool.leer(segmento):
+                lote.append(registro)
+                if len(lote) >= batch_size:
+                    await f_enviar_lote(client, barrier_api_url, api_key, lote, timeout)
+                    total += len(lote)
+                    lote = []
+            if lote:
+                await f_enviar_lote(client, barrier_api_url, api_key, lote, timeout)
+                total += len(lote)
+        except BackendNoDisponible as e:
+            print(f"⚠️ Spool: el backend sigue sin responder ({e}). {total} registros reenviados")
+            return False
+        except LoteRechazado as e:
+            print(f"❌ Spool: segmento rechazado por el backend, se aparta ({e})")
+            spool.apartar(segmento)
+            continue
+        spool.confirmar(segmento)
+
+    if total:
+        print(f"✅ Spool vaciado: {total} registros reenviados")
+    return True
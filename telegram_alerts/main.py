@@ -43,12 +43,14 @@ def registrar_envio(alertas_enviadas):
     if not alertas_enviadas:
         return
     try:
-        requests.post(
+        response = requests.post(
             f"{BARRIER_API_URL}/api/alertas/registrar-envio",
             headers=AUTH_HEADERS,
             json=alertas_enviadas,
             timeout=30
         )
+        response.raise_for_status()
+        print(f"Registradas {response.json().get('alertas_registradas')} alertas nuevas de {len(alertas_enviadas)} enviadas")
     except requests.RequestException as e:
         print(f"Error registrando envío: {e}")
 